@@ -1,12 +1,59 @@
 import os
-import json
-from openai import OpenAI
+import threading
+from digest import ResultDigest
+from metrics import timed, count_tokens
 
-# Get OpenAI API key from environment
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-openai = OpenAI(api_key=OPENAI_API_KEY)
+_openai_client = None
+_openai_lock = threading.Lock()
 
-def generate_sql_query(natural_language_query, schema_info, db_type='mysql'):
+# Upper bound on the (estimated) tokens spent on the result in the explanation prompt
+RESULT_DIGEST_TOKEN_BUDGET = int(os.environ.get("RESULT_DIGEST_TOKEN_BUDGET", 1500))
+
+def get_openai_client():
+    """
+    Return the shared OpenAI client, creating it on first use
+
+    The openai package is slow to import, so it is only loaded once a
+    request actually needs the model.
+    """
+    global _openai_client
+    if _openai_client is None:
+        # Get OpenAI API key from environment
+        api_key = os.environ.get("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
+        with _openai_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=api_key)
+    return _openai_client
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+def describe_result(result, token_budget=RESULT_DIGEST_TOKEN_BUDGET):
+    """Render a query result (or a ResultDigest of it) as prompt text within a token budget"""
+    digest = result if isinstance(result, ResultDigest) else ResultDigest.from_result(result)
+    # Drop sample rows, then columns, until the description fits
+    for sample_rows, max_columns in ((digest.sample_size, 40), (10, 40), (5, 20), (0, 20), (0, 5)):
+        text = digest.describe(sample_rows=sample_rows, max_columns=max_columns)
+        if estimate_tokens(text) <= token_budget:
+            return text
+    return text[:token_budget * 4]
+
+def describe_table(table_name, columns):
+    """Format one table of the schema the way it appears in the SQL generation prompt"""
+    description = f"Table: {table_name}\n"
+    description += "Columns:\n"
+    for column in columns:
+        description += f"  - {column['Field']} ({column['Type']})"
+        if column.get('Key') == 'PRI':
+            description += " PRIMARY KEY"
+        description += "\n"
+    return description + "\n"
+
+def generate_sql_query(natural_language_query, schema_info, db_type='mysql', join_paths=None):
     """
     Generate SQL query from natural language using OpenAI API
 
@@ -14,24 +61,19 @@ def generate_sql_query(natural_language_query, schema_info, db_type='mysql'):
         natural_language_query (str): User's question in natural language
         schema_info (dict): Database schema information
         db_type (str): Database type ('mysql' or 'postgresql')
+        join_paths (str): Foreign-key join paths between the tables, one per line (optional)
 
     Returns:
         str: Generated SQL query
     """
-    if not OPENAI_API_KEY:
-        raise ValueError("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
+    openai = get_openai_client()
 
     # Format the schema information for the prompt
     schema_description = ""
     for table_name, columns in schema_info.items():
-        schema_description += f"Table: {table_name}\n"
-        schema_description += "Columns:\n"
-        for column in columns:
-            schema_description += f"  - {column['Field']} ({column['Type']})"
-            if column.get('Key') == 'PRI':
-                schema_description += " PRIMARY KEY"
-            schema_description += "\n"
-        schema_description += "\n"
+        schema_description += describe_table(table_name, columns)
+    if join_paths:
+        schema_description += f"Join paths (foreign keys; join on exactly these columns):\n{join_paths}\n"
 
     # Adjust syntax guidance based on database type
     syntax_guide = "MySQL" if db_type.lower() == 'mysql' else "PostgreSQL"
@@ -51,20 +93,76 @@ Convert this natural language question into a valid, clean, and properly formatt
 """
 
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an expert SQL developer that converts natural language to valid SQL."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,  # Lower temperature for more deterministic output
-        )
+        with timed('generate'):
+            response = openai.chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": "You are an expert SQL developer that converts natural language to valid SQL."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.1,  # Lower temperature for more deterministic output
+            )
+        count_tokens("gpt-4o", response.usage)
 
         return response.choices[0].message.content.strip()
 
     except Exception as e:
         raise Exception(f"Error generating SQL query: {str(e)}")
 
+def repair_sql_query(natural_language_query, schema_info, sql_query, error, db_type='mysql'):
+    """
+    Ask the model to fix SQL that failed local validation
+
+    A short, low-temperature call to the fast model: it sees the relevant
+    schema, the broken SQL and the validation error.
+
+    Args:
+        natural_language_query (str): User's question in natural language
+        schema_info (dict): Database schema information
+        sql_query (str): The SQL that failed validation
+        error (str): Why it failed
+        db_type (str): Database type ('mysql' or 'postgresql')
+
+    Returns:
+        str: Corrected SQL query
+    """
+    openai = get_openai_client()
+
+    schema_description = "".join(describe_table(table_name, columns) for table_name, columns in schema_info.items())
+    syntax_guide = "MySQL" if db_type.lower() == 'mysql' else "PostgreSQL"
+
+    prompt = f"""
+Database schema:
+
+{schema_description}
+
+Question: "{natural_language_query}"
+
+This {syntax_guide} query was written for the question but is invalid:
+{sql_query}
+
+Problem: {error}
+
+Return only the corrected {syntax_guide} query, using only tables and columns from the schema. No explanations, code blocks or markdown.
+"""
+
+    try:
+        with timed('repair'):
+            response = openai.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You fix invalid SQL queries."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0,
+            )
+        count_tokens("gpt-4o-mini", response.usage)
+
+        return response.choices[0].message.content.strip()
+
+    except Exception as e:
+        raise Exception(f"Error repairing SQL query: {str(e)}")
+
 def generate_natural_language_result(natural_language_query, sql_query, result):
     """
     Generate natural language explanation of query results
@@ -72,16 +170,63 @@ def generate_natural_language_result(natural_language_query, sql_query, result):
     Args:
         natural_language_query (str): Original user question
         sql_query (str): Generated SQL query
-        result (list/dict): Result of SQL query execution
+        result (list/dict/ResultDigest): Result of SQL query execution, or a digest of it
 
     Returns:
         str: Natural language explanation of results
     """
-    if not OPENAI_API_KEY:
-        raise ValueError("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
+    openai = get_openai_client()
+
+    try:
+        with timed('explain'):
+            response = openai.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=_explanation_messages(natural_language_query, sql_query, result),
+            )
+        count_tokens("gpt-4o-mini", response.usage)
+
+        return response.choices[0].message.content.strip()
 
-    # Convert result to string representation
-    result_str = json.dumps(result, indent=2)
+    except Exception as e:
+        raise Exception(f"Error generating natural language explanation: {str(e)}")
+
+def stream_natural_language_result(natural_language_query, sql_query, result):
+    """
+    Stream a natural language explanation of query results as it is generated
+
+    Args:
+        natural_language_query (str): Original user question
+        sql_query (str): Generated SQL query
+        result (list/dict/ResultDigest): Result of SQL query execution, or a digest of it
+
+    Yields:
+        str: Successive fragments of the explanation text
+    """
+    openai = get_openai_client()
+
+    try:
+        # Timed until the last fragment, including the time the caller spends forwarding each one
+        with timed('explain'):
+            stream = openai.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=_explanation_messages(natural_language_query, sql_query, result),
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                # The final chunk carries the token usage and no choices
+                count_tokens("gpt-4o-mini", getattr(chunk, 'usage', None))
+
+    except Exception as e:
+        raise Exception(f"Error generating natural language explanation: {str(e)}")
+
+def _explanation_messages(natural_language_query, sql_query, result):
+    """Build the chat messages asking the model to explain a query result"""
+    # Summarize the result within a fixed token budget instead of pasting every row
+    result_str = describe_result(result)
 
     # Create prompt for OpenAI
     prompt = f"""
@@ -89,22 +234,13 @@ I generated the following SQL query based on this question:
 Question: "{natural_language_query}"
 SQL Query: {sql_query}
 
-The query produced these results:
+The query produced these results (summarized):
 {result_str}
 
 Please explain these results in natural language. Use a friendly, concise tone. Include specific data points from the results but don't simply list everything. Focus on answering the original question in a way that would be helpful to someone who doesn't know SQL.
 """
 
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert at explaining database query results in plain language."},
-                {"role": "user", "content": prompt}
-            ],
-        )
-
-        return response.choices[0].message.content.strip()
-
-    except Exception as e:
-        raise Exception(f"Error generating natural language explanation: {str(e)}")
+    return [
+        {"role": "system", "content": "You are an expert at explaining database query results in plain language."},
+        {"role": "user", "content": prompt}
+    ]
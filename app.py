@@ -1,74 +1,89 @@
-import os
+import json
 import logging
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-from flask import Flask
+import click
+from flask import Flask, render_template
 from werkzeug.middleware.proxy_fix import ProxyFix
+from config import load_config
 from extensions import db, csrf, login_manager, jwt
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
-
-# Create app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-# Configure database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///app.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", "dev-jwt-secret")
-
-# Initialize extensions with app
-db.init_app(app)
-
-# Add custom Jinja2 filters
-@app.template_filter('from_json')
-def from_json_filter(value):
-    import json
-    return json.loads(value) if value else []
-csrf.init_app(app)
-login_manager.init_app(app)
-login_manager.login_view = 'auth.login'
-jwt.init_app(app)
-
-# Create all tables
-with app.app_context():
-    # Import models to ensure they're registered with SQLAlchemy
-    import models
-    
-    db.create_all()
-
-# Register blueprints
-from auth import auth_bp
-from database import db_bp
-
-app.register_blueprint(auth_bp)
-app.register_blueprint(db_bp)
-
-# Root route
-@app.route('/')
-def index():
-    from flask import render_template
-    return render_template('index.html')
-
-# Error handlers
-@app.errorhandler(404)
-def page_not_found(e):
-    from flask import render_template
-    return render_template('base.html', error="Page not found"), 404
-
-@app.errorhandler(500)
-def server_error(e):
-    from flask import render_template
-    return render_template('base.html', error="Internal server error"), 500
+def create_app(config=None):
+    """
+    Create and configure the Flask application
+
+    Nothing heavy happens at import time: settings are read here, blueprints
+    are imported here, database tables are created by the `flask init-db`
+    command rather than on every boot, and the OpenAI client is only built on
+    first use (see ai.get_openai_client). config overrides loaded settings.
+    """
+    app = Flask(__name__)
+    app.config.update(load_config())
+    if config:
+        app.config.update(config)
+    app.secret_key = app.config["SECRET_KEY"]
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+    # Configure logging unless the host (e.g. gunicorn) already did
+    logging.basicConfig(level=app.config["LOG_LEVEL"])
+
+    # Initialize extensions with app
+    db.init_app(app)
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    login_manager.login_view = 'auth.login'
+    jwt.init_app(app)
+
+    # Add custom Jinja2 filters
+    @app.template_filter('from_json')
+    def from_json_filter(value):
+        return json.loads(value) if value else []
+
+    # Register blueprints (imported here so their dependencies load after the config)
+    from auth import auth_bp
+    from database import db_bp
+    from metrics import metrics_bp
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(db_bp)
+    app.register_blueprint(metrics_bp)
+
+    from jobs import job_queue
+    job_queue.init_app(app)
+
+    from batch import batch_runner
+    batch_runner.init_app(app)
+
+    from monitor import connection_monitor
+    connection_monitor.init_app(app)
+
+    # Root route
+    @app.route('/')
+    def index():
+        return render_template('index.html')
+
+    # Error handlers
+    @app.errorhandler(404)
+    def page_not_found(e):
+        return render_template('base.html', error="Page not found"), 404
+
+    @app.errorhandler(500)
+    def server_error(e):
+        return render_template('base.html', error="Internal server error"), 500
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create any missing database tables."""
+        init_db(app)
+        click.echo("Database tables created.")
+
+    return app
+
+def init_db(app):
+    """Create the tables of all models that don't exist yet"""
+    with app.app_context():
+        # Import models to ensure they're registered with SQLAlchemy
+        import models
+
+        db.create_all()
 
 # Load user from user_id
 @login_manager.user_loader
@@ -77,4 +92,4 @@ def load_user(user_id):
     return User.query.get(int(user_id))
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000, debug=True)
+    create_app().run(host='0.0.0.0', port=8000, debug=True)
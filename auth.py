@@ -49,6 +49,9 @@ def login():
         user = User.query.filter_by(username=form.username.data).first()
         if user and user.check_password(form.password.data):
             login_user(user)
+            # Open pooled connections and load schemas before the first question
+            from monitor import connection_monitor
+            connection_monitor.warm_up_user(user.id)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('db_bp.dashboard'))
         flash('Invalid username or password', 'danger')
@@ -0,0 +1,118 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from extensions import db
+from models import DatabaseConnection
+from pipeline import run_query_pipeline, PipelineError
+from pool import POOL_MAX_SIZE
+from scheduler import EXECUTION_MAX_CONCURRENT, EXECUTION_USER_CONCURRENCY, EXECUTION_QUEUE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Defaults follow the limits further down (0 in the scheduler means no limit). A user
+# gets as many questions in flight as the scheduler lets them run on one database,
+# and no more than one connection pool holds; more would only queue there and time out.
+DEFAULT_USER_CONCURRENCY = min(EXECUTION_USER_CONCURRENCY or POOL_MAX_SIZE, POOL_MAX_SIZE)
+# Shared threads: enough for a few databases running at their limit at once
+DEFAULT_WORKERS = 4 * min(EXECUTION_MAX_CONCURRENT or POOL_MAX_SIZE, POOL_MAX_SIZE)
+
+class BatchRunner:
+    """
+    Answers a list of questions against one connection concurrently
+
+    The schema is looked up once per batch; each question then runs the full
+    query pipeline (generation, pre-flight, execution over the connection's
+    pool, explanation and saving) on a shared, bounded thread pool
+    (BATCH_WORKERS), so a batch takes about as long as its slowest question.
+    A user has at most BATCH_USER_CONCURRENCY questions in flight across all
+    of their batches; further questions wait for a slot, for at most
+    BATCH_SLOT_TIMEOUT seconds, after which the rest of the batch is reported
+    busy. The thread pool is created on first use so it is never created
+    before gunicorn forks.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._slots = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = int(app.config.get('BATCH_WORKERS') or DEFAULT_WORKERS)
+        self.user_concurrency = int(app.config.get('BATCH_USER_CONCURRENCY') or DEFAULT_USER_CONCURRENCY)
+        self.slot_timeout = float(app.config.get('BATCH_SLOT_TIMEOUT') or EXECUTION_QUEUE_TIMEOUT)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='query-batch')
+            return self._executor
+
+    def _user_slots(self, user_id):
+        with self._lock:
+            if user_id not in self._slots:
+                self._slots[user_id] = threading.BoundedSemaphore(self.user_concurrency)
+            return self._slots[user_id]
+
+    def run(self, connection, questions, schema_info, user_id, bypass_cache=False):
+        """
+        Run each question through the query pipeline and return the per-question payloads in order
+
+        Questions that got no slot within the timeout get a busy payload
+        ({'busy': True, 'retry_after': seconds}) instead of running.
+        """
+        executor = self._get_executor()
+        slots = self._user_slots(user_id)
+        futures = []
+        busy = None
+        for question in questions:
+            # Waits here, rather than in a pool thread, when the user is at their limit
+            if busy is None and not slots.acquire(timeout=self.slot_timeout):
+                busy = {
+                    'success': False,
+                    'error': "Too many of your questions are already running. Please try again shortly.",
+                    'busy': True,
+                    'retry_after': max(1, int(self.slot_timeout) // 2)
+                }
+            if busy is not None:
+                futures.append(None)
+                continue
+            future = executor.submit(self._answer, connection.id, question, schema_info, bypass_cache)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+
+        results = []
+        for index, (question, future) in enumerate(zip(questions, futures)):
+            result = future.result() if future is not None else dict(busy)
+            result.update(index=index, question=question)
+            results.append(result)
+        return results
+
+    def _answer(self, conn_id, question, schema_info, bypass_cache):
+        started = time.monotonic()
+        try:
+            with self.app.app_context():
+                try:
+                    # Loaded in this thread's session; model instances aren't shared between threads
+                    connection = db.session.get(DatabaseConnection, conn_id)
+                    payload = run_query_pipeline(connection, question, bypass_cache, schema_info=schema_info)
+                except PipelineError as e:
+                    db.session.rollback()
+                    payload = dict(e.payload)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception("Batch question failed: %s", question)
+                    payload = {'success': False, 'error': f"An unexpected error occurred: {str(e)}"}
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            payload = {'success': False, 'error': f"An unexpected error occurred: {str(e)}"}
+        payload['elapsed'] = round(time.monotonic() - started, 3)
+        return payload
+
+# Shared batch runner, bound to the app in app.py
+batch_runner = BatchRunner()
@@ -0,0 +1,124 @@
+"""
+Startup benchmark for the web app
+
+Measures, in fresh interpreter processes, how long a worker takes to import
+the app module, run create_app() and answer its first request, and how much
+memory it uses. It then simulates gunicorn --preload: the app is created once
+in a parent process which forks workers, and each worker reports the memory it
+does not share with the parent after serving a request.
+
+    python bench_startup.py [--runs 5] [--workers 4]
+
+Memory figures come from /proc and are only available on Linux.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in a fresh interpreter and prints one JSON line of timings and memory
+_COLD_START = r"""
+import json, os, sys, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app = app_module.create_app()
+created = time.perf_counter()
+response = app.test_client().get('/')
+served = time.perf_counter()
+sys.path.insert(0, {here!r})
+from bench_startup import read_memory
+print(json.dumps(dict(
+    import_ms=(imported - started) * 1000,
+    create_app_ms=(created - imported) * 1000,
+    first_request_ms=(served - created) * 1000,
+    total_ms=(served - started) * 1000,
+    status=response.status_code,
+    modules=len(sys.modules),
+    **read_memory()
+)))
+"""
+
+# Creates the app once, then forks workers that each serve a request
+_PRELOAD = r"""
+import json, os, sys
+sys.path.insert(0, {here!r})
+from bench_startup import read_memory
+import app as app_module
+app = app_module.create_app()
+parent = read_memory()
+results = []
+for _ in range({workers}):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        app.test_client().get('/')
+        os.write(write_fd, json.dumps(read_memory()).encode())
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        results.append(json.loads(pipe.read() or '{{}}'))
+    os.waitpid(pid, 0)
+print(json.dumps({{'parent': parent, 'workers': results}}))
+"""
+
+def read_memory():
+    """Resident, proportional and private memory of this process in KiB (Linux only)"""
+    memory = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                    memory[name.lower() + '_kb'] = int(value.split()[0])
+    except OSError:
+        pass
+    if 'private_clean_kb' in memory:
+        memory['private_kb'] = memory.pop('private_clean_kb') + memory.pop('private_dirty_kb')
+    return memory
+
+def _run(code):
+    env = dict(os.environ)
+    # A throwaway database and a placeholder key keep the benchmark self-contained
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    env.setdefault('OPENAI_API_KEY', 'benchmark')
+    output = subprocess.run([sys.executable, '-c', code], cwd=HERE, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def _summary(values):
+    return f"median {statistics.median(values):8.1f}  min {min(values):8.1f}  max {max(values):8.1f}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='cold starts to measure')
+    parser.add_argument('--workers', type=int, default=4, help='workers to fork in the preload simulation')
+    args = parser.parse_args()
+
+    runs = [_run(_COLD_START.format(here=HERE)) for _ in range(args.runs)]
+    print(f"Cold worker start ({args.runs} runs)")
+    for key, label in (('import_ms', 'import app (ms)'), ('create_app_ms', 'create_app (ms)'),
+                       ('first_request_ms', 'first request (ms)'), ('total_ms', 'total (ms)'),
+                       ('rss_kb', 'RSS (KiB)')):
+        values = [run[key] for run in runs if key in run]
+        if values:
+            print(f"  {label:<20} {_summary(values)}")
+    print(f"  {'modules loaded':<20} {runs[-1]['modules']}")
+
+    if hasattr(os, 'fork'):
+        preload = _run(_PRELOAD.format(here=HERE, workers=args.workers))
+        workers = [worker for worker in preload['workers'] if 'private_kb' in worker]
+        print(f"Preload and fork ({args.workers} workers)")
+        if 'rss_kb' in preload['parent']:
+            print(f"  {'parent RSS (KiB)':<20} {preload['parent']['rss_kb']:8d}")
+        if workers:
+            print(f"  {'worker private (KiB)':<20} {_summary([w['private_kb'] for w in workers])}")
+            print(f"  {'worker PSS (KiB)':<20} {_summary([w['pss_kb'] for w in workers])}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import time
+import threading
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a time-to-live
+
+    With maxbytes set, entries are stored with a caller-supplied size and the
+    least recently used ones are evicted until the total fits.
+    """
+
+    def __init__(self, maxsize=128, ttl=300, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._data = OrderedDict()  # key -> (value, stored_at, expires_at, size)
+        self._lock = threading.Lock()
+
+    def get_with_age(self, key):
+        """Return (value, age_in_seconds) for a live entry, or (None, None)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[2] is not None and entry[2] <= now):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0], now - entry[1]
+
+    def get(self, key, default=None):
+        value, age = self.get_with_age(key)
+        return default if age is None else value
+
+    def set(self, key, value, ttl=None, size=0):
+        """
+        Store a value; ttl overrides the cache default (0 or None in both means no expiry)
+
+        size is the entry's weight against maxbytes. A value larger than
+        maxbytes on its own is not stored.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = (value, now, now + ttl if ttl else None, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        # Caller holds the lock
+        self.bytes -= self._data.pop(key)[3]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data[key][0]
+            self._remove(key)
+        return value
+
+    def discard_where(self, predicate):
+        """Remove every entry whose key matches the predicate, returning how many were removed"""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        stats = {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+        if self.maxbytes is not None:
+            stats.update({'bytes': self.bytes, 'maxbytes': self.maxbytes})
+        return stats
@@ -0,0 +1,51 @@
+import os
+from dotenv import load_dotenv
+
+def load_config():
+    """
+    Read the settings shared by the web app, CLI commands and migrations
+
+    Values come from the environment, after loading a .env file if there is
+    one. Modules that read their own settings with os.environ.get (pool.py,
+    metrics.py, the caches) are imported by create_app after this runs, so
+    they see .env values too.
+    """
+    load_dotenv()
+    return {
+        "SECRET_KEY": os.environ.get("SESSION_SECRET", "dev-secret-key"),
+        "SQLALCHEMY_DATABASE_URI": os.environ.get("DATABASE_URL", "sqlite:///app.db"),
+        "SQLALCHEMY_ENGINE_OPTIONS": {
+            "pool_recycle": 300,
+            "pool_pre_ping": True,
+        },
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "dev-jwt-secret"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "INFO").upper(),
+
+        # Streaming query execution: hard cap on rows returned and rows fetched per batch
+        "QUERY_MAX_ROWS": int(os.environ.get("QUERY_MAX_ROWS", 100000)),
+        "QUERY_STREAM_BATCH_SIZE": int(os.environ.get("QUERY_STREAM_BATCH_SIZE", 500)),
+        # Preview-first queries: rows returned right away before the full result is fetched in the background
+        "QUERY_PREVIEW_ROWS": int(os.environ.get("QUERY_PREVIEW_ROWS", 50)),
+
+        # Background query jobs: worker threads per process, queue bound and event polling
+        "JOB_WORKERS": int(os.environ.get("JOB_WORKERS", 4)),
+        "JOB_QUEUE_SIZE": int(os.environ.get("JOB_QUEUE_SIZE", 100)),
+        "JOB_EVENT_POLL_INTERVAL": float(os.environ.get("JOB_EVENT_POLL_INTERVAL", 0.25)),
+        # Seconds one job event stream stays open before the browser reconnects; keep it
+        # well below the gunicorn worker timeout (30 s by default)
+        "JOB_EVENT_STREAM_SECONDS": int(os.environ.get("JOB_EVENT_STREAM_SECONDS", 15)),
+
+        # Batch questions: questions per request, worker threads per process, questions in flight per
+        # user and seconds a question waits for one of the user's slots. Unset, the last three follow
+        # the connection pool size and the execution scheduler's limits (see batch.py).
+        "BATCH_MAX_QUESTIONS": int(os.environ.get("BATCH_MAX_QUESTIONS", 50)),
+        "BATCH_WORKERS": os.environ.get("BATCH_WORKERS"),
+        "BATCH_USER_CONCURRENCY": os.environ.get("BATCH_USER_CONCURRENCY"),
+        "BATCH_SLOT_TIMEOUT": os.environ.get("BATCH_SLOT_TIMEOUT"),
+
+        # Connection health monitor: seconds between pings (0 disables), ping checkout timeout and ping threads
+        "HEALTH_CHECK_INTERVAL": int(os.environ.get("HEALTH_CHECK_INTERVAL", 60)),
+        "HEALTH_CHECK_TIMEOUT": float(os.environ.get("HEALTH_CHECK_TIMEOUT", 5)),
+        "HEALTH_CHECK_WORKERS": int(os.environ.get("HEALTH_CHECK_WORKERS", 4)),
+    }
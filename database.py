@@ -1,19 +1,64 @@
 import pymysql
 import psycopg2
 import psycopg2.extras
+import psycopg2.errors
 import json
 import os
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+import time
+import logging
+import hmac
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event, or_, and_
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, Response, stream_with_context, current_app, session
 from flask_login import login_required, current_user
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, IntegerField, SubmitField, TextAreaField, SelectField
-from wtforms.validators import DataRequired, NumberRange, Length
-from models import DatabaseConnection, Query
+from wtforms import StringField, PasswordField, IntegerField, FloatField, SubmitField, TextAreaField, SelectField, BooleanField
+from wtforms.validators import DataRequired, NumberRange, Length, Optional
+from models import DatabaseConnection, Query, QueryJob
 from extensions import db
-from ai import generate_sql_query, generate_natural_language_result
+from pool import pool_manager, open_connection, CONNECT_TIMEOUT
+from scheduler import execution_scheduler, ExecutionBusy
+from preflight import preflight_query, apply_statement_timeout, statement_timeout_error, inject_limit, PreflightRejected
+from schema_cache import get_cached_schema, get_cached_fingerprint, invalidate_schema
+from result_store import ResultWriter, store_result, load_result_page, load_result_summary, result_columns_of
+from digest import ResultDigest
+from result_set import ResultSet, dumps
+from ai import generate_natural_language_result, stream_natural_language_result
+from generation_cache import get_generated_sql, invalidate_generated_sql
+from sql_validation import SQLValidationError, classify_statement, is_read_statement, CURSOR_STATEMENTS
+from result_cache import get_cached_result, cache_result, invalidate_results, RESULT_CACHE_MAX_ROWS
+from schema_index import invalidate_schema_index
+from join_graph import get_join_graph, invalidate_join_graph
+from pipeline import run_query_pipeline, PipelineError, QueryCancelled
+from jobs import job_queue, QueueFull
+from batch import batch_runner
+from monitor import connection_monitor
+from export import export_rows, StoredRowStream, ExportUnavailable, EXPORT_FORMATS, EXPORT_BATCH_SIZE
+from metrics import timed, record_stage, count_rows, count_error
+
+logger = logging.getLogger(__name__)
 
 db_bp = Blueprint('db_bp', __name__)
 
+# Queries shown per page of a connection's history
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 20))
+# Seconds a successful "Test Connection" lets the connect form skip its own connection test
+TESTED_CONNECTION_TTL = int(os.environ.get('TESTED_CONNECTION_TTL', 300))
+
+@event.listens_for(DatabaseConnection, 'after_update')
+@event.listens_for(DatabaseConnection, 'after_delete')
+def invalidate_connection_pool(mapper, db_connection, target):
+    """Drop pooled connections, execution limits and cached schema/SQL/join graph/results when a saved connection is edited or deleted"""
+    pool_manager.invalidate(target.id)
+    execution_scheduler.forget(target.id)
+    invalidate_schema(target.id)
+    invalidate_generated_sql(target.id)
+    invalidate_schema_index(target.id)
+    invalidate_join_graph(target.id)
+    invalidate_results(target.id)
+
 class ConnectionForm(FlaskForm):
     """Form for database connection details"""
     name = StringField('Connection Name', validators=[DataRequired(), Length(max=64)])
@@ -26,19 +71,51 @@ class ConnectionForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(max=64)])
     password = PasswordField('Password', validators=[DataRequired()])
     database_name = StringField('Database Name', validators=[DataRequired(), Length(max=64)])
+    result_cache_ttl = IntegerField('Result Cache TTL (seconds)', validators=[Optional(), NumberRange(min=0, max=86400)])
+    statement_timeout = IntegerField('Statement Timeout (seconds)', validators=[Optional(), NumberRange(min=0, max=86400)])
+    max_estimated_rows = IntegerField('Max Estimated Rows', validators=[Optional(), NumberRange(min=0)])
+    max_estimated_cost = FloatField('Max Estimated Cost (PostgreSQL)', validators=[Optional(), NumberRange(min=0)])
+    preflight_action = SelectField('Over the Limits',
+                                   choices=[('', 'Default'),
+                                            ('limit', 'Add a LIMIT to SELECTs'),
+                                            ('reject', 'Reject the query')],
+                                   default='')
+    preflight_limit = IntegerField('Injected LIMIT', validators=[Optional(), NumberRange(min=1)])
+    max_concurrent_queries = IntegerField('Max Concurrent Queries', validators=[Optional(), NumberRange(min=0, max=1000)])
+    max_user_queries = IntegerField('Max Concurrent Queries per User', validators=[Optional(), NumberRange(min=0, max=1000)])
+    replica_hosts = StringField('Read Replicas', validators=[Optional(), Length(max=512)])
+    replica_selection = SelectField('Replica Selection',
+                                    choices=[('', 'Default'),
+                                             ('round_robin', 'Round robin'),
+                                             ('least_latency', 'Least latency')],
+                                    default='')
     submit = SubmitField('Connect')
 
 class QueryForm(FlaskForm):
     """Form for natural language query input"""
     query = TextAreaField('Ask a question about your database in plain English', 
                          validators=[DataRequired(), Length(min=10, max=1000)])
+    bypass_cache = BooleanField('Regenerate the SQL and re-run it instead of reusing cached results')
+    preview_first = BooleanField('Show the first rows right away and fetch the rest in the background')
     submit = SubmitField('Generate SQL and Run Query')
 
+def _connection_digest(db_type, host, port, username, password, database_name):
+    """Keyed digest of connection parameters, so the session never holds the password itself"""
+    params = json.dumps([db_type, host, int(port), username, password, database_name])
+    return hmac.new(current_app.config['SECRET_KEY'].encode(), params.encode(), hashlib.sha256).hexdigest()
+
+def _recently_tested(digest):
+    """Whether these exact parameters passed /test-connection in this session within TESTED_CONNECTION_TTL"""
+    tested = session.get('tested_connection')
+    return bool(tested) and hmac.compare_digest(tested['digest'], digest) \
+        and time.time() - tested['at'] < TESTED_CONNECTION_TTL
+
 @db_bp.route('/dashboard')
 @login_required
 def dashboard():
     """Dashboard page showing user's database connections"""
-    connections = DatabaseConnection.query.filter_by(user_id=current_user.id).all()
+    connections = DatabaseConnection.query.filter_by(user_id=current_user.id) \
+        .options(db.joinedload(DatabaseConnection.health)).all()
     return render_template('dashboard.html', connections=connections)
 
 @db_bp.route('/test-connection', methods=['POST'])
@@ -62,15 +139,13 @@ def test_connection():
         # Using plain password from form for initial connection test
         if db_type == 'mysql':
             # Connect to MySQL
-            connection = pymysql.connect(
+            connection = open_connection(
+                db_type,
                 host=data.get('host'),
-                user=data.get('username'),
+                port=data.get('port', 3306),
+                username=data.get('username'),
                 password=password,
-                db=data.get('database_name'),
-                port=int(data.get('port', 3306)),
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor,
-                connect_timeout=10  # Add timeout to avoid long waits
+                database_name=data.get('database_name')
             )
             
             # Get table list to verify connection works
@@ -82,13 +157,13 @@ def test_connection():
             
         elif db_type == 'postgresql':
             # Connect to PostgreSQL
-            connection = psycopg2.connect(
+            connection = open_connection(
+                db_type,
                 host=data.get('host'),
-                user=data.get('username'),
+                port=data.get('port', 5432),
+                username=data.get('username'),
                 password=password,  # Using password from the earlier extraction
-                dbname=data.get('database_name'),
-                port=int(data.get('port', 5432)),
-                connect_timeout=10,  # Add timeout to avoid long waits
+                database_name=data.get('database_name')
             )
             
             # Get table list to verify connection works
@@ -108,6 +183,13 @@ def test_connection():
                 'error': f'Unsupported database type: {db_type}'
             })
         
+        # Saving the same parameters right after this doesn't connect a second time
+        session['tested_connection'] = {
+            'digest': _connection_digest(db_type, data.get('host'), data.get('port', 3306 if db_type == 'mysql' else 5432),
+                                         data.get('username'), password, data.get('database_name')),
+            'at': time.time()
+        }
+        
         return jsonify({
             'success': True,
             'tables': tables,
@@ -170,27 +252,20 @@ def connect_db():
             # Handle different database types
             db_type = form.db_type.data.lower()
             
-            if db_type == 'mysql':
-                # Test MySQL connection
-                connection = pymysql.connect(
+            digest = _connection_digest(db_type, form.host.data, form.port.data, form.username.data,
+                                        form.password.data, form.database_name.data)
+            if db_type in ('mysql', 'postgresql') and _recently_tested(digest):
+                # "Test Connection" just succeeded with these exact parameters
+                pass
+            elif db_type in ('mysql', 'postgresql'):
+                # Test the connection with the same connect path the pool uses
+                connection = open_connection(
+                    db_type,
                     host=form.host.data,
-                    user=form.username.data,
-                    password=form.password.data,
-                    db=form.database_name.data,
                     port=form.port.data,
-                    charset='utf8mb4',
-                    cursorclass=pymysql.cursors.DictCursor
-                )
-                connection.close()
-            elif db_type == 'postgresql':
-                # Test PostgreSQL connection
-                connection = psycopg2.connect(
-                    host=form.host.data,
-                    user=form.username.data,
+                    username=form.username.data,
                     password=form.password.data,
-                    dbname=form.database_name.data,
-                    port=form.port.data,
-                    connect_timeout=10
+                    database_name=form.database_name.data
                 )
                 connection.close()
             else:
@@ -205,12 +280,25 @@ def connect_db():
                 username=form.username.data,
                 database_name=form.database_name.data,
                 user_id=current_user.id,
-                db_type=db_type
+                db_type=db_type,
+                result_cache_ttl=form.result_cache_ttl.data,
+                statement_timeout=form.statement_timeout.data,
+                max_estimated_rows=form.max_estimated_rows.data,
+                max_estimated_cost=form.max_estimated_cost.data,
+                preflight_action=form.preflight_action.data or None,
+                preflight_limit=form.preflight_limit.data,
+                max_concurrent_queries=form.max_concurrent_queries.data,
+                max_user_queries=form.max_user_queries.data,
+                replica_hosts=form.replica_hosts.data.strip() or None,
+                replica_selection=form.replica_selection.data or None
             )
             db_connection.set_password(form.password.data)
             
             db.session.add(db_connection)
             db.session.commit()
+            session.pop('tested_connection', None)
+            # Open a pooled connection and load the schema before the first question
+            connection_monitor.warm_up(db_connection.id)
             
             flash(f'{db_type.upper()} database connection created successfully!', 'success')
             return redirect(url_for('db_bp.dashboard'))
@@ -237,10 +325,67 @@ def connect_db():
 def connection_detail(conn_id):
     """View connection details and previous queries"""
     connection = DatabaseConnection.query.filter_by(id=conn_id, user_id=current_user.id).first_or_404()
-    queries = Query.query.filter_by(connection_id=conn_id).order_by(Query.created_at.desc()).all()
+    queries, next_cursor = query_history(conn_id)
     form = QueryForm()
     
-    return render_template('query.html', connection=connection, queries=queries, form=form)
+    return render_template('query.html', connection=connection, queries=queries, next_cursor=next_cursor, form=form)
+
+@db_bp.route('/connection/<int:conn_id>/health')
+@login_required
+def connection_health(conn_id):
+    """Return the latest health check of a connection as JSON"""
+    connection = DatabaseConnection.query.filter_by(id=conn_id, user_id=current_user.id).first_or_404()
+    if connection.health is None:
+        # Not checked yet: check it now in the background
+        connection_monitor.warm_up(connection.id)
+        return jsonify({'success': True, 'health': None})
+    return jsonify({'success': True, 'health': connection.health.to_dict()})
+
+@db_bp.route('/connection/<int:conn_id>/history')
+@login_required
+def connection_history(conn_id):
+    """Return a page of a connection's query history as JSON, for infinite scroll"""
+    DatabaseConnection.query.filter_by(id=conn_id, user_id=current_user.id).first_or_404()
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), 100)
+    try:
+        queries, next_cursor = query_history(conn_id, request.args.get('before'), limit)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid history cursor'
+        }), 400
+    
+    items = []
+    for query in queries:
+        item = query.to_history_dict()
+        item['detail_url'] = url_for('db_bp.query_detail', query_id=query.id)
+        items.append(item)
+    return jsonify({
+        'success': True,
+        'queries': items,
+        'next_cursor': next_cursor
+    })
+
+def query_history(conn_id, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Return (queries, next_cursor) for one page of history, newest first
+    
+    Pages are keyset-paginated on (created_at, id) using the composite index,
+    so later pages cost the same as the first. before is the cursor of the
+    last query on the previous page; next_cursor is None on the last page.
+    Large text columns stay deferred.
+    """
+    history = Query.query.filter(Query.connection_id == conn_id)
+    if before:
+        created_at, _, query_id = before.rpartition('_')
+        created_at, query_id = datetime.fromisoformat(created_at), int(query_id)
+        history = history.filter(or_(
+            Query.created_at < created_at,
+            and_(Query.created_at == created_at, Query.id < query_id)
+        ))
+    queries = history.order_by(Query.created_at.desc(), Query.id.desc()).limit(limit + 1).all()
+    next_cursor = queries[limit - 1].history_cursor if len(queries) > limit else None
+    return queries[:limit], next_cursor
 
 @db_bp.route('/connection/<int:conn_id>/delete', methods=['POST'])
 @login_required
@@ -254,6 +399,51 @@ def delete_connection(conn_id):
     flash('Connection deleted successfully', 'success')
     return redirect(url_for('db_bp.dashboard'))
 
+@db_bp.route('/connection/<int:conn_id>/schema/refresh', methods=['POST'])
+@login_required
+def refresh_schema(conn_id):
+    """Force re-introspection of a connection's schema"""
+    connection = DatabaseConnection.query.filter_by(id=conn_id, user_id=current_user.id).first_or_404()
+    
+    try:
+        schema_info = get_cached_schema(connection, refresh=True)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f"{connection.db_type.upper()} connection error: {str(e)}"
+        })
+    
+    return jsonify({
+        'success': True,
+        'tables': len(schema_info),
+        'message': f'Schema refreshed: {len(schema_info)} tables found.'
+    })
+
+@db_bp.route('/connection/<int:conn_id>/schema/graph')
+@login_required
+def schema_graph(conn_id):
+    """
+    Return the connection's foreign-key graph as JSON
+
+    ?source=&target= also returns the shortest join path between two tables.
+    """
+    connection = DatabaseConnection.query.filter_by(id=conn_id, user_id=current_user.id).first_or_404()
+    
+    try:
+        schema_info = get_cached_schema(connection)
+    except Exception as db_err:
+        return jsonify(schema_error(connection, db_err))
+    
+    graph = get_join_graph(connection.id, get_cached_fingerprint(connection), schema_info)
+    payload = dict(graph.to_dict(), success=True)
+    
+    source, target = request.args.get('source'), request.args.get('target')
+    if source and target:
+        path = graph.path(source, target)
+        payload['path'] = path
+        payload['joins'] = graph.join_conditions(path) if path else None
+    return jsonify(payload)
+
 @db_bp.route('/connection/<int:conn_id>/query', methods=['POST'])
 @login_required
 def query(conn_id):
@@ -265,89 +455,471 @@ def query(conn_id):
         natural_language_query = form.query.data
         
         try:
-            # First, get database schema
-            try:
-                schema_info = get_database_schema(connection)
-            except Exception as db_err:
-                db_type = connection.db_type.upper()
-                error_msg = str(db_err)
-                
-                # Add more user-friendly error messages
-                if "Access denied" in error_msg or "password authentication failed" in error_msg:
-                    return jsonify({
-                        'success': False,
-                        'error': f"{db_type} connection error: Authentication failed. Please check your credentials and try again."
-                    })
-                elif "cannot connect to server" in error_msg or "Can't connect" in error_msg:
-                    return jsonify({
-                        'success': False, 
-                        'error': f"{db_type} connection error: Cannot connect to the database server. The server might be down or unreachable."
-                    })
+            return result_json_response(run_query_pipeline(
+                connection,
+                natural_language_query,
+                bypass_cache=form.bypass_cache.data
+            ))
+        except PipelineError as e:
+            return error_response(e.payload)
+        except Exception as e:
+            return jsonify({
+                'success': False,
+                'error': f"An unexpected error occurred: {str(e)}"
+            }), 500
+    
+    return jsonify({
+        'success': False,
+        'error': 'Invalid form submission'
+    }), 400
+
+@db_bp.route('/connection/<int:conn_id>/jobs', methods=['POST'])
+@login_required
+def submit_query_job(conn_id):
+    """Queue a natural language query for background processing and return its job id"""
+    connection = DatabaseConnection.query.filter_by(id=conn_id, user_id=current_user.id).first_or_404()
+    form = QueryForm()
+    
+    if not form.validate_on_submit():
+        return jsonify({
+            'success': False,
+            'error': 'Invalid form submission'
+        }), 400
+    
+    try:
+        job = job_queue.submit(connection, form.query.data, current_user.id, bypass_cache=form.bypass_cache.data)
+    except QueueFull as e:
+        response = jsonify({
+            'success': False,
+            'error': str(e)
+        })
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('db_bp.query_job', job_id=job.id),
+        'events_url': url_for('db_bp.query_job_events', job_id=job.id)
+    }), 202
+
+@db_bp.route('/connection/<int:conn_id>/query/preview', methods=['POST'])
+@login_required
+def query_preview(conn_id):
+    """
+    Answer a question preview-first: the first rows now, the full result from a background job
+
+    The generated SQL runs with a LIMIT of QUERY_PREVIEW_ROWS + 1, so the
+    planner can stop early and the extra row tells whether the preview holds
+    the whole result. A complete preview goes into the result cache, where
+    the full run picks it up instead of running the query again. Reads that
+    can't take a LIMIT (SHOW, EXPLAIN) and writes get no preview and run
+    entirely in the job. The job's status, events and cancel URLs come back
+    with the preview.
+    """
+    connection = DatabaseConnection.query.filter_by(id=conn_id, user_id=current_user.id).first_or_404()
+    form = QueryForm()
+    
+    if not form.validate_on_submit():
+        return jsonify({
+            'success': False,
+            'error': 'Invalid form submission'
+        }), 400
+    
+    natural_language_query = form.query.data
+    bypass_cache = form.bypass_cache.data
+    try:
+        schema_info = get_cached_schema(connection)
+    except Exception as db_err:
+        return jsonify(schema_error(connection, db_err))
+    
+    try:
+        sql_query, sql_cached = get_generated_sql(
+            connection,
+            natural_language_query,
+            schema_info,
+            bypass_cache=bypass_cache
+        )
+    except SQLValidationError as e:
+        return jsonify(execution_error(e.sql, e))
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f"An unexpected error occurred: {str(e)}"
+        }), 500
+    
+    preview_rows = current_app.config['QUERY_PREVIEW_ROWS']
+    preview, complete, result_age = None, False, None
+    try:
+        sql_query, preflight = run_preflight(connection, sql_query, bypass_cache)
+        keyword, is_read = classify_statement(sql_query)
+        if is_read and keyword in CURSOR_STATEMENTS:
+            cached, result_age = (None, None) if bypass_cache else get_cached_result(connection, sql_query)
+            if cached is not None:
+                preview = ResultSet(cached.columns, cached.rows[:preview_rows + 1], cached.type_codes, cached.types)
+            else:
+                preview = execute_sql_query(connection, inject_limit(sql_query, preview_rows + 1))
+            complete = len(preview) <= preview_rows
+            if complete and cached is None:
+                cache_result(connection, sql_query, preview)
+            preview.rows = preview.rows[:preview_rows]
+    except Exception as sql_err:
+        return error_response(execution_error(sql_query, sql_err))
+    
+    try:
+        # A complete preview is replayed from the result cache even when bypassing it
+        job = job_queue.submit(connection, natural_language_query, current_user.id,
+                               bypass_cache=bypass_cache and not complete, sql_query=sql_query)
+    except QueueFull as e:
+        response = jsonify({
+            'success': False,
+            'error': str(e)
+        })
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    return result_json_response({
+        'success': True,
+        'sql': sql_query,
+        'sql_cached': sql_cached,
+        'preflight': preflight,
+        'preview': preview,
+        'preview_complete': complete,
+        'preview_rows': preview_rows,
+        'result_cached': result_age is not None,
+        'result_age': round(result_age, 1) if result_age is not None else None,
+        'job_id': job.id,
+        'status_url': url_for('db_bp.query_job', job_id=job.id),
+        'events_url': url_for('db_bp.query_job_events', job_id=job.id),
+        'cancel_url': url_for('db_bp.cancel_query_job', job_id=job.id)
+    })
+
+@db_bp.route('/connection/<int:conn_id>/batch', methods=['POST'])
+@login_required
+def batch_query(conn_id):
+    """
+    Answer a list of natural language questions concurrently
+
+    Expects JSON {"questions": [...], "bypass_cache": false}. The schema is
+    looked up once and the questions run in parallel; each entry of 'results'
+    is the /query payload for that question (or its error) plus its index.
+    Questions turned away because the user or the database had no free slot
+    are marked busy, with a Retry-After header on the response; if all of
+    them were, the response is a 503.
+    """
+    connection = DatabaseConnection.query.filter_by(id=conn_id, user_id=current_user.id).first_or_404()
+    data = request.get_json(silent=True) or {}
+    questions = data.get('questions')
+    max_questions = current_app.config['BATCH_MAX_QUESTIONS']
+    
+    if not isinstance(questions, list) or not questions or \
+            not all(isinstance(question, str) and question.strip() for question in questions):
+        return jsonify({
+            'success': False,
+            'error': 'questions must be a non-empty list of questions'
+        }), 400
+    if len(questions) > max_questions:
+        return jsonify({
+            'success': False,
+            'error': f"A batch can have at most {max_questions} questions"
+        }), 400
+    
+    started = time.monotonic()
+    try:
+        schema_info = get_cached_schema(connection)
+    except Exception as db_err:
+        return jsonify(schema_error(connection, db_err))
+    
+    results = batch_runner.run(
+        connection,
+        [question.strip() for question in questions],
+        schema_info,
+        current_user.id,
+        bypass_cache=bool(data.get('bypass_cache'))
+    )
+    busy = [result for result in results if result.get('busy')]
+    if len(busy) == len(results):
+        return error_response({
+            'success': False,
+            'error': busy[0]['error'],
+            'busy': True,
+            'retry_after': busy[0]['retry_after']
+        })
+    response = result_json_response({
+        'success': True,
+        'results': results,
+        'succeeded': sum(1 for result in results if result.get('success')),
+        'failed': sum(1 for result in results if not result.get('success')),
+        'busy': len(busy),
+        'elapsed': round(time.monotonic() - started, 3)
+    })
+    if busy:
+        response.headers['Retry-After'] = str(max(result['retry_after'] for result in busy))
+    return response
+
+@db_bp.route('/jobs/<job_id>')
+@login_required
+def query_job(job_id):
+    """Poll the status of a background query job"""
+    job = QueryJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    return jsonify(job_status(job))
+
+@db_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_query_job(job_id):
+    """Cancel a queued or running background query job"""
+    job = QueryJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if not job_queue.cancel(job):
+        return jsonify(dict(job_status(job), success=False, error='The query has already finished')), 409
+    return jsonify(dict(job_status(job), success=True))
+
+@db_bp.route('/jobs/<job_id>/events')
+@login_required
+def query_job_events(job_id):
+    """
+    Subscribe to a job's stage progress as Server-Sent Events
+
+    Each stream stays open for at most JOB_EVENT_STREAM_SECONDS, well below
+    the worker timeout, and then ends; EventSource reconnects on its own and
+    sends the id of the last stage it saw (Last-Event-ID), so the next stream
+    picks up from there. A worker is never tied up for the whole job.
+    """
+    QueryJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    poll_interval = current_app.config['JOB_EVENT_POLL_INTERVAL']
+    stream_seconds = current_app.config['JOB_EVENT_STREAM_SECONDS']
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    
+    def generate():
+        sent = int(last_event_id) if last_event_id.isdigit() else 0
+        deadline = time.monotonic() + stream_seconds
+        # Reconnect right away when this stream ends
+        yield f"retry: {int(poll_interval * 1000)}\n\n"
+        while True:
+            # The job is updated by a worker thread (possibly in another process),
+            # so reload it and end the read transaction on every poll
+            current = db.session.get(QueryJob, job_id, populate_existing=True)
+            entries = current.progress_entries()
+            finished = current.is_finished
+            for number, entry in enumerate(entries[sent:], start=sent + 1):
+                yield f"id: {number}\nevent: stage\ndata: {json.dumps(entry, default=str)}\n\n"
+            sent = len(entries)
+            if finished:
+                yield f"event: done\ndata: {json.dumps(job_status(current), default=str)}\n\n"
+                return
+            db.session.commit()
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(poll_interval)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def job_status(job):
+    """Job status payload, including the SQL and explanation once the job succeeded"""
+    status = job.to_dict()
+    if job.sql_query:
+        status['max_rows'] = current_app.config['QUERY_MAX_ROWS']
+    if job.query_id:
+        query = db.session.get(Query, job.query_id)
+        status.update({
+            'sql': query.sql_query,
+            'explanation': query.natural_language_result,
+            'result_url': url_for('db_bp.query_result', query_id=query.id),
+            'detail_url': url_for('db_bp.query_detail', query_id=query.id)
+        })
+    return status
+
+@db_bp.route('/connection/<int:conn_id>/query/stream', methods=['POST'])
+@login_required
+def query_stream(conn_id):
+    """Process a natural language query, streaming result rows back as NDJSON"""
+    connection = DatabaseConnection.query.filter_by(id=conn_id, user_id=current_user.id).first_or_404()
+    form = QueryForm()
+    
+    if not form.validate_on_submit():
+        return jsonify({
+            'success': False,
+            'error': 'Invalid form submission'
+        }), 400
+    
+    natural_language_query = form.query.data
+    
+    try:
+        schema_info = get_cached_schema(connection)
+    except Exception as db_err:
+        return jsonify(schema_error(connection, db_err))
+    
+    try:
+        sql_query, sql_cached = get_generated_sql(
+            connection,
+            natural_language_query, 
+            schema_info,
+            bypass_cache=form.bypass_cache.data
+        )
+    except SQLValidationError as e:
+        return jsonify(execution_error(e.sql, e))
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f"An unexpected error occurred: {str(e)}"
+        }), 500
+    
+    batch_size = current_app.config['QUERY_STREAM_BATCH_SIZE']
+    max_rows = current_app.config['QUERY_MAX_ROWS']
+    bypass_cache = form.bypass_cache.data
+    
+    def generate():
+        # Each line of the response is one JSON event: sql, columns, rows, complete,
+        # explanation_delta (one per explanation fragment), explanation or error
+        nonlocal sql_query
+        try:
+            # The pre-flight check may rewrite the SQL with a LIMIT
+            sql_query, preflight = run_preflight(connection, sql_query, bypass_cache)
+        except Exception as sql_err:
+            yield to_ndjson(dict(execution_error(sql_query, sql_err), type='error'))
+            return
+        yield to_ndjson({'type': 'sql', 'sql': sql_query, 'sql_cached': sql_cached, 'preflight': preflight})
+        
+        try:
+            if is_read_statement(sql_query):
+                # Rows are not kept: each batch is folded into the stored pages and the
+                # explanation digest, then forwarded to the client
+                writer = ResultWriter()
+                digest = ResultDigest()
+                cached, result_age = (None, None) if bypass_cache else get_cached_result(connection, sql_query)
+                if cached is not None:
+                    stream = CachedRowStream(cached, batch_size=batch_size, max_rows=max_rows)
+                    kept = None
                 else:
-                    return jsonify({
-                        'success': False,
-                        'error': f"{db_type} connection error: {error_msg}"
-                    })
-            
-            # Generate SQL using OpenAI with appropriate database syntax
-            sql_query = generate_sql_query(
-                natural_language_query, 
-                schema_info,
-                db_type=connection.db_type
-            )
-            
-            # Execute the SQL query
-            try:
+                    stream = stream_sql_query(connection, sql_query, batch_size=batch_size, max_rows=max_rows)
+                    # Small results are also collected for the result cache
+                    kept = []
+                for rows in stream:
+                    if stream.row_count == len(rows):
+                        yield to_ndjson({'type': 'columns', 'columns': stream.columns, 'types': stream.types})
+                    writer.add_rows(rows)
+                    digest.add_rows(rows)
+                    if kept is not None:
+                        kept.extend(rows)
+                        if len(kept) > RESULT_CACHE_MAX_ROWS:
+                            kept = None
+                    yield to_ndjson({'type': 'rows', 'rows': rows})
+                writer.columns = stream.columns
+                if kept is not None and not stream.truncated:
+                    cache_result(connection, sql_query,
+                                 ResultSet(stream.columns, kept, stream.type_codes, stream.types))
+                yield to_ndjson({
+                    'type': 'complete',
+                    'columns': stream.columns,
+                    'row_count': stream.row_count,
+                    'truncated': stream.truncated,
+                    'max_rows': max_rows,
+                    'result_cached': result_age is not None,
+                    'result_age': round(result_age, 1) if result_age is not None else None
+                })
+            else:
+                # Writes only report an affected-row count, so there is nothing to stream
                 result = execute_sql_query(connection, sql_query)
-            except Exception as sql_err:
-                error_msg = str(sql_err)
-                
-                if "syntax error" in error_msg.lower():
-                    return jsonify({
-                        'success': False,
-                        'error': f"SQL Error: Syntax error in the generated query. Please try rephrasing your question.",
-                        'sql': sql_query,
-                        'details': error_msg
-                    })
-                else:
-                    return jsonify({
-                        'success': False,
-                        'error': f"Error executing query: {error_msg}",
-                        'sql': sql_query
-                    })
-            
-            # Generate natural language response
-            nl_result = generate_natural_language_result(natural_language_query, sql_query, result)
+                writer = None
+                digest = ResultDigest.from_result(result)
+                yield to_ndjson({'type': 'complete', 'result': result})
+        except Exception as sql_err:
+            yield to_ndjson(dict(execution_error(sql_query, sql_err), type='error'))
+            return
+        
+        try:
+            # Forward the explanation as it is generated, keeping the full text to save
+            parts = []
+            for text in stream_natural_language_result(natural_language_query, sql_query, digest):
+                parts.append(text)
+                yield to_ndjson({'type': 'explanation_delta', 'text': text})
+            nl_result = ''.join(parts).strip()
             
-            # Save the query
             query = Query(
                 natural_language=natural_language_query,
                 sql_query=sql_query,
-                result=json.dumps(result),
                 natural_language_result=nl_result,
                 connection_id=conn_id
             )
             db.session.add(query)
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'query_id': query.id,
-                'sql': sql_query,
-                'result': result,
-                'explanation': nl_result
-            })
-            
+            db.session.flush()
+            if writer is not None:
+                writer.save(query)
+            else:
+                store_result(query, result)
+            with timed('commit'):
+                db.session.commit()
         except Exception as e:
-            return jsonify({
-                'success': False,
-                'error': f"An unexpected error occurred: {str(e)}"
-            }), 500
+            yield to_ndjson({'type': 'error', 'success': False, 'error': f"An unexpected error occurred: {str(e)}"})
+            return
+        
+        yield to_ndjson({'type': 'explanation', 'query_id': query.id, 'explanation': nl_result})
     
-    return jsonify({
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def to_ndjson(event):
+    """Serialize one streamed event as a line of newline-delimited JSON"""
+    return dumps(event) + "\n"
+
+def schema_error(connection, db_err):
+    """Build the JSON error payload for a failed schema lookup"""
+    db_type = connection.db_type.upper()
+    error_msg = str(db_err)
+    
+    # Add more user-friendly error messages
+    if "Access denied" in error_msg or "password authentication failed" in error_msg:
+        return {
+            'success': False,
+            'error': f"{db_type} connection error: Authentication failed. Please check your credentials and try again."
+        }
+    elif "cannot connect to server" in error_msg or "Can't connect" in error_msg:
+        return {
+            'success': False, 
+            'error': f"{db_type} connection error: Cannot connect to the database server. The server might be down or unreachable."
+        }
+    return {
         'success': False,
-        'error': 'Invalid form submission'
-    }), 400
+        'error': f"{db_type} connection error: {error_msg}"
+    }
+
+def execution_error(sql_query, sql_err):
+    """Build the JSON error payload for a generated query that failed to execute"""
+    error_msg = str(sql_err)
+    
+    if isinstance(sql_err, ExecutionBusy):
+        return {
+            'success': False,
+            'error': error_msg,
+            'sql': sql_query,
+            'busy': True,
+            'retry_after': sql_err.retry_after
+        }
+    if isinstance(sql_err, PreflightRejected):
+        return {
+            'success': False,
+            'error': error_msg,
+            'sql': sql_query,
+            'estimate': sql_err.estimate
+        }
+    if isinstance(sql_err, SQLValidationError):
+        return {
+            'success': False,
+            'error': f"{error_msg}. Please try rephrasing your question.",
+            'sql': sql_err.sql
+        }
+    if "syntax error" in error_msg.lower():
+        return {
+            'success': False,
+            'error': f"SQL Error: Syntax error in the generated query. Please try rephrasing your question.",
+            'sql': sql_query,
+            'details': error_msg
+        }
+    return {
+        'success': False,
+        'error': f"Error executing query: {error_msg}",
+        'sql': sql_query
+    }
 
 @db_bp.route('/query/<int:query_id>')
 @login_required
@@ -355,104 +927,279 @@ def query_detail(query_id):
     """View details of a specific query"""
     query = Query.query.filter_by(id=query_id).first_or_404()
     connection = DatabaseConnection.query.filter_by(id=query.connection_id, user_id=current_user.id).first_or_404()
+    page = request.args.get('page', 1, type=int)
     
     return render_template(
         'query_detail.html', 
         query=query, 
         connection=connection,
-        result=json.loads(query.result) if query.result else None
+        result=load_result_page(query, max(page, 1)),
+        summary=load_result_summary(query)
     )
 
-def get_database_schema(connection):
-    """Retrieve schema information from the database"""
+@db_bp.route('/query/<int:query_id>/result')
+@login_required
+def query_result(query_id):
+    """Return one page of a stored query result as JSON"""
+    query = Query.query.filter_by(id=query_id).first_or_404()
+    DatabaseConnection.query.filter_by(id=query.connection_id, user_id=current_user.id).first_or_404()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', type=int)
+    if per_page is not None:
+        per_page = min(max(per_page, 1), 5000)
+    
+    result = load_result_page(query, page, per_page)
+    if result is None:
+        return jsonify({
+            'success': True,
+            'summary': load_result_summary(query)
+        })
+    
+    return result_json_response(dict(result, success=True))
+
+@db_bp.route('/query/<int:query_id>/export')
+@login_required
+def export_query(query_id):
+    """
+    Download a query's result as CSV, an Arrow IPC stream or Parquet
+
+    ?format= picks csv (default), arrow or parquet. ?source=database (default)
+    re-runs the query's SELECT through a server-side cursor; ?source=stored
+    reads the saved result. Either way rows are fetched, encoded and sent in
+    batches of EXPORT_BATCH_SIZE, so memory use doesn't grow with the result.
+    """
+    query = Query.query.filter_by(id=query_id).first_or_404()
+    connection = DatabaseConnection.query.filter_by(id=query.connection_id, user_id=current_user.id).first_or_404()
+    file_format = request.args.get('format', 'csv').lower()
+    source = request.args.get('source', 'database').lower()
+    
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f"Unsupported export format: {file_format}. Use one of: {', '.join(EXPORT_FORMATS)}"
+        }), 400
+    
+    if source == 'stored':
+        if result_columns_of(query) is None:
+            return jsonify({
+                'success': False,
+                'error': 'This query has no stored rows to export'
+            }), 400
+        stream = StoredRowStream(query)
+    elif source == 'database':
+        # Only re-run reads; a stored INSERT, UPDATE or DELETE must not run again
+        if not is_read_statement(query.sql_query):
+            return jsonify({
+                'success': False,
+                'error': 'Only SELECT queries can be re-run for export; use source=stored'
+            }), 400
+        stream = stream_sql_query(connection, query.sql_query, batch_size=EXPORT_BATCH_SIZE)
+    else:
+        return jsonify({
+            'success': False,
+            'error': 'source must be database or stored'
+        }), 400
+    
     try:
-        schema_info = {}
-        
-        # Get password and handle different formats
-        password = connection.get_password()
-        
-        # Handle issue with encrypted passwords vs hashed passwords
-        if ':' in connection.password_hash and password == connection.password_hash:
-            # Using old password hash method, just use the raw password hash
-            # This is a temporary fix for backward compatibility
-            password = connection.password_hash
-            
-        # Handle different database types
-        if connection.is_mysql:
-            # MySQL connection
-            conn = pymysql.connect(
-                host=connection.host,
-                user=connection.username,
-                password=password,
-                db=connection.database_name,
-                port=connection.port,
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor,
-                connect_timeout=10  # Add timeout to avoid long waits
-            )
-            
-            with conn.cursor() as cursor:
-                # Get all tables
-                cursor.execute("SHOW TABLES")
-                tables = [list(table.values())[0] for table in cursor.fetchall()]
-                
-                # Get columns for each table
-                for table in tables:
-                    cursor.execute(f"DESCRIBE `{table}`")
-                    columns = cursor.fetchall()
-                    schema_info[table] = columns
-            
-            conn.close()
-            
-        elif connection.is_postgresql:
-            # PostgreSQL connection
-            conn = psycopg2.connect(
-                host=connection.host,
-                user=connection.username,
-                password=password,  # Use the processed password
-                dbname=connection.database_name,
-                port=connection.port,
-                connect_timeout=10
-            )
-            
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                # Get all tables from public schema
-                cursor.execute("""
-                    SELECT table_name 
-                    FROM information_schema.tables 
-                    WHERE table_schema = 'public'
-                """)
-                tables = [record['table_name'] for record in cursor.fetchall()]
-                
-                # Get columns for each table
-                for table in tables:
-                    cursor.execute(f"""
-                        SELECT column_name, data_type, 
-                               CASE WHEN is_nullable = 'YES' THEN 'YES' ELSE 'NO' END AS is_nullable,
-                               CASE WHEN column_default IS NOT NULL THEN column_default ELSE '' END AS column_default
-                        FROM information_schema.columns
-                        WHERE table_name = '{table}' AND table_schema = 'public'
-                    """)
-                    # Convert to a format similar to MySQL's DESCRIBE
-                    columns = []
-                    for col in cursor.fetchall():
-                        columns.append({
-                            'Field': col['column_name'],
-                            'Type': col['data_type'],
-                            'Null': col['is_nullable'],
-                            'Default': col['column_default'],
-                            'Key': '',  # PostgreSQL doesn't directly expose this in information_schema
-                            'Extra': ''
-                        })
-                    schema_info[table] = columns
-            
-            conn.close()
+        chunks = export_rows(stream, file_format)
+        # Run the query and encode the first batch now, so errors still get a JSON response
+        first = next(chunks)
+    except ExportUnavailable as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 501
+    except Exception as e:
+        return error_response(execution_error(query.sql_query, e))
+    
+    def generate():
+        yield first
+        yield from chunks
+    
+    mimetype, extension = EXPORT_FORMATS[file_format]
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="query-{query.id}.{extension}"',
+        'X-Accel-Buffering': 'no'
+    })
+
+def error_response(payload):
+    """JSON response for an error payload: 503 with Retry-After when the database was busy"""
+    response = jsonify(payload)
+    if payload.get('busy'):
+        response.headers['Retry-After'] = str(payload['retry_after'])
+        return response, 503
+    return response
+
+def result_json_response(payload):
+    """JSON response for result data, which may hold ResultSets and values jsonify cannot encode"""
+    return Response(dumps(payload), mimetype='application/json')
+
+# Set-based catalog queries used for schema introspection. Each runs once per
+# introspection regardless of the number of tables.
+MYSQL_COLUMNS_SQL = """
+    SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name, COLUMN_TYPE AS column_type,
+           IS_NULLABLE AS is_nullable, COLUMN_KEY AS column_key,
+           COLUMN_DEFAULT AS column_default, EXTRA AS extra
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() {tables}
+    ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+MYSQL_FOREIGN_KEYS_SQL = """
+    SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name, CONSTRAINT_NAME AS constraint_name,
+           REFERENCED_TABLE_NAME AS referenced_table, REFERENCED_COLUMN_NAME AS referenced_column
+    FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND REFERENCED_TABLE_SCHEMA = DATABASE()
+      AND REFERENCED_TABLE_NAME IS NOT NULL {tables}
+    ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+"""
+
+# User-visible PostgreSQL schemas (everything except the system catalogs)
+PG_SCHEMA_FILTER = """
+    n.nspname NOT IN ('pg_catalog', 'information_schema')
+    AND n.nspname !~ '^pg_(toast|temp_)'
+"""
+
+# Display name of a PostgreSQL table, as pg_table_name() builds it
+PG_TABLE_NAME = "CASE WHEN n.nspname = 'public' THEN c.relname ELSE n.nspname || '.' || c.relname END"
+
+PG_COLUMNS_SQL = """
+    SELECT n.nspname AS table_schema, c.relname AS table_name, a.attname AS column_name,
+           format_type(a.atttypid, a.atttypmod) AS data_type,
+           CASE WHEN a.attnotnull THEN 'NO' ELSE 'YES' END AS is_nullable,
+           COALESCE(pg_get_expr(d.adbin, d.adrelid), '') AS column_default,
+           CASE WHEN a.attidentity IN ('a', 'd') THEN 'identity' ELSE '' END AS extra
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    LEFT JOIN pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+    WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+      AND has_table_privilege(c.oid, 'SELECT')
+      AND """ + PG_SCHEMA_FILTER + """ {tables}
+    ORDER BY n.nspname, c.relname, a.attnum
+"""
+
+# Index membership per column, mapped to MySQL's PRI / UNI / MUL key markers
+PG_KEYS_SQL = """
+    SELECT n.nspname AS table_schema, c.relname AS table_name, a.attname AS column_name,
+           bool_or(i.indisprimary) AS is_primary,
+           bool_or(i.indisunique AND i.indnatts = 1) AS is_unique,
+           bool_or(a.attnum = i.indkey[0]) AS is_leading
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+    WHERE """ + PG_SCHEMA_FILTER + """ {tables}
+    GROUP BY n.nspname, c.relname, a.attname
+"""
+
+PG_FOREIGN_KEYS_SQL = """
+    SELECT n.nspname AS table_schema, c.relname AS table_name, a.attname AS column_name,
+           con.conname AS constraint_name, rn.nspname AS referenced_schema, rc.relname AS referenced_table,
+           ra.attname AS referenced_column
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_class rc ON rc.oid = con.confrelid
+    JOIN pg_namespace rn ON rn.oid = rc.relnamespace
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, ref_attnum, position)
+    JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+    JOIN pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.ref_attnum
+    WHERE con.contype = 'f'
+      AND """ + PG_SCHEMA_FILTER + """ {tables}
+    ORDER BY con.oid, k.position
+"""
+
+def pg_table_name(schema, table):
+    """Tables in the public schema keep their bare name; others are schema-qualified"""
+    return table if schema == 'public' else f"{schema}.{table}"
+
+def _table_filter(column, tables):
+    """Extra WHERE condition and parameters restricting a catalog query to some tables"""
+    if tables is None:
+        return '', None
+    return f"AND {column} IN %(tables)s", {'tables': tuple(tables)}
+
+def _introspect_mysql(cursor, tables=None):
+    """Build the schema dict for a MySQL database (or some of its tables) in two catalog queries"""
+    schema_info = {}
+    condition, params = _table_filter('TABLE_NAME', tables)
+    
+    cursor.execute(MYSQL_COLUMNS_SQL.format(tables=condition), params)
+    for col in cursor.fetchall():
+        # COLUMN_KEY already holds DESCRIBE's PRI / UNI / MUL marker
+        schema_info.setdefault(col['table_name'], []).append({
+            'Field': col['column_name'],
+            'Type': col['column_type'],
+            'Null': col['is_nullable'],
+            'Key': col['column_key'] or '',
+            'Default': col['column_default'],
+            'Extra': col['extra'] or ''
+        })
+    
+    cursor.execute(MYSQL_FOREIGN_KEYS_SQL.format(tables=condition), params)
+    _attach_foreign_keys(schema_info, [
+        (fk['table_name'], fk['column_name'], fk['referenced_table'], fk['referenced_column'], fk['constraint_name'])
+        for fk in cursor.fetchall()
+    ])
+    return schema_info
+
+def _introspect_postgresql(cursor, tables=None):
+    """Build the schema dict for a PostgreSQL database (or some of its tables) in three catalog queries"""
+    schema_info = {}
+    condition, params = _table_filter(PG_TABLE_NAME, tables)
+    
+    cursor.execute(PG_KEYS_SQL.format(tables=condition), params)
+    keys = {}
+    for row in cursor.fetchall():
+        if row['is_primary']:
+            key = 'PRI'
+        elif row['is_unique']:
+            key = 'UNI'
+        elif row['is_leading']:
+            key = 'MUL'
         else:
-            raise Exception(f"Unsupported database type: {connection.db_type}")
-            
-        return schema_info
-        
+            continue
+        keys[(row['table_schema'], row['table_name'], row['column_name'])] = key
+    
+    cursor.execute(PG_COLUMNS_SQL.format(tables=condition), params)
+    for col in cursor.fetchall():
+        table = pg_table_name(col['table_schema'], col['table_name'])
+        # Same shape as MySQL's DESCRIBE output
+        schema_info.setdefault(table, []).append({
+            'Field': col['column_name'],
+            'Type': col['data_type'],
+            'Null': col['is_nullable'],
+            'Key': keys.get((col['table_schema'], col['table_name'], col['column_name']), ''),
+            'Default': col['column_default'],
+            'Extra': col['extra']
+        })
+    
+    cursor.execute(PG_FOREIGN_KEYS_SQL.format(tables=condition), params)
+    _attach_foreign_keys(schema_info, [
+        (pg_table_name(fk['table_schema'], fk['table_name']), fk['column_name'],
+         pg_table_name(fk['referenced_schema'], fk['referenced_table']), fk['referenced_column'],
+         fk['constraint_name'])
+        for fk in cursor.fetchall()
+    ])
+    return schema_info
+
+def _attach_foreign_keys(schema_info, foreign_keys):
+    """Record foreign keys on their columns as a 'References' entry, naming the constraint"""
+    for table, column, referenced_table, referenced_column, constraint in foreign_keys:
+        for col in schema_info.get(table, []):
+            if col['Field'] == column:
+                col['References'] = {'table': referenced_table, 'column': referenced_column, 'constraint': constraint}
+                break
+
+@contextmanager
+def schema_errors(connection):
+    """Count driver errors raised while reading a schema and re-raise them with readable messages"""
+    try:
+        yield
     except pymysql.err.OperationalError as e:
+        count_error('schema', db_error_type(e))
         error_code = e.args[0]
         if error_code == 1045:  # Access denied error
             error_message = (
@@ -467,6 +1214,7 @@ def get_database_schema(connection):
         else:
             raise Exception(f"Database connection error ({error_code}): {str(e)}")
     except psycopg2.OperationalError as e:
+        count_error('schema', db_error_type(e))
         error_message = str(e)
         if "password authentication failed" in error_message.lower():
             raise Exception(f"Authentication failed for PostgreSQL database. Please check your credentials.")
@@ -476,107 +1224,352 @@ def get_database_schema(connection):
         else:
             raise Exception(f"PostgreSQL error: {str(e)}")
     except Exception as e:
+        count_error('schema', db_error_type(e))
         raise Exception(f"Error fetching database schema: {str(e)}")
 
+@timed('schema')
+def get_database_schema(connection, tables=None):
+    """Retrieve schema information from the database, optionally only for the named tables"""
+    if tables is not None and not tables:
+        return {}
+    with schema_errors(connection):
+        # Handle different database types
+        if connection.is_mysql:
+            # MySQL connection (pooled)
+            with pool_manager.connection(connection) as conn:
+                with conn.cursor() as cursor:
+                    schema_info = _introspect_mysql(cursor, tables)
+            
+        elif connection.is_postgresql:
+            # PostgreSQL connection (pooled)
+            with pool_manager.connection(connection) as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                    schema_info = _introspect_postgresql(cursor, tables)
+        else:
+            raise Exception(f"Unsupported database type: {connection.db_type}")
+            
+        return schema_info
+
+def begin_read_only(conn, connection):
+    """
+    Make the pooled connection's transaction read-only
+
+    Call before any other statement of the transaction. A read that turns
+    out to write anyway (a volatile function, say) then fails instead of
+    changing data. The transaction ends with the rollback when the
+    connection goes back to the pool.
+    """
+    with conn.cursor() as cursor:
+        if connection.is_postgresql:
+            cursor.execute("SET TRANSACTION READ ONLY")
+        elif connection.is_mysql:
+            cursor.execute("START TRANSACTION READ ONLY")
+
+@timed('execute')
 def execute_sql_query(connection, sql_query):
-    """Execute SQL query against the database"""
-    conn = None
+    """
+    Execute SQL query against the database, returning a ResultSet for a read
+
+    Reads (see classify_statement) run in a read-only transaction, on a
+    read replica when the connection has any. Writes run on the primary,
+    are committed and return their affected row count.
+    """
+    is_read = is_read_statement(sql_query)
     try:
-        password = connection.get_password()
-        
-        # Handle issue with encrypted passwords vs hashed passwords
-        if ':' in connection.password_hash and password == connection.password_hash:
-            # Using old password hash method, just use the raw hash for now
-            password = connection.password_hash
-        
         # Handle different database types
         if connection.is_mysql:
-            # MySQL connection
-            conn = pymysql.connect(
-                host=connection.host,
-                user=connection.username,
-                password=password,
-                db=connection.database_name,
-                port=connection.port,
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor,
-                connect_timeout=10  # Add timeout to avoid long waits
-            )
-            
-            with conn.cursor() as cursor:
-                cursor.execute(sql_query)
-                
-                # For SELECT queries, return results
-                if sql_query.strip().lower().startswith('select'):
-                    result = cursor.fetchall()
-                    return result
-                # For other queries, return affected row count
-                else:
-                    conn.commit()
-                    return {'affected_rows': cursor.rowcount}
+            # MySQL connection (pooled), once the database has a free execution slot
+            with execution_scheduler.slot(connection), pool_manager.connection(connection, read_only=is_read) as conn:
+                if is_read:
+                    begin_read_only(conn, connection)
+                apply_statement_timeout(conn, connection)
+                # Rows as tuples: the result is columnar, so dicts would only repeat the column names
+                with conn.cursor(pymysql.cursors.Cursor) as cursor:
+                    cursor.execute(sql_query)
+                    
+                    # For reads, return results
+                    if is_read:
+                        result = ResultSet.from_cursor(cursor, cursor.fetchall(), connection.db_type)
+                        count_rows(len(result))
+                        return result
+                    # For other queries, return affected row count
+                    else:
+                        conn.commit()
+                        # The write may change any cached result of this connection
+                        invalidate_results(connection.id)
+                        return {'affected_rows': cursor.rowcount}
             
         elif connection.is_postgresql:
-            # PostgreSQL connection
-            conn = psycopg2.connect(
-                host=connection.host,
-                user=connection.username,
-                password=password,  # Use the processed password
-                dbname=connection.database_name,
-                port=connection.port,
-                connect_timeout=10
-            )
-            
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                cursor.execute(sql_query)
-                
-                # For SELECT queries, return results
-                if sql_query.strip().lower().startswith('select'):
-                    result = cursor.fetchall()
-                    # Convert psycopg2 result to dict list to match MySQL format
-                    dict_result = []
-                    for row in result:
-                        dict_result.append(dict(row))
-                    return dict_result
-                # For other queries, return affected row count
-                else:
-                    conn.commit()
-                    return {'affected_rows': cursor.rowcount}
+            # PostgreSQL connection (pooled), once the database has a free execution slot
+            with execution_scheduler.slot(connection), pool_manager.connection(connection, read_only=is_read) as conn:
+                if is_read:
+                    begin_read_only(conn, connection)
+                apply_statement_timeout(conn, connection)
+                with conn.cursor() as cursor:
+                    cursor.execute(sql_query)
+                    
+                    # For reads, return results
+                    if is_read:
+                        result = ResultSet.from_cursor(cursor, cursor.fetchall(), connection.db_type)
+                        count_rows(len(result))
+                        return result
+                    # For other queries, return affected row count
+                    else:
+                        conn.commit()
+                        # The write may change any cached result of this connection
+                        invalidate_results(connection.id)
+                        return {'affected_rows': cursor.rowcount}
         
         else:
             raise Exception(f"Unsupported database type: {connection.db_type}")
         
-    except pymysql.err.OperationalError as e:
+    except ExecutionBusy:
+        raise
+    except Exception as e:
+        raise query_error(connection, e)
+
+def run_preflight(connection, sql_query, bypass_cache=False):
+    """
+    Run the EXPLAIN pre-flight check before executing generated SQL
+    
+    Returns (sql_query, report) where sql_query may have a LIMIT injected.
+    A SELECT whose result is already cached skips the check. Raises
+    PreflightRejected, or a user-facing error if EXPLAIN itself fails.
+    """
+    if not bypass_cache and is_read_statement(sql_query):
+        cached, age = get_cached_result(connection, sql_query)
+        if cached is not None:
+            return sql_query, None
+    try:
+        with timed('preflight'):
+            return preflight_query(connection, sql_query)
+    except PreflightRejected:
+        raise
+    except Exception as e:
+        raise query_error(connection, e)
+
+def execute_cached_query(connection, sql_query, bypass_cache=False):
+    """
+    Execute a SQL query, serving SELECTs from the result cache when possible
+
+    Returns (result, age): age is the cached result's age in seconds, or None
+    when the query ran against the database. With bypass_cache the query always
+    runs and a SELECT result replaces the cached entry.
+    """
+    is_read = is_read_statement(sql_query)
+    if is_read and not bypass_cache:
+        cached, age = get_cached_result(connection, sql_query)
+        if cached is not None:
+            count_rows(len(cached), source='cache')
+            return cached, age
+    
+    result = execute_sql_query(connection, sql_query)
+    if is_read:
+        cache_result(connection, sql_query, result)
+    return result, None
+
+def stream_sql_query(connection, sql_query, batch_size=1000, max_rows=None):
+    """Execute a SELECT with a server-side cursor and return a RowStream over its batches"""
+    return RowStream(connection, sql_query, batch_size, max_rows)
+
+class RowStream:
+    """
+    Iterates over the rows of a SELECT in batches without materializing the result
+
+    MySQL uses an unbuffered SSCursor and PostgreSQL a named (server-side)
+    cursor; rows are tuples in column order. columns, type_codes and types
+    (as in ResultSet) are set once the first batch is fetched. After
+    iteration, row_count holds the number of rows yielded and
+    truncated is True if max_rows cut the result short. Only time spent in the
+    driver counts towards the execute stage, not time spent by the consumer.
+    cancel() may be called from another thread to stop the query.
+    """
+
+    def __init__(self, connection, sql_query, batch_size=1000, max_rows=None):
+        self.connection = connection
+        self.sql_query = sql_query
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.columns = None
+        self.type_codes = None
+        self.types = None
+        self.row_count = 0
+        self.truncated = False
+        self.cancelled = False
+        self._conn = None
+
+    def cancel(self):
+        """
+        Stop the query: interrupt the running statement and end the iteration
+
+        PostgreSQL gets a cancel request on the driver connection; MySQL gets a
+        KILL QUERY from a second session on the same server. Iteration then
+        raises QueryCancelled.
+        """
+        self.cancelled = True
+        conn = self._conn
+        if conn is None:
+            return
+        try:
+            if self.connection.is_postgresql:
+                conn.cancel()
+            elif self.connection.is_mysql:
+                killer = pymysql.connect(host=conn.host, port=conn.port, user=conn.user, password=conn.password,
+                                         connect_timeout=CONNECT_TIMEOUT)
+                try:
+                    with killer.cursor() as cursor:
+                        cursor.execute("KILL QUERY %s", (conn.thread_id(),))
+                finally:
+                    killer.close()
+        except Exception as e:
+            # The flag still stops the iteration after the current batch
+            logger.warning("Could not interrupt a query of connection %s: %s", self.connection.id, e)
+
+    def __iter__(self):
+        connection = self.connection
+        elapsed = 0.0
+        started = time.perf_counter()
+        try:
+            # The slot is held until the last row is fetched
+            with execution_scheduler.slot(connection), pool_manager.connection(connection, read_only=True) as conn:
+                exhausted = False
+                self._conn = conn
+                try:
+                    if self.cancelled:
+                        raise QueryCancelled("The query was cancelled")
+                    begin_read_only(conn, connection)
+                    apply_statement_timeout(conn, connection)
+                    if connection.is_mysql:
+                        cursor = conn.cursor(pymysql.cursors.SSCursor)
+                    elif connection.is_postgresql and classify_statement(self.sql_query)[0] in CURSOR_STATEMENTS:
+                        cursor = conn.cursor(name='sqlai_stream')
+                        cursor.itersize = self.batch_size
+                    elif connection.is_postgresql:
+                        # SHOW and EXPLAIN can't run in a server-side cursor; their output is small
+                        cursor = conn.cursor()
+                    else:
+                        raise Exception(f"Unsupported database type: {connection.db_type}")
+                    
+                    cursor.execute(self.sql_query)
+                    while True:
+                        if self.cancelled:
+                            raise QueryCancelled("The query was cancelled")
+                        size = self.batch_size
+                        if self.max_rows is not None:
+                            size = min(size, self.max_rows - self.row_count)
+                            if size <= 0:
+                                # Probe for one more row to know whether the cap cut anything off
+                                self.truncated = cursor.fetchone() is not None
+                                break
+                        rows = cursor.fetchmany(size)
+                        if self.columns is None and cursor.description:
+                            described = ResultSet.from_cursor(cursor, None, connection.db_type)
+                            self.columns, self.type_codes, self.types = \
+                                described.columns, described.type_codes, described.types
+                        if not rows:
+                            exhausted = True
+                            break
+                        self.row_count += len(rows)
+                        count_rows(len(rows))
+                        elapsed += time.perf_counter() - started
+                        yield rows
+                        started = time.perf_counter()
+                    
+                    if connection.is_postgresql:
+                        cursor.close()
+                finally:
+                    self._conn = None
+                    if connection.is_mysql and not exhausted:
+                        # Closing an unbuffered cursor would drain the remaining rows from
+                        # the server, so drop the whole connection instead. The pool
+                        # discards it when the rollback on release fails.
+                        conn.close()
+        except (GeneratorExit, ExecutionBusy, QueryCancelled):
+            raise
+        except Exception as e:
+            if self.cancelled:
+                raise QueryCancelled("The query was cancelled") from e
+            raise query_error(connection, e)
+        finally:
+            record_stage('execute', elapsed + time.perf_counter() - started)
+
+class CachedRowStream:
+    """Replays a cached ResultSet with the same interface and batching as RowStream"""
+    
+    def __init__(self, result, batch_size=1000, max_rows=None):
+        self.columns = result.columns
+        self.type_codes = result.type_codes
+        self.types = result.types
+        self.rows = result.rows if max_rows is None else result.rows[:max_rows]
+        self.batch_size = batch_size
+        self.row_count = 0
+        self.truncated = len(result.rows) > len(self.rows)
+    
+    def __iter__(self):
+        for start in range(0, len(self.rows), self.batch_size):
+            rows = self.rows[start:start + self.batch_size]
+            self.row_count += len(rows)
+            count_rows(len(rows), source='cache')
+            yield rows
+
+# MySQL's max_execution_time and MariaDB's max_statement_time errors
+MYSQL_TIMEOUT_CODES = (3024, 1969)
+
+def is_statement_timeout(e):
+    """True if a driver error means the statement timeout cancelled the query"""
+    if isinstance(e, pymysql.err.MySQLError):
+        return bool(e.args) and e.args[0] in MYSQL_TIMEOUT_CODES
+    return isinstance(e, psycopg2.errors.QueryCanceled)
+
+def db_error_type(e):
+    """Short label for a driver error, following the branches of query_error"""
+    if is_statement_timeout(e):
+        return 'mysql_timeout' if isinstance(e, pymysql.err.MySQLError) else 'postgresql_timeout'
+    if isinstance(e, pymysql.err.OperationalError):
+        return {1045: 'mysql_access_denied', 2003: 'mysql_connect'}.get(e.args[0] if e.args else None, 'mysql_operational')
+    elif isinstance(e, pymysql.err.ProgrammingError):
+        return 'mysql_syntax'
+    elif isinstance(e, psycopg2.OperationalError):
+        error_message = str(e).lower()
+        if "password authentication failed" in error_message:
+            return 'postgresql_auth'
+        elif "could not connect to server" in error_message:
+            return 'postgresql_connect'
+        return 'postgresql_operational'
+    elif isinstance(e, psycopg2.ProgrammingError):
+        return 'postgresql_syntax'
+    return 'other'
+
+def query_error(connection, e):
+    """Translate a driver error raised while executing a query into a user-facing exception"""
+    count_error('execute', db_error_type(e))
+    if is_statement_timeout(e):
+        return statement_timeout_error(connection)
+    if isinstance(e, pymysql.err.OperationalError):
         # Handle MySQL errors
         error_code = e.args[0]
         if error_code == 1045:  # Access denied error
-            error_message = (
+            return Exception(
                 f"Access denied to MySQL database '{connection.database_name}' on host '{connection.host}'. "
                 f"Please verify your credentials and ensure that this server's IP address "
                 f"is allowed in your database's access control settings."
             )
-            raise Exception(error_message)
         elif error_code == 2003:  # Can't connect error
-            raise Exception(f"Cannot connect to MySQL server at '{connection.host}:{connection.port}'. "
-                          f"Please verify the hostname and port, and ensure the database server is running.")
-        else:
-            raise Exception(f"Database connection error ({error_code}): {str(e)}")
-    except pymysql.err.ProgrammingError as e:
-        raise Exception(f"MySQL syntax error: {str(e)}")
-    except psycopg2.OperationalError as e:
+            return Exception(f"Cannot connect to MySQL server at '{connection.host}:{connection.port}'. "
+                             f"Please verify the hostname and port, and ensure the database server is running.")
+        return Exception(f"Database connection error ({error_code}): {str(e)}")
+    elif isinstance(e, pymysql.err.ProgrammingError):
+        return Exception(f"MySQL syntax error: {str(e)}")
+    elif isinstance(e, psycopg2.OperationalError):
         # Handle PostgreSQL connection errors
         error_message = str(e)
         if "password authentication failed" in error_message.lower():
-            raise Exception(f"Authentication failed for PostgreSQL database. Please check your credentials.")
+            return Exception(f"Authentication failed for PostgreSQL database. Please check your credentials.")
         elif "could not connect to server" in error_message.lower():
-            raise Exception(f"Cannot connect to PostgreSQL server at '{connection.host}:{connection.port}'. "
-                          f"Please verify the hostname and port, and ensure the database server is running.")
-        else:
-            raise Exception(f"PostgreSQL error: {str(e)}")
-    except psycopg2.ProgrammingError as e:
+            return Exception(f"Cannot connect to PostgreSQL server at '{connection.host}:{connection.port}'. "
+                             f"Please verify the hostname and port, and ensure the database server is running.")
+        return Exception(f"PostgreSQL error: {str(e)}")
+    elif isinstance(e, psycopg2.ProgrammingError):
         # Handle PostgreSQL syntax errors
-        raise Exception(f"PostgreSQL syntax error: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Error executing query: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+        return Exception(f"PostgreSQL syntax error: {str(e)}")
+    return Exception(f"Error executing query: {str(e)}")
@@ -0,0 +1,204 @@
+import os
+import random
+import datetime
+from decimal import Decimal
+from collections import Counter
+from result_set import ResultSet
+
+# Rows kept as a representative sample of the result
+DIGEST_SAMPLE_ROWS = int(os.environ.get('DIGEST_SAMPLE_ROWS', 20))
+# Most frequent values reported per column
+DIGEST_TOP_K = 5
+# Columns with more distinct values than this stop tracking value frequencies
+DIGEST_DISTINCT_LIMIT = 1000
+# Longest rendering of a single value in the digest
+DIGEST_VALUE_WIDTH = 60
+
+_NUMBER_TYPES = (int, float, Decimal)
+_TIME_TYPES = (datetime.date, datetime.datetime, datetime.time)
+
+def _kind(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, _NUMBER_TYPES):
+        return 'number'
+    if isinstance(value, _TIME_TYPES):
+        return 'datetime'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return 'binary'
+    return 'text'
+
+def _time_key(value):
+    """Sort key putting dates, datetimes (naive or aware) and times on one timeline"""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time.min)
+    return datetime.datetime.combine(datetime.date.min, value.replace(tzinfo=None))
+
+# Sort keys of the kinds that get min/max; each makes the kind's mixed types comparable
+_ORDER_KEYS = {'number': float, 'datetime': _time_key}
+
+def _render(value):
+    """Short, prompt-safe rendering of a single value"""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<{len(value)} bytes>'
+    if isinstance(value, float):
+        text = f'{value:.6g}'
+    else:
+        text = str(value)
+    return text if len(text) <= DIGEST_VALUE_WIDTH else text[:DIGEST_VALUE_WIDTH - 3] + '...'
+
+class ColumnStats:
+    """Running statistics for one result column"""
+
+    def __init__(self, name):
+        self.name = name
+        self.kinds = Counter()
+        self.null_count = 0
+        # kind -> (minimum, maximum) over the values of that kind
+        self.bounds = {}
+        self.total = 0.0
+        self.numeric_count = 0
+        self.values = Counter()
+        self.high_cardinality = False
+
+    def add(self, values):
+        """Fold a batch of values (one column of a batch of rows) into the statistics"""
+        present = [value for value in values if value is not None]
+        self.null_count += len(values) - len(present)
+        if not present:
+            return
+
+        kinds = [_kind(value) for value in present]
+        self.kinds.update(kinds)
+        # Values of another kind (a stray string among numbers, say) are left out of min/max
+        for kind, key in _ORDER_KEYS.items():
+            comparable = [value for value, value_kind in zip(present, kinds) if value_kind == kind]
+            if not comparable:
+                continue
+            low, high = min(comparable, key=key), max(comparable, key=key)
+            if kind in self.bounds:
+                low = min(self.bounds[kind][0], low, key=key)
+                high = max(self.bounds[kind][1], high, key=key)
+            self.bounds[kind] = (low, high)
+            if kind == 'number':
+                # Decimals and floats don't add up directly
+                self.total += sum(map(float, comparable))
+                self.numeric_count += len(comparable)
+
+        if not self.high_cardinality:
+            self.values.update(value if isinstance(value, (str, int, bool)) else str(value)
+                               for value, kind in zip(present, kinds) if kind != 'binary')
+            if len(self.values) > DIGEST_DISTINCT_LIMIT:
+                # Frequencies of a near-unique column say nothing; stop paying for them
+                self.high_cardinality = True
+                self.values = Counter()
+
+    @property
+    def kind(self):
+        return self.kinds.most_common(1)[0][0] if self.kinds else 'null'
+
+    def describe(self, row_count):
+        parts = [f"{self.name} ({self.kind})"]
+        if self.null_count:
+            parts.append(f"nulls={self.null_count}")
+        if self.kind in self.bounds:
+            minimum, maximum = self.bounds[self.kind]
+            parts.append(f"min={_render(minimum)}")
+            parts.append(f"max={_render(maximum)}")
+        if self.numeric_count:
+            parts.append(f"mean={_render(self.total / self.numeric_count)}")
+        if self.high_cardinality:
+            parts.append(f"distinct>{DIGEST_DISTINCT_LIMIT}")
+        elif self.values:
+            parts.append(f"distinct={len(self.values)}")
+            # Top values are only informative when values actually repeat
+            if len(self.values) < row_count:
+                top = ', '.join(f"{_render(value)} ({count})" for value, count in self.values.most_common(DIGEST_TOP_K))
+                parts.append(f"top: {top}")
+        return '  - ' + '; '.join(parts)
+
+class ResultDigest:
+    """
+    A fixed-size summary of a query result for the explanation prompt
+
+    Rows are folded in batch by batch, one column at a time, so the digest
+    can be built while a result streams past without keeping the rows. It
+    records the row count, per-column type, null count, min/max/mean and most
+    frequent values, plus a reservoir sample of rows.
+    """
+
+    def __init__(self, columns=None, sample_size=DIGEST_SAMPLE_ROWS):
+        self.columns = list(columns) if columns else None
+        self.stats = [ColumnStats(name) for name in self.columns] if self.columns else None
+        self.sample_size = sample_size
+        self.sample = []
+        self.row_count = 0
+        self.affected_rows = None
+        self._random = random.Random(0)
+
+    @classmethod
+    def from_result(cls, result):
+        """Build a digest from an execute_sql_query result"""
+        if isinstance(result, dict):
+            digest = cls()
+            digest.affected_rows = result.get('affected_rows')
+        elif isinstance(result, ResultSet):
+            digest = cls(result.columns)
+            digest.add_rows(result.rows)
+        else:
+            digest = cls()
+            digest.add_rows(result or [])
+        return digest
+
+    def add_rows(self, rows):
+        """Fold a batch of rows, given as dicts or as sequences in column order"""
+        if not rows:
+            return
+        if isinstance(rows[0], dict):
+            if self.columns is None:
+                self.columns = list(rows[0].keys())
+            rows = [[row.get(column) for column in self.columns] for row in rows]
+        if self.stats is None:
+            self.columns = self.columns or [f"column_{i + 1}" for i in range(len(rows[0]))]
+            self.stats = [ColumnStats(name) for name in self.columns]
+
+        # Column-wise pass over the batch
+        for stats, values in zip(self.stats, zip(*rows)):
+            stats.add(values)
+
+        # Reservoir sampling keeps a uniform sample of all rows seen so far
+        for row in rows:
+            self.row_count += 1
+            if len(self.sample) < self.sample_size:
+                self.sample.append(row)
+            else:
+                slot = self._random.randrange(self.row_count)
+                if slot < self.sample_size:
+                    self.sample[slot] = row
+
+    def describe(self, sample_rows=None, max_columns=40):
+        """Render the digest as prompt text, with at most sample_rows sample rows"""
+        if self.affected_rows is not None:
+            return f"The statement affected {self.affected_rows} rows."
+        if not self.row_count:
+            return "The query returned no rows."
+
+        sample_rows = self.sample_size if sample_rows is None else sample_rows
+        columns = self.columns[:max_columns]
+        lines = [f"Row count: {self.row_count}", f"Columns ({len(self.columns)}):"]
+        lines.extend(stats.describe(self.row_count) for stats in self.stats[:max_columns])
+        if len(self.columns) > max_columns:
+            lines.append(f"  ... and {len(self.columns) - max_columns} more columns")
+
+        if sample_rows:
+            label = "All rows" if self.row_count <= sample_rows else f"Sample of {min(sample_rows, len(self.sample))} rows"
+            lines.append(f"{label} ({', '.join(columns)}):")
+            for row in self.sample[:sample_rows]:
+                lines.append('  ' + ' | '.join(_render(value) for value in row[:max_columns]))
+        return '\n'.join(lines)
@@ -0,0 +1,247 @@
+import io
+import os
+import csv
+import json
+from decimal import Decimal, Context, ROUND_HALF_EVEN
+from result_store import iter_result_pages, result_columns_of
+
+# Rows fetched from the cursor (and written to the file) per chunk
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+
+# Format name -> (MIME type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+class ExportUnavailable(Exception):
+    """The requested export format needs a library that isn't installed"""
+
+class StoredRowStream:
+    """Iterates over a stored result page by page with the same interface as RowStream"""
+
+    def __init__(self, query):
+        self.columns = result_columns_of(query) or []
+        self.row_count = 0
+        self.truncated = False
+        self._query = query
+
+    def __iter__(self):
+        for rows in iter_result_pages(self._query):
+            self.row_count += len(rows)
+            yield rows
+
+def _as_arrays(rows, columns):
+    """
+    Rows as value sequences in column order
+
+    RowStream and CachedRowStream yield tuples and stored pages yield lists,
+    both already in column order, and pass through unchanged. Dict rows,
+    such as those from a DictCursor, are converted.
+    """
+    if rows and isinstance(rows[0], dict):
+        return [[row.get(column) for column in columns] for row in rows]
+    return rows
+
+def _plain_value(value):
+    """JSON documents and binary values as text; everything else unchanged"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return value
+
+class _ChunkSink:
+    """Write-only file object that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def export_csv(stream):
+    """Yield a CSV file, header first, as one chunk of bytes per batch of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+
+    def drain():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data.encode()
+
+    for rows in stream:
+        if not header_written:
+            # RowStream only knows its columns once the first batch is fetched
+            writer.writerow(stream.columns or [])
+            header_written = True
+        writer.writerows([_plain_value(value) for value in row] for row in _as_arrays(rows, stream.columns))
+        yield drain()
+    if not header_written:
+        writer.writerow(stream.columns or [])
+        yield drain()
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportUnavailable("Arrow and Parquet exports need the pyarrow package, which is not installed")
+    return pyarrow
+
+# Driver type codes refining the portable type names (see result_set.py). PostgreSQL and
+# MySQL codes don't overlap within a type name, so neither needs the database type.
+_FLOAT_CODES = {700, 701, 4, 5}
+# PostgreSQL money arrives as formatted text, timetz as times Arrow can't hold
+_TEXT_CODES = {790, 1266}
+_TIMESTAMPTZ_CODES = {1184}
+# Decimals are written with this many digits after the point (rounded half-even),
+# leaving 56 for the integer part; larger values fail the export
+DECIMAL_SCALE = 20
+_DECIMAL_QUANTUM = Decimal(1).scaleb(-DECIMAL_SCALE)
+_DECIMAL_CONTEXT = Context(prec=76, rounding=ROUND_HALF_EVEN)
+
+def _arrow_type(pa, type_name, type_code):
+    """Arrow type for a column of a portable type name, or None to infer it from the data"""
+    if type_code in _TEXT_CODES:
+        return pa.string()
+    if type_name == 'boolean':
+        return pa.bool_()
+    if type_name == 'integer':
+        return pa.int64()
+    if type_name == 'number':
+        return pa.float64() if type_code in _FLOAT_CODES else pa.decimal256(76, DECIMAL_SCALE)
+    if type_name == 'date':
+        return pa.date32()
+    if type_name == 'datetime':
+        return pa.timestamp('us', tz='UTC' if type_code in _TIMESTAMPTZ_CODES else None)
+    if type_name == 'time':
+        return pa.time64('us')
+    if type_name == 'interval':
+        return pa.duration('us')
+    if type_name in ('text', 'json', 'binary', 'uuid'):
+        return pa.string()
+    return None
+
+def _decimal(value):
+    if not isinstance(value, Decimal):
+        value = Decimal(value)
+    return value.quantize(_DECIMAL_QUANTUM, context=_DECIMAL_CONTEXT)
+
+class _ArrowBatches:
+    """
+    Converts row batches to Arrow record batches with a fixed schema
+
+    The schema comes from the stream's column types (RowStream and
+    CachedRowStream carry them). Columns of unknown type, and every column of
+    a stored result, which keeps no types, are inferred from the first batch;
+    columns that are all NULL there become strings. JSON, binary and UUID
+    columns are written as strings. Each column is built from its values and
+    then cast to the schema type with safe=True, so a value that doesn't fit
+    (2.5 in an integer column, say) fails the export instead of being
+    silently truncated.
+    """
+
+    def __init__(self, pa, columns, types=None, type_codes=None):
+        self.pa = pa
+        self.columns = columns
+        self.types = types or [None] * len(columns)
+        self.type_codes = type_codes or [None] * len(columns)
+        self.schema = None
+
+    def _make_schema(self, arrays):
+        pa = self.pa
+        fields = []
+        for column, type_name, type_code, values in zip(self.columns, self.types, self.type_codes, arrays):
+            field_type = _arrow_type(pa, type_name, type_code)
+            if field_type is None:
+                field_type = pa.array(values).type
+                if pa.types.is_null(field_type):
+                    field_type = pa.string()
+                elif pa.types.is_decimal(field_type):
+                    field_type = pa.decimal256(76, DECIMAL_SCALE)
+            fields.append(pa.field(column, field_type))
+        return pa.schema(fields)
+
+    def _array(self, values, field_type):
+        pa = self.pa
+        if pa.types.is_string(field_type):
+            values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+        elif pa.types.is_decimal(field_type):
+            values = [None if value is None else _decimal(value) for value in values]
+        array = pa.array(values)
+        return array if array.type == field_type else array.cast(field_type, safe=True)
+
+    def convert(self, rows):
+        pa = self.pa
+        rows = _as_arrays(rows, self.columns)
+        arrays = [[_plain_value(value) for value in column] for column in zip(*rows)] if rows \
+            else [[] for _ in self.columns]
+        if self.schema is None:
+            self.schema = self._make_schema(arrays)
+        return pa.record_batch([self._array(values, field.type) for field, values in zip(self.schema, arrays)],
+                               schema=self.schema)
+
+def export_arrow(stream, file_format='arrow'):
+    """Yield an Arrow IPC stream or a Parquet file as one chunk of bytes per batch of rows"""
+    pa = _import_pyarrow()
+    sink = _ChunkSink()
+    batches = None
+    writer = None
+
+    def open_writer(schema):
+        if file_format == 'parquet':
+            return pa.parquet.ParquetWriter(sink, schema)
+        return pa.ipc.new_stream(sink, schema)
+
+    for rows in stream:
+        if batches is None:
+            batches = _ArrowBatches(pa, stream.columns or [], getattr(stream, 'types', None),
+                                    getattr(stream, 'type_codes', None))
+        batch = batches.convert(rows)
+        if writer is None:
+            writer = open_writer(batches.schema)
+        if file_format == 'parquet':
+            # Each batch becomes a row group, so only one batch is buffered at a time
+            writer.write_batch(batch, row_group_size=len(rows))
+        else:
+            writer.write_batch(batch)
+        yield sink.drain()
+
+    if writer is None:
+        writer = open_writer(pa.schema([pa.field(column, pa.string()) for column in stream.columns or []]))
+    writer.close()
+    yield sink.drain()
+
+def export_rows(stream, file_format):
+    """Yield the rows of a RowStream-like stream encoded in one of EXPORT_FORMATS"""
+    if file_format == 'csv':
+        return export_csv(stream)
+    if file_format in ('arrow', 'parquet'):
+        # Fail before any rows are fetched if pyarrow is missing
+        _import_pyarrow()
+        return export_arrow(stream, file_format)
+    raise ValueError(f"Unsupported export format: {file_format}")
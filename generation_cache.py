@@ -0,0 +1,95 @@
+import os
+import re
+import ai
+from cache import TTLCache
+from schema_cache import get_cached_fingerprint
+from schema_index import prune_schema
+from join_graph import get_join_graph
+from sql_validation import clean_sql, validate_sql, SQLValidationError
+from metrics import timed, count_validation, register_cache
+
+# Generated SQL is reused for at most this many seconds
+GENERATION_CACHE_TTL = int(os.environ.get('GENERATION_CACHE_TTL', 24 * 3600))
+GENERATION_CACHE_SIZE = int(os.environ.get('GENERATION_CACHE_SIZE', 2048))
+# Model calls allowed to fix generated SQL that fails local validation
+SQL_REPAIR_ATTEMPTS = int(os.environ.get('SQL_REPAIR_ATTEMPTS', 2))
+
+_generation_cache = TTLCache(maxsize=GENERATION_CACHE_SIZE, ttl=GENERATION_CACHE_TTL)
+
+def normalize_question(question):
+    """Normalize a question so trivial differences in case, spacing and punctuation share a cache entry"""
+    question = re.sub(r'\s+', ' ', question.strip().lower())
+    return question.strip('"\'').rstrip('?.! ')
+
+def get_generated_sql(connection, natural_language_query, schema_info, bypass_cache=False):
+    """
+    Return (sql_query, cached) for a question, calling the LLM only on a cache miss
+
+    Entries are keyed by connection, schema fingerprint, normalized question and
+    database type, so any schema change naturally misses. With bypass_cache the
+    LLM is always called and the fresh SQL replaces the cached entry. Only SQL
+    that passes local validation is returned or cached; raises
+    SQLValidationError otherwise.
+    """
+    fingerprint = get_cached_fingerprint(connection)
+    key = None
+    if fingerprint is not None:
+        key = (connection.id, fingerprint, normalize_question(natural_language_query), connection.db_type.lower())
+        if not bypass_cache:
+            sql_query = _generation_cache.get(key)
+            if sql_query is not None:
+                return sql_query, True
+
+    # Only the tables relevant to the question go into the prompt
+    relevant_schema = prune_schema(connection.id, fingerprint, schema_info, natural_language_query)
+    # ... along with how they join, so the model doesn't have to guess join keys
+    join_paths = get_join_graph(connection.id, fingerprint, schema_info).describe_paths(list(relevant_schema))
+    sql_query = ai.generate_sql_query(
+        natural_language_query,
+        relevant_schema,
+        db_type=connection.db_type,
+        join_paths=join_paths
+    )
+    sql_query = validated_sql(connection, natural_language_query, sql_query, schema_info, relevant_schema)
+    if key is not None:
+        _generation_cache.set(key, sql_query)
+    return sql_query, False
+
+def validated_sql(connection, natural_language_query, sql_query, schema_info, relevant_schema):
+    """
+    Clean generated SQL and validate it against the full schema
+
+    Invalid SQL is sent back to the model with the error, at most
+    SQL_REPAIR_ATTEMPTS times, so it never reaches the customer database.
+    """
+    attempts = 0
+    while True:
+        sql_query = clean_sql(sql_query)
+        try:
+            with timed('validate'):
+                validate_sql(sql_query, schema_info, connection.db_type, connection.database_name)
+        except ValueError as e:
+            if attempts >= SQL_REPAIR_ATTEMPTS:
+                count_validation('invalid', attempts)
+                raise SQLValidationError(f"The generated SQL is invalid: {e}", sql_query)
+            attempts += 1
+            sql_query = ai.repair_sql_query(
+                natural_language_query,
+                relevant_schema,
+                sql_query,
+                str(e),
+                db_type=connection.db_type
+            )
+            continue
+        count_validation('repaired' if attempts else 'valid', attempts)
+        return sql_query
+
+def invalidate_generated_sql(conn_id):
+    """Drop all cached SQL generated for a connection"""
+    _generation_cache.discard_where(lambda key: key[0] == conn_id)
+
+def generation_cache_stats():
+    """Hit/miss counters and size of the generation cache"""
+    return _generation_cache.stats()
+
+register_cache('generation', generation_cache_stats)
@@ -0,0 +1,206 @@
+import json
+import time
+import queue
+import uuid
+import logging
+import threading
+from extensions import db
+from models import DatabaseConnection, QueryJob
+from pipeline import run_query_pipeline, run_full_query, PipelineError, QueryCancelled
+
+logger = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    """Raised when the job queue cannot accept more work"""
+
+class JobQueue:
+    """
+    Runs query pipelines on a pool of background worker threads
+
+    Job state lives in the QueryJob table, so any gunicorn worker can answer
+    status polls. The queue itself is an in-process stand-in for an external
+    broker: it is bounded (JOB_QUEUE_SIZE) and submissions beyond that raise
+    QueueFull. Worker threads (JOB_WORKERS) are started on first use so they
+    are never created before gunicorn forks.
+
+    A job given its SQL (the full run behind a preview) skips generation and
+    can be cancelled. The cancel flag is stored on the job; the process
+    running it interrupts the query right away if the request reached it,
+    and otherwise its watcher thread notices the flag within
+    JOB_EVENT_POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._threads = []
+        self._lock = threading.Lock()
+        # job id -> RowStream of the jobs this process is running, for cancellation
+        self._streams = {}
+        self._watcher = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('JOB_WORKERS', 4)
+        self.poll_interval = app.config.get('JOB_EVENT_POLL_INTERVAL', 0.25)
+        self._queue = queue.Queue(maxsize=app.config.get('JOB_QUEUE_SIZE', 100))
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f'query-job-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=self._watch_cancellations, name='query-job-cancel', daemon=True)
+                self._watcher.start()
+
+    def depth(self):
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    def submit(self, connection, natural_language_query, user_id, bypass_cache=False, sql_query=None):
+        """
+        Record and enqueue a job, returning the QueryJob; raises QueueFull under backpressure
+
+        With sql_query the job runs that SQL for the question (see
+        run_full_query) instead of the whole pipeline.
+        """
+        if self._queue.full():
+            raise QueueFull(f"The query queue is full ({self._queue.maxsize} jobs waiting). Please try again shortly.")
+
+        job = QueryJob(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            connection_id=connection.id,
+            natural_language=natural_language_query,
+            bypass_cache=bool(bypass_cache),
+            sql_query=sql_query
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait(job.id)
+        except queue.Full:
+            job.status = 'failed'
+            job.error = json.dumps({'success': False, 'error': 'The query queue is full. Please try again shortly.'})
+            db.session.commit()
+            raise QueueFull("The query queue is full. Please try again shortly.")
+        return job
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                with self.app.app_context():
+                    try:
+                        self._run(job_id)
+                    finally:
+                        db.session.remove()
+            except Exception:
+                logger.exception("Query job %s crashed", job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        job = db.session.get(QueryJob, job_id)
+        if job is None:
+            return
+        connection = db.session.get(DatabaseConnection, job.connection_id)
+        progress = []
+        started = time.monotonic()
+
+        def on_stage(stage, **info):
+            # Each stage start is committed so pollers see it immediately
+            progress.append(dict(info, stage=stage, elapsed=round(time.monotonic() - started, 3)))
+            job.stage = stage
+            job.progress = json.dumps(progress, default=str)
+            db.session.commit()
+
+        if job.cancel_requested:
+            job.status = 'cancelled'
+            db.session.commit()
+            return
+        if connection is None:
+            job.status = 'failed'
+            job.error = json.dumps({'success': False, 'error': 'The database connection was deleted before the question ran'})
+            db.session.commit()
+            return
+        job.status = 'running'
+        db.session.commit()
+        try:
+            if job.sql_query:
+                payload = run_full_query(connection, job.natural_language, job.sql_query, job.bypass_cache,
+                                         progress=on_stage, on_stream=lambda stream: self._track(job_id, stream))
+                job.row_count = payload['row_count']
+                job.truncated = payload['truncated']
+            else:
+                payload = run_query_pipeline(connection, job.natural_language, job.bypass_cache, progress=on_stage)
+            job.status = 'succeeded'
+            job.query_id = payload['query_id']
+        except QueryCancelled:
+            db.session.rollback()
+            job.status = 'cancelled'
+        except PipelineError as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = json.dumps(e.payload, default=str)
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = json.dumps({'success': False, 'error': f"An unexpected error occurred: {str(e)}"})
+        finally:
+            with self._lock:
+                self._streams.pop(job_id, None)
+        db.session.commit()
+
+    def _track(self, job_id, stream):
+        with self._lock:
+            self._streams[job_id] = stream
+        # The cancel request may have come in while the job was starting
+        if db.session.execute(db.select(QueryJob.cancel_requested).filter_by(id=job_id)).scalar():
+            stream.cancel()
+
+    def cancel(self, job):
+        """Ask a queued or running job to stop; returns False if it had already finished"""
+        if job.is_finished:
+            return False
+        job.cancel_requested = True
+        db.session.commit()
+        with self._lock:
+            stream = self._streams.get(job.id)
+        if stream is not None:
+            stream.cancel()
+        return True
+
+    def _watch_cancellations(self):
+        """Cancel the running jobs of this process that were cancelled through another process"""
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                running = dict(self._streams)
+            if not running:
+                continue
+            try:
+                with self.app.app_context():
+                    try:
+                        cancelled = db.session.execute(
+                            db.select(QueryJob.id).where(QueryJob.id.in_(list(running)), QueryJob.cancel_requested)
+                        ).scalars().all()
+                    finally:
+                        db.session.remove()
+            except Exception:
+                logger.exception("Checking for cancelled query jobs failed")
+                continue
+            for job_id in cancelled:
+                stream = running[job_id]
+                if not stream.cancelled:
+                    stream.cancel()
+
+# Shared job queue, bound to the app in app.py
+job_queue = JobQueue()
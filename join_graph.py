@@ -0,0 +1,148 @@
+import os
+from collections import deque
+from cache import TTLCache
+
+# Join paths longer than this many foreign-key hops are left out of the prompt
+JOIN_PATH_MAX_HOPS = int(os.environ.get('JOIN_PATH_MAX_HOPS', 3))
+# Most join paths listed in one generation prompt
+JOIN_PATHS_MAX = int(os.environ.get('JOIN_PATHS_MAX', 30))
+# Schemas with at most this many tables get all shortest paths computed up front;
+# larger ones compute them per source table on first use
+JOIN_GRAPH_PRECOMPUTE_TABLES = int(os.environ.get('JOIN_GRAPH_PRECOMPUTE_TABLES', 500))
+
+_graph_cache = TTLCache(maxsize=256, ttl=0)
+
+class JoinGraph:
+    """
+    Foreign-key graph of a schema with the shortest join paths between its tables
+
+    Tables are nodes; each foreign key is an undirected edge carrying its join
+    condition. Shortest paths are found by a breadth-first search from each
+    source table and kept, so every path lookup after the first is a walk up
+    the stored parents.
+    """
+
+    def __init__(self, schema_info):
+        self.schema_info = schema_info
+        self.edges = []
+        self.neighbors = {table: {} for table in schema_info}
+        self._parents = {}
+
+        # Column pairs grouped by foreign key constraint; a reference without a
+        # constraint name (from an older snapshot) is a key of its own
+        references = {}
+        for table, columns in schema_info.items():
+            for column in columns:
+                reference = column.get('References')
+                if reference and reference['table'] in schema_info:
+                    constraint = reference.get('constraint') or column['Field']
+                    references.setdefault((table, reference['table'], constraint), []).append(
+                        (column['Field'], reference['column']))
+
+        for (table, referenced_table, _), key in sorted(references.items()):
+            condition = ' AND '.join(f"{table}.{column} = {referenced_table}.{referenced}"
+                                     for column, referenced in key)
+            self.edges.append({
+                'from': table,
+                'to': referenced_table,
+                'columns': [column for column, _ in key],
+                'referenced_columns': [referenced for _, referenced in key],
+                'condition': condition
+            })
+            if table != referenced_table:
+                self.neighbors[table].setdefault(referenced_table, []).append(condition)
+                self.neighbors[referenced_table].setdefault(table, []).append(condition)
+
+        if len(schema_info) <= JOIN_GRAPH_PRECOMPUTE_TABLES:
+            for table in schema_info:
+                self._shortest_paths(table)
+
+    def _shortest_paths(self, source):
+        """Breadth-first search from source: {table: previous table on a shortest path}"""
+        parents = self._parents.get(source)
+        if parents is None:
+            parents = {source: None}
+            queue = deque([source])
+            while queue:
+                table = queue.popleft()
+                for neighbor in sorted(self.neighbors[table]):
+                    if neighbor not in parents:
+                        parents[neighbor] = table
+                        queue.append(neighbor)
+            self._parents[source] = parents
+        return parents
+
+    def path(self, source, target):
+        """Tables on a shortest join path from source to target (both included), or None"""
+        if source not in self.neighbors or target not in self.neighbors:
+            return None
+        parents = self._shortest_paths(source)
+        if target not in parents:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(parents[path[-1]])
+        return path[::-1]
+
+    def join_conditions(self, path):
+        """The join condition of each hop of a path (the first foreign key when there are several)"""
+        return [self.neighbors[table][next_table][0] for table, next_table in zip(path, path[1:])]
+
+    def relevant_paths(self, tables, max_hops=JOIN_PATH_MAX_HOPS, limit=JOIN_PATHS_MAX):
+        """
+        Shortest join paths between pairs of the given tables, shortest first
+
+        A path through another of the given tables is left out: it is a chain
+        of shorter paths that are already listed.
+        """
+        tables = [table for table in tables if table in self.neighbors]
+        selected = set(tables)
+        paths = []
+        for i, source in enumerate(tables):
+            for target in tables[i + 1:]:
+                path = self.path(source, target)
+                if path is None or len(path) - 1 > max_hops:
+                    continue
+                if any(table in selected for table in path[1:-1]):
+                    continue
+                paths.append(path)
+        paths.sort(key=lambda path: (len(path), path))
+        return paths[:limit]
+
+    def describe_paths(self, tables, max_hops=JOIN_PATH_MAX_HOPS, limit=JOIN_PATHS_MAX):
+        """Render the join paths (and self-references) among tables for the generation prompt"""
+        lines = []
+        for path in self.relevant_paths(tables, max_hops, limit):
+            alternatives = len(self.neighbors[path[0]][path[1]]) - 1 if len(path) == 2 else 0
+            line = f"  - {' -> '.join(path)}: {'; '.join(self.join_conditions(path))}"
+            if alternatives:
+                line += f" (or {'; '.join(self.neighbors[path[0]][path[1]][1:])})"
+            lines.append(line)
+        selected = set(tables)
+        for edge in self.edges:
+            if edge['from'] == edge['to'] and edge['from'] in selected:
+                lines.append(f"  - {edge['from']} (self join): {edge['condition']}")
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        """JSON-serializable nodes and foreign-key edges"""
+        return {
+            'tables': [
+                {'name': table, 'columns': len(columns), 'degree': len(self.neighbors[table])}
+                for table, columns in self.schema_info.items()
+            ],
+            'edges': self.edges
+        }
+
+def get_join_graph(conn_id, fingerprint, schema_info):
+    """Return the join graph of a cached schema, building it once per schema fingerprint"""
+    key = (conn_id, fingerprint)
+    graph = _graph_cache.get(key)
+    if graph is None or graph.schema_info is not schema_info:
+        graph = JoinGraph(schema_info)
+        _graph_cache.set(key, graph)
+    return graph
+
+def invalidate_join_graph(conn_id):
+    """Forget the join graphs built for a connection"""
+    _graph_cache.discard_where(lambda key: key[0] == conn_id)
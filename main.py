@@ -1,6 +1,9 @@
-from app import app, db
+from app import create_app
+from extensions import db
 from flask_migrate import Migrate
 
+app = create_app()
+
 # Initialize Flask-Migrate
 migrate = Migrate(app, db)
 
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from flask import Blueprint, Response, request, g, has_request_context, abort
+
+# Each process writes its metrics here; /metrics merges the files of all live processes
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'sqlai-metrics')
+# Seconds between writes of this process's metrics file
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# If set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_HELP = {
+    'sqlai_stage_seconds': ('histogram', 'Time spent in each stage of answering a question'),
+    'sqlai_llm_tokens_total': ('counter', 'Tokens used by OpenAI calls'),
+    'sqlai_rows_returned_total': ('counter', 'Rows returned by SELECT queries'),
+    'sqlai_result_bytes_total': ('counter', 'Bytes of JSON result data stored'),
+    'sqlai_db_errors_total': ('counter', 'Database errors by stage and type'),
+    'sqlai_sql_validations_total': ('counter', 'Generated SQL checked locally, by outcome'),
+    'sqlai_sql_repair_attempts_total': ('counter', 'Model calls made to repair invalid generated SQL'),
+    'sqlai_db_ping_seconds': ('histogram', 'Latency of health check pings to saved databases'),
+    'sqlai_db_ping_failures_total': ('counter', 'Health check pings that failed'),
+    'sqlai_execution_wait_seconds': ('histogram', 'Time queries waited for an execution slot, by outcome'),
+    'sqlai_execution_rejected_total': ('counter', 'Queries turned away because their database was busy, by reason'),
+    'sqlai_execution_queue_depth': ('gauge', 'Queries waiting for an execution slot'),
+    'sqlai_execution_running': ('gauge', 'Queries holding an execution slot'),
+    'sqlai_cache_hits_total': ('counter', 'Lookups answered from an in-memory cache, by cache'),
+    'sqlai_cache_misses_total': ('counter', 'Lookups an in-memory cache could not answer, by cache'),
+    'sqlai_cache_entries': ('gauge', 'Entries held by an in-memory cache'),
+    'sqlai_cache_bytes': ('gauge', 'Memory held by a size-bounded in-memory cache'),
+}
+
+metrics_bp = Blueprint('metrics', __name__)
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms shared by the worker processes through files
+
+    Updates are kept in memory and written to METRICS_DIR/<pid>.json at most
+    every METRICS_FLUSH_INTERVAL seconds (and whenever /metrics is rendered),
+    so gunicorn workers don't need shared memory. Rendering sums the files of
+    all processes that are still alive; files of exited processes are removed.
+    Gauges are summed too, so a gauge reads as the total over all processes.
+    """
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._collectors = []
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self._maybe_flush()
+
+    def set(self, name, value, labels=None):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+        self._maybe_flush()
+
+    def observe(self, name, value, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            # Per-bucket counts (not cumulative), then +Inf, sum and count
+            entry = self.histograms.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0])
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            else:
+                entry[len(LATENCY_BUCKETS)] += 1
+            entry[-2] += value
+            entry[-1] += 1
+        self._maybe_flush()
+
+    def add_collector(self, collect):
+        """Register a function returning [(name, labels, value)] read each time this process's file is written"""
+        self._collectors.append(collect)
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write this process's metrics file"""
+        collected = []
+        for collect in self._collectors:
+            try:
+                collected.extend([name, _label_key(labels), value] for name, labels, value in collect())
+            except Exception:
+                pass
+        with self._lock:
+            self._flushed_at = time.monotonic()
+            data = {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, labels, value] for (name, labels), value in self.gauges.items()] + collected,
+                'histograms': [[name, labels, entry] for (name, labels), entry in self.histograms.items()],
+            }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{os.getpid()}.json")
+            with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False, suffix='.tmp') as f:
+                json.dump(data, f)
+            os.replace(f.name, path)
+        except OSError:
+            # Metrics must never break a request
+            pass
+
+    def collect(self):
+        """Sum the metrics of every live process: ({(name, labels): value}, {(name, labels): entry})"""
+        self.flush()
+        counters, histograms = {}, {}
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        for file_name in names:
+            if not file_name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, file_name)
+            if not _pid_alive(file_name[:-5]):
+                _remove_quietly(path)
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # Counters and gauges share one namespace; render tells them apart by name
+            for name, labels, value in data['counters'] + data.get('gauges', []):
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, entry in data['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(entry))
+                for i, value in enumerate(entry):
+                    total[i] += value
+        return counters, histograms
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text) in _HELP.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind in ('counter', 'gauge'):
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            else:
+                for (metric, labels), entry in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), entry):
+                        cumulative += count
+                        bucket_labels = labels + (('le', str(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(entry[-2])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {entry[-1]}")
+        return '\n'.join(lines) + '\n'
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, PermissionError, OSError):
+        return True
+    return True
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Metrics of this process
+registry = MetricsRegistry()
+
+@contextmanager
+def timed(stage):
+    """
+    Time a stage into the sqlai_stage_seconds histogram and the Server-Timing header
+
+    Works as a context manager or a decorator. Outside a request (e.g. in a
+    job worker thread) only the histogram is updated.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+def record_stage(stage, elapsed):
+    """Record a stage duration measured by the caller"""
+    registry.observe('sqlai_stage_seconds', elapsed, {'stage': stage})
+    if has_request_context():
+        timings = g.setdefault('server_timing', {})
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def count_tokens(model, usage):
+    """Count the prompt and completion tokens of an OpenAI response's usage block"""
+    if usage is None:
+        return
+    registry.inc('sqlai_llm_tokens_total', {'model': model, 'kind': 'prompt'}, usage.prompt_tokens or 0)
+    registry.inc('sqlai_llm_tokens_total', {'model': model, 'kind': 'completion'}, usage.completion_tokens or 0)
+
+def count_rows(count, source='database'):
+    registry.inc('sqlai_rows_returned_total', {'source': source}, count)
+
+def count_result_bytes(count):
+    registry.inc('sqlai_result_bytes_total', amount=count)
+
+def count_error(stage, error_type):
+    registry.inc('sqlai_db_errors_total', {'stage': stage, 'type': error_type})
+
+def count_validation(outcome, repair_attempts=0):
+    """Record one validation outcome (valid, repaired or invalid) and the repair calls it took"""
+    registry.inc('sqlai_sql_validations_total', {'outcome': outcome})
+    if repair_attempts:
+        registry.inc('sqlai_sql_repair_attempts_total', amount=repair_attempts)
+
+def record_ping(db_type, seconds):
+    """Record a health check ping; seconds is None when the ping failed"""
+    if seconds is None:
+        registry.inc('sqlai_db_ping_failures_total', {'db_type': db_type})
+    else:
+        registry.observe('sqlai_db_ping_seconds', seconds, {'db_type': db_type})
+
+def record_execution_wait(db_type, seconds, outcome):
+    """Record how long a query waited for an execution slot; outcome is 'run' or the busy reason"""
+    registry.observe('sqlai_execution_wait_seconds', seconds, {'db_type': db_type, 'outcome': outcome})
+    if outcome != 'run':
+        registry.inc('sqlai_execution_rejected_total', {'db_type': db_type, 'reason': outcome})
+
+def set_execution_load(db_type, running, waiting):
+    """Publish this process's running and waiting query counts for a database type"""
+    registry.set('sqlai_execution_running', running, {'db_type': db_type})
+    registry.set('sqlai_execution_queue_depth', waiting, {'db_type': db_type})
+
+def register_cache(cache, stats):
+    """Publish a cache's stats() (hits, misses, size and bytes) with this process's metrics"""
+    def collect():
+        values = stats()
+        labels = {'cache': cache}
+        entries = [('sqlai_cache_hits_total', labels, values['hits']),
+                   ('sqlai_cache_misses_total', labels, values['misses']),
+                   ('sqlai_cache_entries', labels, values['size'])]
+        if 'bytes' in values:
+            entries.append(('sqlai_cache_bytes', labels, values['bytes']))
+        return entries
+    registry.add_collector(collect)
+
+@metrics_bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@metrics_bp.after_app_request
+def add_server_timing(response):
+    """Report the stage timings of this request in a Server-Timing header"""
+    timings = g.get('server_timing') or {}
+    entries = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings.items()]
+    if 'request_started' in g:
+        entries.append(f"total;dur={(time.perf_counter() - g.request_started) * 1000:.1f}")
+    if entries:
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        abort(401)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,27 +1,15 @@
-import os
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate, init, migrate, upgrade
-from sqlalchemy.orm import DeclarativeBase
+from app import create_app
+from extensions import db
 
-class Base(DeclarativeBase):
-    pass
-
-# Database setup
-db = SQLAlchemy(model_class=Base)
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_recycle': 300,
-    'pool_pre_ping': True,
-}
-db.init_app(app)
+# Same app, configuration and SQLAlchemy instance as the web server
+app = create_app()
 
 # Initialize Flask-Migrate
 migrate_instance = Migrate(app, db)
 
 # Import models
-from models import User, DatabaseConnection, Query
+from models import User, DatabaseConnection, Query, QueryResultPage, QueryJob, SchemaSnapshot, ConnectionHealth
 
 def run_migrations():
     """Run database migrations"""
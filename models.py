@@ -1,9 +1,11 @@
 from flask_login import UserMixin
 from datetime import datetime
+import json
 from werkzeug.security import generate_password_hash, check_password_hash
 from cryptography.fernet import Fernet
 import base64
 from extensions import db
+from metrics import timed, LATENCY_BUCKETS
 
 class User(UserMixin, db.Model):
     """User model for authentication"""
@@ -40,9 +42,31 @@ class DatabaseConnection(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     # Add database type with MySQL as default
     db_type = db.Column(db.String(20), default='mysql', nullable=False)
+    # Seconds SELECT results are reused (see result_cache.py); NULL uses the default, 0 disables
+    result_cache_ttl = db.Column(db.Integer, nullable=True)
+    # Pre-flight EXPLAIN thresholds and statement timeout (see preflight.py);
+    # NULL uses the default, 0 disables
+    max_estimated_rows = db.Column(db.BigInteger, nullable=True)
+    max_estimated_cost = db.Column(db.Float, nullable=True)
+    # 'limit' or 'reject'
+    preflight_action = db.Column(db.String(10), nullable=True)
+    preflight_limit = db.Column(db.Integer, nullable=True)
+    statement_timeout = db.Column(db.Integer, nullable=True)
+    # Queries run at once against this database, in total and per user (see scheduler.py);
+    # NULL uses the default, 0 disables
+    max_concurrent_queries = db.Column(db.Integer, nullable=True)
+    max_user_queries = db.Column(db.Integer, nullable=True)
+    # Read replicas of the database as 'host[:port], ...' with the same credentials, and
+    # how reads pick one: 'round_robin' or 'least_latency' (see pool.py); NULL reads from the primary
+    replica_hosts = db.Column(db.Text, nullable=True)
+    replica_selection = db.Column(db.String(16), nullable=True)
     
     # Relationship to queries
     queries = db.relationship('Query', backref='connection', lazy=True)
+    # Persisted schema snapshot, removed with the connection
+    schema_snapshot = db.relationship('SchemaSnapshot', uselist=False, lazy=True, cascade='all, delete-orphan')
+    # Latest health check results (see monitor.py)
+    health = db.relationship('ConnectionHealth', uselist=False, lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
         """Encrypt the database password using Fernet symmetric encryption"""
@@ -55,6 +79,7 @@ class DatabaseConnection(db.Model):
         # Format: key:encrypted_password
         self.password_hash = f"{key.decode()}:{encrypted_pw.decode()}"
     
+    @timed('decrypt')
     def get_password(self):
         """Decrypt the database password for connection using the stored key"""
         if not self.password_hash:
@@ -99,10 +124,168 @@ class Query(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     natural_language = db.Column(db.Text, nullable=False)
     sql_query = db.Column(db.Text, nullable=True)
-    result = db.Column(db.Text, nullable=True)
-    natural_language_result = db.Column(db.Text, nullable=True)
+    # Large text columns are deferred: they load on first access, so history
+    # listings only read the summary columns
+    result = db.deferred(db.Column(db.Text, nullable=True))
+    natural_language_result = db.deferred(db.Column(db.Text, nullable=True))
     connection_id = db.Column(db.Integer, db.ForeignKey('database_connection.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Paged, compressed result storage (see result_store.py). The legacy `result`
+    # column only holds old row results and write summaries such as affected_rows.
+    result_columns = db.deferred(db.Column(db.Text, nullable=True))
+    result_row_count = db.Column(db.Integer, nullable=True)
+    result_page_size = db.Column(db.Integer, nullable=True)
+    result_blob_path = db.Column(db.String(512), nullable=True)
+    
+    # Relationship to stored result pages
+    result_pages = db.relationship('QueryResultPage', backref='source_query', lazy='dynamic',
+                                   cascade='all, delete-orphan')
+    
+    # History is listed newest first per connection (keyset pagination, see query_history)
+    __table_args__ = (
+        db.Index('ix_query_connection_created', 'connection_id', 'created_at', 'id'),
+    )
+    
+    @property
+    def history_cursor(self):
+        """Keyset cursor pointing just after this query in the history"""
+        return f"{self.created_at.isoformat()}_{self.id}"
+    
+    def to_history_dict(self):
+        """JSON-serializable summary for the history listing (no deferred columns)"""
+        return {
+            'id': self.id,
+            'natural_language': self.natural_language,
+            'sql_query': self.sql_query,
+            'result_row_count': self.result_row_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
     
     def __repr__(self):
         return f'<Query {self.id}>'
+
+class QueryResultPage(db.Model):
+    """One zlib-compressed page of a stored query result (rows as JSON arrays)"""
+    id = db.Column(db.Integer, primary_key=True)
+    query_id = db.Column(db.Integer, db.ForeignKey('query.id'), nullable=False)
+    page = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('query_id', 'page', name='uq_query_result_page'),
+    )
+    
+    def __repr__(self):
+        return f'<QueryResultPage {self.query_id}:{self.page}>'
+
+class QueryJob(db.Model):
+    """A natural language query run asynchronously by the job queue (see jobs.py)"""
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    connection_id = db.Column(db.Integer, db.ForeignKey('database_connection.id'), nullable=False)
+    natural_language = db.Column(db.Text, nullable=False)
+    bypass_cache = db.Column(db.Boolean, default=False, nullable=False)
+    # SQL already generated for the question (the full run after a preview); NULL runs the whole pipeline
+    sql_query = db.Column(db.Text, nullable=True)
+    # queued, running, succeeded, failed or cancelled
+    status = db.Column(db.String(16), default='queued', nullable=False)
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    # Rows fetched by a full run, and whether QUERY_MAX_ROWS cut the result short
+    row_count = db.Column(db.Integer, nullable=True)
+    truncated = db.Column(db.Boolean, nullable=True)
+    stage = db.Column(db.String(16), nullable=True)
+    # JSON list of {stage, elapsed, ...} entries, one per started stage
+    progress = db.Column(db.Text, nullable=True)
+    query_id = db.Column(db.Integer, db.ForeignKey('query.id'), nullable=True)
+    # JSON error payload when the job failed
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed', 'cancelled')
+    
+    def progress_entries(self):
+        return json.loads(self.progress) if self.progress else []
+    
+    def to_dict(self):
+        """JSON-serializable job status"""
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress_entries(),
+            'query_id': self.query_id,
+            'row_count': self.row_count,
+            'truncated': self.truncated,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+        if self.error:
+            data['error'] = json.loads(self.error)
+        return data
+    
+    def __repr__(self):
+        return f'<QueryJob {self.id} {self.status}>'
+
+class SchemaSnapshot(db.Model):
+    """The last introspected schema of a connection (see schema_cache.py), so restarts start warm"""
+    connection_id = db.Column(db.Integer, db.ForeignKey('database_connection.id', ondelete='CASCADE'), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    # zlib-compressed JSON: {"schema": {table: [columns]}, "signatures": {table: signature}}
+    data = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaSnapshot {self.connection_id}>'
+
+class ConnectionHealth(db.Model):
+    """Health check results of a saved connection (see monitor.py)"""
+    connection_id = db.Column(db.Integer, db.ForeignKey('database_connection.id', ondelete='CASCADE'), primary_key=True)
+    # 'up' or 'down'
+    status = db.Column(db.String(8), nullable=False)
+    checked_at = db.Column(db.DateTime, nullable=False)
+    # When the current outage started (NULL while up)
+    down_since = db.Column(db.DateTime, nullable=True)
+    latency_ms = db.Column(db.Float, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    checks = db.Column(db.Integer, default=0, nullable=False)
+    failures = db.Column(db.Integer, default=0, nullable=False)
+    # JSON list of successful ping counts per metrics.LATENCY_BUCKETS bound, then one for slower pings
+    latency_histogram = db.Column(db.Text, nullable=True)
+    
+    @property
+    def is_up(self):
+        return self.status == 'up'
+    
+    def latency_percentile(self, fraction):
+        """Upper bound (ms) of the histogram bucket holding the given fraction of pings, or None"""
+        counts = json.loads(self.latency_histogram) if self.latency_histogram else []
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(list(LATENCY_BUCKETS) + [None], counts):
+            seen += count
+            if seen >= fraction * total:
+                return bound * 1000 if bound is not None else None
+        return None
+    
+    def to_dict(self):
+        """JSON-serializable health summary"""
+        return {
+            'status': self.status,
+            'checked_at': self.checked_at.isoformat() if self.checked_at else None,
+            'down_since': self.down_since.isoformat() if self.down_since else None,
+            'latency_ms': round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            'p50_ms': self.latency_percentile(0.5),
+            'p95_ms': self.latency_percentile(0.95),
+            'checks': self.checks,
+            'failures': self.failures,
+            'error': self.error
+        }
+    
+    def __repr__(self):
+        return f'<ConnectionHealth {self.connection_id} {self.status}>'
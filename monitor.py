@@ -0,0 +1,176 @@
+import json
+import time
+import bisect
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from extensions import db
+from models import DatabaseConnection, ConnectionHealth
+from pool import pool_manager, PoolTimeout
+from schema_cache import get_cached_schema, get_cached_fingerprint
+from schema_index import get_schema_index
+from join_graph import get_join_graph
+from metrics import record_ping, LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+class ConnectionMonitor:
+    """
+    Warms up saved connections and pings them on an interval
+
+    Warming a connection opens a pooled driver connection and loads its
+    schema (from the stored snapshot when it is still current), schema index
+    and join graph, so the first question doesn't pay for them. It runs when
+    a connection is saved and when its owner logs in.
+
+    Every HEALTH_CHECK_INTERVAL seconds each connection gets a SELECT 1. The
+    result goes to its ConnectionHealth row (up/down, latest latency and a
+    latency histogram), which any worker can read, and to /metrics. Each
+    worker process runs the schedule, but skips connections another process
+    checked within the interval. Threads start on the first request, so they
+    are never created before gunicorn forks.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._scheduler = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('HEALTH_CHECK_INTERVAL', 60)
+        self.timeout = app.config.get('HEALTH_CHECK_TIMEOUT', 5)
+        self.workers = app.config.get('HEALTH_CHECK_WORKERS', 4)
+        app.before_request(self._ensure_started)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='connection-monitor')
+            if self.interval and (self._scheduler is None or not self._scheduler.is_alive()):
+                self._scheduler = threading.Thread(target=self._schedule, name='connection-monitor', daemon=True)
+                self._scheduler.start()
+
+    def _submit(self, task, conn_id):
+        """Run task(conn_id) on a monitor thread, at most once at a time per task and connection"""
+        self._ensure_started()
+        key = (task.__name__, conn_id)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._run, task, conn_id, key)
+
+    def _run(self, task, conn_id, key):
+        try:
+            with self.app.app_context():
+                try:
+                    task(conn_id)
+                finally:
+                    db.session.remove()
+        except Exception:
+            logger.exception("Connection monitor task %s failed for connection %s", task.__name__, conn_id)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def warm_up(self, conn_id):
+        """Warm the pool and schema caches of a connection in the background"""
+        self._submit(self._warm_up, conn_id)
+
+    def warm_up_user(self, user_id):
+        """Warm every connection of a user in the background, e.g. after login"""
+        conn_ids = db.session.execute(
+            db.select(DatabaseConnection.id).filter_by(user_id=user_id)
+        ).scalars().all()
+        for conn_id in conn_ids:
+            self.warm_up(conn_id)
+
+    def _warm_up(self, conn_id):
+        connection = db.session.get(DatabaseConnection, conn_id)
+        if connection is None:
+            return
+        # The ping opens the pooled connection; a database that is down isn't introspected
+        if not self._check(conn_id, connection):
+            return
+        schema_info = get_cached_schema(connection)
+        fingerprint = get_cached_fingerprint(connection)
+        get_schema_index(connection.id, fingerprint, schema_info)
+        get_join_graph(connection.id, fingerprint, schema_info)
+
+    def _schedule(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    try:
+                        cutoff = datetime.utcnow() - timedelta(seconds=self.interval * 0.9)
+                        # Connections nobody (in any process) has checked within the interval
+                        conn_ids = db.session.execute(
+                            db.select(DatabaseConnection.id)
+                            .outerjoin(ConnectionHealth)
+                            .where(db.or_(ConnectionHealth.checked_at.is_(None), ConnectionHealth.checked_at < cutoff))
+                        ).scalars().all()
+                    finally:
+                        db.session.remove()
+                for conn_id in conn_ids:
+                    self._submit(self._ping, conn_id)
+            except Exception:
+                logger.exception("Connection health schedule failed")
+            time.sleep(self.interval)
+
+    def _ping(self, conn_id):
+        connection = db.session.get(DatabaseConnection, conn_id)
+        if connection is not None:
+            self._check(conn_id, connection)
+
+    def _check(self, conn_id, connection):
+        """Ping a connection through its pool and record the result; returns True if it is up"""
+        started = time.perf_counter()
+        try:
+            with pool_manager.connection(connection, timeout=self.timeout) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                    cursor.fetchall()
+        except PoolTimeout:
+            # Every pooled connection is busy running queries: the database is up, but there is nothing to measure
+            return True
+        except Exception as e:
+            record_ping(connection.db_type, None)
+            self._record(conn_id, None, str(e))
+            return False
+        latency = time.perf_counter() - started
+        record_ping(connection.db_type, latency)
+        self._record(conn_id, latency, None)
+        return True
+
+    def _record(self, conn_id, latency, error):
+        now = datetime.utcnow()
+        health = db.session.get(ConnectionHealth, conn_id)
+        if health is None:
+            health = ConnectionHealth(connection_id=conn_id, checks=0, failures=0)
+            db.session.add(health)
+        histogram = json.loads(health.latency_histogram) if health.latency_histogram else [0] * (len(LATENCY_BUCKETS) + 1)
+        health.checked_at = now
+        health.checks += 1
+        if error is None:
+            histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            health.status = 'up'
+            health.down_since = None
+            health.latency_ms = latency * 1000
+            health.error = None
+        else:
+            if health.status != 'down':
+                health.down_since = now
+            health.status = 'down'
+            health.failures += 1
+            health.error = error
+        health.latency_histogram = json.dumps(histogram)
+        db.session.commit()
+
+# Shared connection monitor, bound to the app in app.py
+connection_monitor = ConnectionMonitor()
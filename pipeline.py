@@ -0,0 +1,178 @@
+from extensions import db
+from models import Query
+from metrics import timed
+from sql_validation import SQLValidationError
+
+# Stages of the question-answering pipeline, in order
+PIPELINE_STAGES = ('schema', 'generate', 'preflight', 'execute', 'explain', 'save')
+
+class PipelineError(Exception):
+    """A pipeline stage failed; payload is the JSON error returned to the client"""
+
+    def __init__(self, payload):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+
+class QueryCancelled(Exception):
+    """The user cancelled a running query"""
+
+def run_query_pipeline(connection, natural_language_query, bypass_cache=False, progress=None, schema_info=None):
+    """
+    Answer a natural language question against a saved connection
+
+    Runs schema lookup, SQL generation, the EXPLAIN pre-flight check,
+    execution, explanation and saving in order. progress, if given, is called as progress(stage, **info) when
+    each stage starts; schema_info, if given, is used instead of looking the
+    schema up. Returns the success payload; raises PipelineError with
+    the client-facing error payload when schema lookup, SQL validation or
+    execution fails.
+    """
+    # Imported here because database.py imports this module
+    from database import get_cached_schema, get_generated_sql, run_preflight, execute_cached_query, \
+        generate_natural_language_result, store_result, schema_error, execution_error
+
+    progress = progress or (lambda stage, **info: None)
+
+    # First, get database schema
+    progress('schema')
+    if schema_info is None:
+        try:
+            schema_info = get_cached_schema(connection)
+        except Exception as db_err:
+            raise PipelineError(schema_error(connection, db_err))
+
+    # Generate SQL using OpenAI with appropriate database syntax (or reuse a cached translation)
+    progress('generate')
+    try:
+        sql_query, sql_cached = get_generated_sql(
+            connection,
+            natural_language_query,
+            schema_info,
+            bypass_cache=bypass_cache
+        )
+    except SQLValidationError as e:
+        # Invalid SQL that couldn't be repaired never reaches the database
+        raise PipelineError(execution_error(e.sql, e))
+
+    # Check the planner's estimates before running anything expensive
+    progress('preflight', sql=sql_query, sql_cached=sql_cached)
+    try:
+        sql_query, preflight = run_preflight(connection, sql_query, bypass_cache=bypass_cache)
+    except Exception as sql_err:
+        raise PipelineError(execution_error(sql_query, sql_err))
+    
+    # Execute the SQL query (or reuse a recent result of the same SELECT)
+    progress('execute', sql=sql_query, preflight=preflight)
+    try:
+        result, result_age = execute_cached_query(connection, sql_query, bypass_cache=bypass_cache)
+    except Exception as sql_err:
+        raise PipelineError(execution_error(sql_query, sql_err))
+
+    # Generate natural language response
+    progress('explain', result_cached=result_age is not None)
+    nl_result = generate_natural_language_result(natural_language_query, sql_query, result)
+
+    # Save the query, then its result as compressed pages
+    progress('save')
+    query = Query(
+        natural_language=natural_language_query,
+        sql_query=sql_query,
+        natural_language_result=nl_result,
+        connection_id=connection.id
+    )
+    db.session.add(query)
+    db.session.flush()
+    store_result(query, result)
+    with timed('commit'):
+        db.session.commit()
+
+    return {
+        'success': True,
+        'query_id': query.id,
+        'sql': sql_query,
+        'sql_cached': sql_cached,
+        'preflight': preflight,
+        'result': result,
+        'result_cached': result_age is not None,
+        'result_age': round(result_age, 1) if result_age is not None else None,
+        'explanation': nl_result
+    }
+
+def run_full_query(connection, natural_language_query, sql_query, bypass_cache=False, progress=None, on_stream=None):
+    """
+    Fetch the full result of SQL that was already generated and checked, explain it and save it
+
+    This is the background half of a preview-first question. A read is
+    streamed with a server-side cursor up to QUERY_MAX_ROWS rows, batch by
+    batch, into the stored result pages and the explanation digest; a result
+    still in the result cache (such as a preview that held every row) is
+    replayed instead, unless bypass_cache is set. Any other statement is
+    executed as usual. on_stream, if given, is called with the row stream
+    before it runs, so the caller can cancel it. Returns the success payload
+    with row_count and truncated; raises PipelineError when execution fails
+    and QueryCancelled when the stream was cancelled.
+    """
+    # Imported here because database.py imports this module
+    from flask import current_app
+    from database import is_read_statement, get_cached_result, CachedRowStream, stream_sql_query, \
+        execute_sql_query, ResultWriter, ResultDigest, generate_natural_language_result, store_result, \
+        execution_error
+
+    progress = progress or (lambda stage, **info: None)
+
+    progress('execute', sql=sql_query)
+    writer = cached = None
+    row_count, truncated = None, False
+    try:
+        if is_read_statement(sql_query):
+            batch_size = current_app.config['QUERY_STREAM_BATCH_SIZE']
+            max_rows = current_app.config['QUERY_MAX_ROWS']
+            cached, _ = (None, None) if bypass_cache else get_cached_result(connection, sql_query)
+            if cached is not None:
+                stream = CachedRowStream(cached, batch_size=batch_size, max_rows=max_rows)
+            else:
+                stream = stream_sql_query(connection, sql_query, batch_size=batch_size, max_rows=max_rows)
+                if on_stream is not None:
+                    on_stream(stream)
+            writer = ResultWriter()
+            digest = ResultDigest()
+            for rows in stream:
+                writer.add_rows(rows)
+                digest.add_rows(rows)
+            writer.columns = stream.columns
+            row_count, truncated = stream.row_count, stream.truncated
+        else:
+            result = execute_sql_query(connection, sql_query)
+            digest = ResultDigest.from_result(result)
+    except QueryCancelled:
+        raise
+    except Exception as sql_err:
+        raise PipelineError(execution_error(sql_query, sql_err))
+
+    progress('explain', row_count=row_count, truncated=truncated, cached=cached is not None)
+    nl_result = generate_natural_language_result(natural_language_query, sql_query, digest)
+
+    progress('save')
+    query = Query(
+        natural_language=natural_language_query,
+        sql_query=sql_query,
+        natural_language_result=nl_result,
+        connection_id=connection.id
+    )
+    db.session.add(query)
+    db.session.flush()
+    if writer is not None:
+        writer.save(query)
+    else:
+        store_result(query, result)
+    with timed('commit'):
+        db.session.commit()
+
+    return {
+        'success': True,
+        'query_id': query.id,
+        'sql': sql_query,
+        'row_count': row_count,
+        'truncated': truncated,
+        'explanation': nl_result
+    }
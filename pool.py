@@ -0,0 +1,348 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+import pymysql
+import psycopg2
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Pool sizing and lifetime settings (per saved DatabaseConnection, per worker process)
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300))
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', 30))
+# Connections idle for less than this many seconds skip the checkout ping
+POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', 2))
+CONNECT_TIMEOUT = 10
+# How reads pick a replica: 'round_robin' or 'least_latency' (lowest recent round-trip time)
+REPLICA_SELECTION = os.environ.get('DB_REPLICA_SELECTION', 'round_robin')
+# With 'least_latency', seconds between round-trip probes of a replica
+REPLICA_PROBE_INTERVAL = float(os.environ.get('DB_REPLICA_PROBE_INTERVAL', 10))
+# Seconds a replica that couldn't be reached is left out before it is tried again
+REPLICA_RETRY_AFTER = float(os.environ.get('DB_REPLICA_RETRY_AFTER', 30))
+
+@timed('connect')
+def open_connection(db_type, host, port, username, password, database_name):
+    """Open a new driver connection to a MySQL or PostgreSQL database"""
+    db_type = (db_type or '').lower()
+    if db_type == 'mysql':
+        return pymysql.connect(
+            host=host,
+            user=username,
+            password=password,
+            db=database_name,
+            port=int(port),
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor,
+            connect_timeout=CONNECT_TIMEOUT  # Add timeout to avoid long waits
+        )
+    elif db_type == 'postgresql':
+        return psycopg2.connect(
+            host=host,
+            user=username,
+            password=password,
+            dbname=database_name,
+            port=int(port),
+            connect_timeout=CONNECT_TIMEOUT
+        )
+    raise Exception(f"Unsupported database type: {db_type}")
+
+class PoolTimeout(Exception):
+    """No pooled connection became free before the checkout timeout"""
+
+def _is_alive(db_type, conn):
+    """Cheap liveness check used when a connection is checked out"""
+    try:
+        if db_type == 'mysql':
+            conn.ping(reconnect=False)
+        else:
+            if conn.closed:
+                return False
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+        return True
+    except Exception:
+        return False
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+class ConnectionPool:
+    """A bounded pool of open connections to a single target database"""
+
+    def __init__(self, db_type, params, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.db_type = db_type.lower()
+        self.params = params
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = []  # (conn, last_used) pairs, most recently used last
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _evict_expired(self, now):
+        """Close idle connections that exceeded the idle timeout (lock must be held)"""
+        keep = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.idle_timeout:
+                _close_quietly(conn)
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+
+    def acquire(self, timeout=POOL_CHECKOUT_TIMEOUT):
+        """Check out a healthy connection, opening a new one if the pool has room"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise Exception("Connection pool has been closed")
+                now = time.monotonic()
+                self._evict_expired(now)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._in_use += 1
+                    candidate = (conn, now - last_used)
+                elif self._in_use < self.max_size:
+                    self._in_use += 1
+                    candidate = None
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f"Timed out waiting for a free connection (pool size {self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+                    continue
+
+            # Network work happens outside the lock
+            try:
+                if candidate is not None:
+                    conn, idle_for = candidate
+                    if idle_for < POOL_PING_AFTER or _is_alive(self.db_type, conn):
+                        return conn
+                    _close_quietly(conn)
+                return open_connection(self.db_type, **self.params)
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, ending any open transaction first"""
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed or len(self._idle) >= self.max_size:
+                _close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        """Close all idle connections; checked-out ones are closed on release"""
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                _close_quietly(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'idle': len(self._idle), 'in_use': self._in_use, 'max_size': self.max_size}
+
+def parse_hosts(text, default_port):
+    """Parse 'host[:port], host[:port] ...' (commas, spaces or newlines) into (host, port) pairs"""
+    hosts = []
+    for entry in (text or '').replace(',', ' ').split():
+        host, separator, port = entry.rpartition(':')
+        if not separator or not port.isdigit() or not host:
+            host, port = entry, default_port
+        hosts.append((host, int(port)))
+    return hosts
+
+class ReplicaSet:
+    """
+    Picks the read replica for each read of one saved connection
+
+    'round_robin' rotates through the replicas; 'least_latency' picks the one
+    with the lowest moving average of round-trip times, trying unmeasured
+    replicas first. A round trip is a SELECT 1 (or MySQL ping) on a checked
+    out connection, taken at most every REPLICA_PROBE_INTERVAL seconds per
+    replica, so the queries themselves don't count against it. A replica that can't be reached is skipped for
+    REPLICA_RETRY_AFTER seconds. The primary is always the last candidate.
+    """
+
+    def __init__(self, replicas, selection=REPLICA_SELECTION):
+        self.replicas = replicas
+        self.selection = selection
+        self._next = 0
+        self._latency = {}
+        self._probed_at = {}
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def candidates(self):
+        """Replicas to try for one read, in order, followed by None for the primary"""
+        now = time.monotonic()
+        with self._lock:
+            available = [replica for replica in self.replicas if self._down_until.get(replica, 0) <= now]
+            if self.selection == 'least_latency':
+                available.sort(key=lambda replica: self._latency.get(replica, 0.0))
+            elif available:
+                start = self._next % len(available)
+                available = available[start:] + available[:start]
+                self._next += 1
+        return available + [None]
+
+    def due_for_probe(self, replica):
+        """True (once per interval) when least_latency needs a new round-trip time for a replica"""
+        if self.selection != 'least_latency':
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._probed_at.get(replica, float('-inf')) < REPLICA_PROBE_INTERVAL:
+                return False
+            self._probed_at[replica] = now
+            return True
+
+    def record(self, replica, seconds):
+        with self._lock:
+            previous = self._latency.get(replica)
+            self._latency[replica] = seconds if previous is None else 0.7 * previous + 0.3 * seconds
+
+    def mark_down(self, replica):
+        with self._lock:
+            self._down_until[replica] = time.monotonic() + REPLICA_RETRY_AFTER
+
+# Driver errors that mean the connection itself is unusable and must not be reused
+_BROKEN_CONNECTION_ERRORS = (
+    pymysql.err.OperationalError,
+    pymysql.err.InterfaceError,
+    psycopg2.OperationalError,
+    psycopg2.InterfaceError,
+)
+
+class PoolManager:
+    """Keeps one ConnectionPool per saved DatabaseConnection id and replica host"""
+
+    def __init__(self):
+        self._pools = {}
+        self._replica_sets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(connection):
+        # Any change to these fields (e.g. editing the connection) invalidates the pool
+        return (
+            connection.db_type.lower(),
+            connection.host,
+            connection.port,
+            connection.username,
+            connection.database_name,
+            connection.password_hash,
+        )
+
+    def get_pool(self, connection, replica=None):
+        """Return the pool for a DatabaseConnection (or one of its replicas), creating it on first use"""
+        signature = self._signature(connection)
+        key = (connection.id, replica)
+        with self._lock:
+            entry = self._pools.get(key)
+            if entry and entry[0] == signature:
+                return entry[1]
+            stale = entry[1] if entry else None
+            host, port = replica or (connection.host, connection.port)
+            # The password is decrypted once per pool rather than once per request
+            pool = ConnectionPool(connection.db_type, {
+                'host': host,
+                'port': port,
+                'username': connection.username,
+                'password': connection.get_password(),
+                'database_name': connection.database_name,
+            })
+            self._pools[key] = (signature, pool)
+        if stale:
+            stale.close()
+        return pool
+
+    def get_replica_set(self, connection):
+        """Return the ReplicaSet of a connection with replica hosts, or None"""
+        replicas = parse_hosts(getattr(connection, 'replica_hosts', None), connection.port)
+        if not replicas:
+            return None
+        signature = (tuple(replicas), getattr(connection, 'replica_selection', None) or REPLICA_SELECTION)
+        with self._lock:
+            entry = self._replica_sets.get(connection.id)
+            if entry is None or entry[0] != signature:
+                entry = (signature, ReplicaSet(replicas, signature[1]))
+                self._replica_sets[connection.id] = entry
+            return entry[1]
+
+    @contextmanager
+    def connection(self, connection, timeout=POOL_CHECKOUT_TIMEOUT, read_only=False):
+        """
+        Check out a pooled driver connection for a DatabaseConnection
+
+        With read_only=True and replica hosts configured, the connection goes
+        to a replica chosen by the connection's ReplicaSet. A replica that
+        can't be reached is marked down and the next candidate is tried,
+        ending with the primary.
+        """
+        replica_set = self.get_replica_set(connection) if read_only else None
+        candidates = replica_set.candidates() if replica_set else [None]
+        for replica in candidates:
+            pool = self.get_pool(connection, replica)
+            try:
+                conn = pool.acquire(timeout)
+                break
+            except _BROKEN_CONNECTION_ERRORS as e:
+                if replica is None:
+                    raise
+                logger.warning("Read replica %s:%s of connection %s is unreachable: %s",
+                               replica[0], replica[1], connection.id, e)
+                replica_set.mark_down(replica)
+        if replica is not None and replica_set.due_for_probe(replica):
+            started = time.perf_counter()
+            if _is_alive(pool.db_type, conn):
+                replica_set.record(replica, time.perf_counter() - started)
+        discard = False
+        try:
+            yield conn
+        except _BROKEN_CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            pool.release(conn, discard=discard)
+
+    def invalidate(self, conn_id):
+        """Drop and close the pools (primary and replicas) for a connection that was edited or deleted"""
+        with self._lock:
+            entries = [self._pools.pop(key) for key in list(self._pools) if key[0] == conn_id]
+            self._replica_sets.pop(conn_id, None)
+        for _, pool in entries:
+            pool.close()
+        if entries:
+            logger.debug("Invalidated connection pools for connection %s", conn_id)
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._pools.values())
+            self._pools = {}
+        for _, pool in entries:
+            pool.close()
+
+# Shared, process-wide pool manager
+pool_manager = PoolManager()
@@ -0,0 +1,238 @@
+import os
+import json
+import pymysql
+from pool import pool_manager
+from sql_validation import classify_statement, tokenize
+
+# Defaults for connections that leave a threshold empty (NULL); 0 disables a check
+PREFLIGHT_MAX_ROWS = int(os.environ.get('PREFLIGHT_MAX_ROWS', 1000000))
+# In PostgreSQL planner cost units; MySQL's tabular EXPLAIN has no cost, so only rows apply there
+PREFLIGHT_MAX_COST = float(os.environ.get('PREFLIGHT_MAX_COST', 10000000))
+# 'limit' injects a LIMIT into an over-threshold SELECT, 'reject' refuses it
+PREFLIGHT_ACTION = os.environ.get('PREFLIGHT_ACTION', 'limit')
+PREFLIGHT_LIMIT = int(os.environ.get('PREFLIGHT_LIMIT', 1000))
+# Seconds a statement may run before the database cancels it
+STATEMENT_TIMEOUT = int(os.environ.get('STATEMENT_TIMEOUT', 30))
+
+# Statements EXPLAIN accepts in both MySQL and PostgreSQL
+_EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete')
+# Words after which a SELECT reads every row before a LIMIT applies
+_FULL_READ_WORDS = ('group', 'having', 'order', 'distinct', 'union', 'over')
+_AGGREGATES = ('count', 'sum', 'avg', 'min', 'max', 'group_concat', 'json_arrayagg', 'json_objectagg',
+               'std', 'stddev', 'stddev_pop', 'stddev_samp', 'variance', 'var_pop', 'var_samp',
+               'bit_and', 'bit_or', 'bit_xor', 'string_agg', 'array_agg', 'bool_and', 'bool_or')
+
+class PreflightRejected(Exception):
+    """The query's estimated size or cost is above the connection's thresholds"""
+
+    def __init__(self, message, estimate):
+        super().__init__(message)
+        self.estimate = estimate
+
+def _setting(connection, name, default):
+    value = getattr(connection, name, None)
+    return default if value is None else value
+
+def statement_timeout(connection):
+    """Statement timeout in seconds for a connection (0 means none)"""
+    return _setting(connection, 'statement_timeout', STATEMENT_TIMEOUT)
+
+def statement_timeout_error(connection):
+    """The user-facing error for a query the statement timeout cancelled"""
+    return Exception(f"The query was cancelled after running for longer than the "
+                     f"{statement_timeout(connection)} second statement timeout.")
+
+def apply_statement_timeout(conn, connection):
+    """
+    Bound the next statements on a pooled driver connection by the connection's timeout
+
+    PostgreSQL uses SET LOCAL statement_timeout, which ends with the current
+    transaction. MySQL sets the session's max_execution_time (SELECTs only),
+    falling back to MariaDB's max_statement_time.
+    """
+    seconds = statement_timeout(connection)
+    if connection.is_postgresql:
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL statement_timeout = %s", (int(seconds * 1000),))
+    elif connection.is_mysql:
+        with conn.cursor() as cursor:
+            try:
+                cursor.execute("SET SESSION max_execution_time = %s", (int(seconds * 1000),))
+            except pymysql.err.MySQLError:
+                cursor.execute("SET SESSION max_statement_time = %s", (seconds,))
+
+def explain_query(connection, sql_query):
+    """Return {'rows': estimated rows, 'cost': estimated cost or None} from the database's EXPLAIN"""
+    sql_query = sql_query.strip().rstrip(';')
+    # A read is explained where it will run: on a replica if the connection has any
+    with pool_manager.connection(connection, read_only=classify_statement(sql_query)[1]) as conn:
+        apply_statement_timeout(conn, connection)
+        if connection.is_postgresql:
+            with conn.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql_query}")
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            plan = plan[0]['Plan']
+            return {'rows': int(plan['Plan Rows']), 'cost': float(plan['Total Cost'])}
+        elif connection.is_mysql:
+            with conn.cursor() as cursor:
+                cursor.execute(f"EXPLAIN {sql_query}")
+                steps = cursor.fetchall()
+            # Rows with the same id are the table accesses of one SELECT's nested-loop
+            # join: their rows multiply, scaled by the fraction the WHERE clause is
+            # expected to keep. Subqueries, derived tables and UNION parts have their
+            # own ids and add up.
+            selects = {}
+            for step in steps:
+                if step.get('rows') is None:
+                    continue
+                rows = max(step['rows'], 1) * float(step.get('filtered') or 100) / 100
+                selects[step.get('id')] = selects.get(step.get('id'), 1.0) * rows
+            return {'rows': int(sum(selects.values()) or 1), 'cost': None}
+        raise Exception(f"Unsupported database type: {connection.db_type}")
+
+def _is_count(token):
+    return token.kind == 'number' and token.text.isdigit()
+
+def _limit_count(tokens, k):
+    """
+    Read the LIMIT or FETCH clause starting at tokens[k] and running to the end
+
+    Returns (matched, count): count is the token holding the row count (a
+    number or ALL), or None for FETCH FIRST ROW ONLY, which means one row.
+    matched is False when the clause is something else, e.g. a parameter.
+    """
+    rest = tokens[k + 1:]
+    words = [token.lower for token in rest]
+    if tokens[k].lower == 'limit':
+        if rest and (_is_count(rest[0]) or words[0] == 'all'):
+            # LIMIT n, LIMIT ALL, optionally followed by OFFSET m
+            if len(rest) == 1 or (len(rest) == 3 and words[1] == 'offset' and _is_count(rest[2])):
+                return True, rest[0]
+        if len(rest) == 3 and _is_count(rest[0]) and rest[1].is_op(',') and _is_count(rest[2]):
+            # MySQL's LIMIT offset, n
+            return True, rest[2]
+        return False, None
+    # FETCH {FIRST | NEXT} [n] {ROW | ROWS} {ONLY | WITH TIES}
+    if words[:1] not in (['first'], ['next']):
+        return False, None
+    count = rest[1] if len(rest) > 1 and _is_count(rest[1]) else None
+    if words[2 if count else 1:] not in (['row', 'only'], ['rows', 'only'], ['row', 'with', 'ties'], ['rows', 'with', 'ties']):
+        return False, None
+    return True, count
+
+def _apply_limit(sql_query, limit):
+    """inject_limit, also returning whether the statement's row limit changed"""
+    try:
+        tokens = tokenize(sql_query)
+    except ValueError:
+        # Left for the database to report; the newline keeps a trailing -- comment from hiding the LIMIT
+        return f"{sql_query.strip()}\nLIMIT {limit}", True
+    while tokens and tokens[-1].is_op(';'):
+        tokens.pop()
+    if not tokens:
+        return sql_query, False
+    # Trailing comments, whitespace and semicolons are dropped
+    sql_query = sql_query[:tokens[-1].end]
+    k = next((k for k in range(len(tokens) - 1, -1, -1)
+              if tokens[k].depth == 0 and tokens[k].is_word('limit', 'fetch')), None)
+    if k is None:
+        return f"{sql_query} LIMIT {limit}", True
+    matched, count = _limit_count(tokens, k)
+    if not matched:
+        return f"SELECT * FROM ({sql_query}) AS limited LIMIT {limit}", True
+    if count is None or (count.kind == 'number' and int(count.text) <= limit):
+        return sql_query, False
+    return sql_query[:count.start] + str(limit) + sql_query[count.end:], True
+
+def inject_limit(sql_query, limit):
+    """
+    Add (or lower) the row limit at the end of a SELECT
+
+    An existing LIMIT n, LIMIT offset, n, LIMIT ALL or FETCH FIRST n ROWS
+    clause is lowered rather than followed by a second one. Trailing
+    comments are dropped first, so a -- comment can't swallow the LIMIT. A
+    limit clause that isn't a plain number (a parameter or an expression)
+    is kept and the statement is wrapped in SELECT * FROM (...) LIMIT n.
+    """
+    return _apply_limit(sql_query, limit)[0]
+
+def _limit_stops_early(sql_query):
+    """
+    True if a LIMIT lets the database stop reading rows early
+
+    Aggregates, GROUP BY, HAVING, ORDER BY, DISTINCT, UNION and window
+    functions all read every row before the LIMIT applies, anywhere in the
+    statement.
+    """
+    try:
+        tokens = tokenize(sql_query)
+    except ValueError:
+        return False
+    for i, token in enumerate(tokens):
+        if token.is_word(*_FULL_READ_WORDS):
+            return False
+        if token.is_word(*_AGGREGATES) and i + 1 < len(tokens) and tokens[i + 1].is_op('('):
+            return False
+    return True
+
+def preflight_query(connection, sql_query):
+    """
+    Check a query's EXPLAIN estimates against the connection's thresholds
+
+    Returns (sql_query, report). When a SELECT is over a threshold and the
+    connection's action is 'limit', the returned SQL has a LIMIT injected and
+    is re-explained; it is rejected if it is still over. MySQL's tabular
+    EXPLAIN estimates rows before the LIMIT applies, so there the limited
+    SQL is accepted without a second EXPLAIN, but only when nothing in it
+    (aggregates, grouping, sorting, DISTINCT) makes the database read every
+    row anyway. Statements EXPLAIN can't handle (SHOW, SET, ...) pass
+    through with report None.
+    Raises PreflightRejected.
+    """
+    if not sql_query.strip().lower().startswith(_EXPLAINABLE):
+        return sql_query, None
+
+    max_rows = _setting(connection, 'max_estimated_rows', PREFLIGHT_MAX_ROWS)
+    max_cost = _setting(connection, 'max_estimated_cost', PREFLIGHT_MAX_COST)
+    action = _setting(connection, 'preflight_action', PREFLIGHT_ACTION)
+    if not max_rows and not max_cost:
+        return sql_query, None
+
+    def over(estimate):
+        reasons = []
+        if max_rows and estimate['rows'] > max_rows:
+            reasons.append(f"about {estimate['rows']:,} rows (limit {max_rows:,})")
+        if max_cost and estimate['cost'] is not None and estimate['cost'] > max_cost:
+            reasons.append(f"a planner cost of {estimate['cost']:,.0f} (limit {max_cost:,.0f})")
+        return reasons
+
+    estimate = explain_query(connection, sql_query)
+    report = dict(estimate, limited=False)
+    reasons = over(estimate)
+    if not reasons:
+        return sql_query, report
+
+    keyword, is_read = classify_statement(sql_query)
+    if action == 'limit' and is_read and keyword in ('select', 'with'):
+        limit = _setting(connection, 'preflight_limit', PREFLIGHT_LIMIT)
+        limited_sql, changed = _apply_limit(sql_query, limit)
+        if connection.is_mysql:
+            if _limit_stops_early(sql_query):
+                if not changed:
+                    # Already limited to at most PREFLIGHT_LIMIT rows
+                    return limited_sql, report
+                return limited_sql, dict(estimate, limited=True, limit=limit, original=estimate)
+        else:
+            limited_estimate = explain_query(connection, limited_sql)
+            if not over(limited_estimate):
+                return limited_sql, dict(limited_estimate, limited=True, limit=limit, original=estimate)
+            reasons = over(limited_estimate)
+            estimate = limited_estimate
+
+    raise PreflightRejected(
+        f"The query was not run because the database estimates it would process {' and '.join(reasons)}. "
+        f"Try a more specific question.",
+        estimate
+    )
@@ -0,0 +1,51 @@
+import os
+import re
+from cache import TTLCache
+from result_set import dumps
+from metrics import register_cache
+
+# Default seconds a SELECT result is reused; a connection's result_cache_ttl overrides it (0 disables)
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 60))
+# Memory bound on cached results, measured as their JSON size
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Results with more rows than this are never cached
+RESULT_CACHE_MAX_ROWS = int(os.environ.get('RESULT_CACHE_MAX_ROWS', 10000))
+
+_result_cache = TTLCache(maxsize=4096, ttl=RESULT_CACHE_TTL, maxbytes=RESULT_CACHE_MAX_BYTES)
+
+# Quoted strings and identifiers are kept verbatim when normalizing
+_SQL_TOKEN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`)|(\s+)""")
+
+def normalize_sql(sql_query):
+    """Collapse whitespace outside quoted literals and drop trailing semicolons"""
+    normalized = _SQL_TOKEN.sub(lambda m: m.group(1) or ' ', sql_query.strip())
+    return normalized.rstrip('; ')
+
+def result_cache_ttl(connection):
+    """Seconds results of this connection are cached for (0 means not cached)"""
+    ttl = getattr(connection, 'result_cache_ttl', None)
+    return RESULT_CACHE_TTL if ttl is None else ttl
+
+def get_cached_result(connection, sql_query):
+    """Return (ResultSet, age_in_seconds) for a cached SELECT, or (None, None)"""
+    if not result_cache_ttl(connection):
+        return None, None
+    return _result_cache.get_with_age((connection.id, normalize_sql(sql_query)))
+
+def cache_result(connection, sql_query, result):
+    """Cache a SELECT's ResultSet, unless caching is off for the connection or the result is too large"""
+    ttl = result_cache_ttl(connection)
+    if not ttl or len(result) > RESULT_CACHE_MAX_ROWS:
+        return
+    size = len(dumps(result))
+    _result_cache.set((connection.id, normalize_sql(sql_query)), result, ttl=ttl, size=size)
+
+def invalidate_results(conn_id):
+    """Drop every cached result of a connection, e.g. after a write"""
+    return _result_cache.discard_where(lambda key: key[0] == conn_id)
+
+def result_cache_stats():
+    """Hit/miss counters, size and memory use of the result cache"""
+    return _result_cache.stats()
+
+register_cache('result', result_cache_stats)
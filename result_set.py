@@ -0,0 +1,95 @@
+import json
+import uuid
+import datetime
+from decimal import Decimal
+
+# Driver type codes (cursor.description[i][1]) -> type names sent to the client.
+# PostgreSQL reports type OIDs, MySQL its FIELD_TYPE constants.
+PG_TYPE_NAMES = {
+    16: 'boolean',
+    20: 'integer', 21: 'integer', 23: 'integer', 26: 'integer',
+    700: 'number', 701: 'number', 1700: 'number', 790: 'number',
+    18: 'text', 19: 'text', 25: 'text', 1042: 'text', 1043: 'text',
+    1082: 'date', 1114: 'datetime', 1184: 'datetime', 1083: 'time', 1266: 'time', 1186: 'interval',
+    114: 'json', 3802: 'json',
+    17: 'binary',
+    2950: 'uuid',
+}
+MYSQL_TYPE_NAMES = {
+    1: 'integer', 2: 'integer', 3: 'integer', 8: 'integer', 9: 'integer', 13: 'integer',
+    0: 'number', 4: 'number', 5: 'number', 246: 'number',
+    7: 'datetime', 12: 'datetime', 10: 'date', 14: 'date', 11: 'time',
+    15: 'text', 247: 'text', 248: 'text', 253: 'text', 254: 'text',
+    # MySQL reports TEXT columns as BLOB types; the driver decodes them to str
+    249: 'text', 250: 'text', 251: 'text', 252: 'text',
+    245: 'json',
+    16: 'binary', 255: 'binary',
+}
+
+def type_names(type_codes, db_type):
+    """Map driver type codes to portable type names ('other' when unknown)"""
+    names = PG_TYPE_NAMES if db_type == 'postgresql' else MYSQL_TYPE_NAMES
+    return [names.get(code, 'other') for code in type_codes]
+
+class ResultSet:
+    """
+    A tabular query result in columnar form
+
+    Holds column names, the driver's type code per column and the rows as
+    tuples in column order, exactly as the cursor returned them. Column names
+    are stored once rather than on every row. to_dict() gives the JSON shape
+    {columns, types, rows}, with types as portable names.
+    """
+
+    __slots__ = ('columns', 'type_codes', 'types', 'rows')
+
+    def __init__(self, columns, rows, type_codes=None, types=None):
+        self.columns = list(columns)
+        self.rows = rows
+        self.type_codes = list(type_codes) if type_codes is not None else [None] * len(self.columns)
+        self.types = list(types) if types is not None else ['other'] * len(self.columns)
+
+    @classmethod
+    def from_cursor(cls, cursor, rows, db_type):
+        """Build a result from a tuple cursor's description and fetched rows"""
+        description = cursor.description or []
+        type_codes = [column[1] for column in description]
+        return cls([column[0] for column in description], rows, type_codes, type_names(type_codes, db_type))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_dicts(self):
+        """Rows as dicts keyed by column name"""
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+    def to_dict(self):
+        return {'columns': self.columns, 'types': self.types, 'rows': self.rows}
+
+def _binary(value):
+    return bytes(value).hex()
+
+# Values the json module can't encode, by exact type. The C encoder handles
+# str, int, float, bool, None, lists, tuples and dicts itself and only calls
+# encode_value for the rest, so ordinary cells never reach Python code.
+_ENCODERS = {
+    Decimal: str,
+    datetime.datetime: datetime.datetime.isoformat,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: datetime.time.isoformat,
+    datetime.timedelta: str,
+    uuid.UUID: str,
+    bytes: _binary,
+    bytearray: _binary,
+    memoryview: _binary,
+    ResultSet: ResultSet.to_dict,
+}
+
+def encode_value(value):
+    """json default hook for database values (Decimal, datetime, UUID, bytes) and ResultSets"""
+    encoder = _ENCODERS.get(type(value))
+    return encoder(value) if encoder is not None else str(value)
+
+def dumps(payload):
+    """Serialize a payload that may contain ResultSets and database values to compact JSON"""
+    return json.dumps(payload, default=encode_value, separators=(',', ':'))
@@ -0,0 +1,188 @@
+import os
+import json
+import zlib
+from flask import current_app
+from extensions import db
+from models import QueryResultPage
+from metrics import count_result_bytes
+from result_set import ResultSet, dumps
+
+# Rows per compressed page
+RESULT_PAGE_SIZE = int(os.environ.get('RESULT_PAGE_SIZE', 500))
+# Results whose compressed size exceeds this many bytes are written to the blob store
+RESULT_SPILL_BYTES = int(os.environ.get('RESULT_SPILL_BYTES', 256 * 1024))
+RESULT_COMPRESSION_LEVEL = int(os.environ.get('RESULT_COMPRESSION_LEVEL', 6))
+
+def _blob_dir():
+    """Directory of the local blob store for large results"""
+    return os.environ.get('RESULT_STORE_DIR') or os.path.join(current_app.instance_path, 'results')
+
+def _compress_page(rows):
+    data = dumps(rows).encode()
+    count_result_bytes(len(data))
+    return zlib.compress(data, RESULT_COMPRESSION_LEVEL)
+
+def _decompress_page(data):
+    return json.loads(zlib.decompress(data).decode())
+
+class ResultWriter:
+    """
+    Accumulates result rows as compressed pages in a columnar layout
+
+    Column names are stored once and every row is stored as a plain array.
+    Rows can be added in batches as they are fetched, so only the compressed
+    pages (plus at most one page of pending rows) are held in memory.
+    """
+
+    def __init__(self, columns=None, page_size=RESULT_PAGE_SIZE):
+        self.columns = columns
+        self.page_size = page_size
+        self.row_count = 0
+        self.pages = []
+        self.compressed_bytes = 0
+        self._pending = []
+
+    def add_rows(self, rows):
+        """Add a batch of rows, given as dicts or as sequences in column order"""
+        for row in rows:
+            if isinstance(row, dict):
+                if self.columns is None:
+                    self.columns = list(row.keys())
+                row = [row.get(column) for column in self.columns]
+            else:
+                row = list(row)
+            self._pending.append(row)
+            if len(self._pending) >= self.page_size:
+                self._flush_page()
+        self.row_count += len(rows)
+
+    def _flush_page(self):
+        if self._pending:
+            page = _compress_page(self._pending)
+            self.pages.append(page)
+            self.compressed_bytes += len(page)
+            self._pending = []
+
+    def save(self, query):
+        """Persist the pages for a Query that has already been flushed (and so has an id)"""
+        self._flush_page()
+        query.result = None
+        query.result_columns = json.dumps(self.columns or [])
+        query.result_row_count = self.row_count
+        query.result_page_size = self.page_size
+
+        if self.compressed_bytes > RESULT_SPILL_BYTES:
+            # Large results go to the local blob store, one file per page
+            directory = os.path.join(_blob_dir(), str(query.id))
+            os.makedirs(directory, exist_ok=True)
+            for number, page in enumerate(self.pages):
+                with open(os.path.join(directory, f"{number}.z"), 'wb') as f:
+                    f.write(page)
+            query.result_blob_path = directory
+        else:
+            for number, page in enumerate(self.pages):
+                db.session.add(QueryResultPage(query_id=query.id, page=number, data=page))
+            query.result_blob_path = None
+
+def store_result(query, result):
+    """Store an execution result (a ResultSet, or a write's affected-row count) on a flushed Query"""
+    if isinstance(result, ResultSet):
+        writer = ResultWriter(result.columns)
+        writer.add_rows(result.rows)
+        writer.save(query)
+    else:
+        # Write statements only report an affected-row count; keep that as plain JSON
+        query.result = json.dumps(result, default=str)
+
+def has_stored_rows(query):
+    """True if the query's result was stored in the paged, compressed layout"""
+    return query.result_row_count is not None
+
+def _read_page(query, number):
+    if query.result_blob_path:
+        path = os.path.join(query.result_blob_path, f"{number}.z")
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            return _decompress_page(f.read())
+    page = QueryResultPage.query.filter_by(query_id=query.id, page=number).first()
+    return _decompress_page(page.data) if page else []
+
+def load_result_page(query, page=1, per_page=None):
+    """
+    Load one page (1-based) of a stored result
+
+    Only the compressed pages covering the requested rows are read and
+    decompressed. Returns a dict with columns, rows (as arrays), page,
+    per_page, page_count and row_count, or None if the query has no rows.
+    """
+    if has_stored_rows(query):
+        columns = json.loads(query.result_columns)
+        row_count = query.result_row_count
+        per_page = per_page or query.result_page_size
+        start = (page - 1) * per_page
+        end = min(start + per_page, row_count)
+        rows = []
+        stored_size = query.result_page_size
+        for number in range(start // stored_size, (max(end, 1) - 1) // stored_size + 1):
+            if start >= end:
+                break
+            page_rows = _read_page(query, number)
+            offset = number * stored_size
+            rows.extend(page_rows[max(start - offset, 0):end - offset])
+    elif query.result:
+        # Results saved before paged storage existed are a JSON list of row dicts
+        legacy = json.loads(query.result)
+        if not isinstance(legacy, list):
+            return None
+        columns = list(legacy[0].keys()) if legacy else []
+        row_count = len(legacy)
+        per_page = per_page or RESULT_PAGE_SIZE
+        start = (page - 1) * per_page
+        rows = [[row.get(column) for column in columns] for row in legacy[start:start + per_page]]
+    else:
+        return None
+
+    return {
+        'columns': columns,
+        'rows': rows,
+        'page': page,
+        'per_page': per_page,
+        'page_count': max((row_count + per_page - 1) // per_page, 1),
+        'row_count': row_count
+    }
+
+def iter_result_pages(query):
+    """
+    Yield the rows of a stored result one stored page at a time, as arrays
+
+    Only one page is decompressed at a time. Yields nothing if the query has
+    no rows; use result_columns_of for the column names.
+    """
+    if has_stored_rows(query):
+        page_count = (query.result_row_count + query.result_page_size - 1) // query.result_page_size
+        for number in range(page_count):
+            yield _read_page(query, number)
+    elif query.result:
+        legacy = json.loads(query.result)
+        if isinstance(legacy, list) and legacy:
+            columns = list(legacy[0].keys())
+            for start in range(0, len(legacy), RESULT_PAGE_SIZE):
+                yield [[row.get(column) for column in columns] for row in legacy[start:start + RESULT_PAGE_SIZE]]
+
+def result_columns_of(query):
+    """Column names of a stored result, or None if the query has no tabular result"""
+    if has_stored_rows(query):
+        return json.loads(query.result_columns)
+    if query.result:
+        legacy = json.loads(query.result)
+        if isinstance(legacy, list):
+            return list(legacy[0].keys()) if legacy else []
+    return None
+
+def load_result_summary(query):
+    """Return the non-tabular result (e.g. affected rows) of a write statement, if any"""
+    if has_stored_rows(query) or not query.result:
+        return None
+    result = json.loads(query.result)
+    return result if isinstance(result, dict) else None
@@ -0,0 +1,202 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from metrics import record_execution_wait, set_execution_load
+
+# Defaults for connections that leave a limit empty (NULL); 0 means no limit. Limits apply per
+# target database (host, port and database name, however many saved
+# connections point at it) and per worker process, like the connection pools.
+# When saved connections to one database set different limits, the strictest applies.
+EXECUTION_MAX_CONCURRENT = int(os.environ.get('EXECUTION_MAX_CONCURRENT', 5))
+EXECUTION_USER_CONCURRENCY = int(os.environ.get('EXECUTION_USER_CONCURRENCY', 3))
+# Seconds a query waits for a slot before the database is reported busy
+EXECUTION_QUEUE_TIMEOUT = float(os.environ.get('EXECUTION_QUEUE_TIMEOUT', 30))
+# Queries that may wait for one target database; more are turned away at once
+EXECUTION_QUEUE_MAX = int(os.environ.get('EXECUTION_QUEUE_MAX', 100))
+
+class ExecutionBusy(Exception):
+    """The target database has no free execution slot within the queue timeout"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def _setting(connection, name, default):
+    value = getattr(connection, name, None)
+    value = default if value is None else value
+    return value or float('inf')
+
+def concurrency_limits(connection):
+    """(queries running on the connection's database, queries per user there) allowed at once"""
+    return (_setting(connection, 'max_concurrent_queries', EXECUTION_MAX_CONCURRENT),
+            _setting(connection, 'max_user_queries', EXECUTION_USER_CONCURRENCY))
+
+def target_key(connection):
+    """Identifies the database a connection points at, shared by all saved connections to it"""
+    return (connection.db_type.lower(), (connection.host or '').lower(), connection.port, connection.database_name)
+
+class _Waiter:
+    __slots__ = ('user_id', 'granted', 'event')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.granted = False
+        self.event = threading.Event()
+
+class _Target:
+    """Running counts and waiting queries of one target database"""
+
+    def __init__(self, key):
+        self.key = key
+        self.db_type = key[0]
+        self.running = 0
+        self.running_by_user = {}
+        # user id -> that user's waiters in arrival order; users are served round-robin
+        self.waiting = OrderedDict()
+        self.depth = 0
+
+class ExecutionScheduler:
+    """
+    Limits how many queries run at once against each target database
+
+    A query takes a slot for as long as it runs (for a stream, until the
+    last row is fetched). A target runs at most max_concurrent_queries at
+    once and each user at most max_user_queries there; when the saved
+    connections to one database disagree, the strictest of their limits
+    holds for all of them, so one owner can't lift the cap for everyone.
+    When no slot is free
+    the query waits in a per-user queue; freed slots go to the waiting users
+    in turn, so one user's burst (say, a batch of 50 questions) can't starve
+    everyone else. A query that waits longer than EXECUTION_QUEUE_TIMEOUT,
+    or arrives while EXECUTION_QUEUE_MAX are already waiting, fails with
+    ExecutionBusy instead of piling more load on the database.
+    """
+
+    def __init__(self):
+        self._targets = {}
+        # target key -> {connection id: (limit, user limit)} of the connections seen using it
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, connection, timeout=None):
+        """Hold an execution slot on the connection's database; raises ExecutionBusy"""
+        token = self.acquire(connection, timeout)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def acquire(self, connection, timeout=None):
+        """Wait for a slot and return the token to release it with; raises ExecutionBusy"""
+        key = target_key(connection)
+        timeout = EXECUTION_QUEUE_TIMEOUT if timeout is None else timeout
+        waiter = _Waiter(connection.user_id)
+        started = time.perf_counter()
+
+        with self._lock:
+            self._limits.setdefault(key, {})[connection.id] = concurrency_limits(connection)
+            target = self._targets.get(key)
+            if target is None:
+                target = self._targets[key] = _Target(key)
+            if target.depth >= EXECUTION_QUEUE_MAX:
+                reason = 'queue_full'
+            else:
+                target.waiting.setdefault(waiter.user_id, deque()).append(waiter)
+                target.depth += 1
+                self._dispatch(target)
+                reason = None
+            self._publish(target.db_type)
+
+        if reason is None and not waiter.granted:
+            waiter.event.wait(timeout)
+            with self._lock:
+                if not waiter.granted:
+                    # Timed out; a slot granted after this point goes to the next waiter instead
+                    self._remove(key, target, waiter)
+                    reason = 'timeout'
+                    self._publish(target.db_type)
+
+        record_execution_wait(key[0], time.perf_counter() - started, reason or 'run')
+        if reason is not None:
+            raise ExecutionBusy(
+                f"The database '{connection.database_name}' is busy running other queries "
+                f"({target.running} running, {target.depth} waiting). Please try again shortly.",
+                retry_after=max(1, int(timeout) // 2)
+            )
+        return key, waiter.user_id
+
+    def release(self, token):
+        key, user_id = token
+        with self._lock:
+            target = self._targets[key]
+            target.running -= 1
+            remaining = target.running_by_user[user_id] - 1
+            if remaining:
+                target.running_by_user[user_id] = remaining
+            else:
+                del target.running_by_user[user_id]
+            self._dispatch(target)
+            if not target.running and not target.depth:
+                del self._targets[key]
+            self._publish(target.db_type)
+
+    def _dispatch(self, target):
+        """Grant free slots to waiting users in round-robin order (lock must be held)"""
+        # A connection forgotten while its queries still run leaves only the defaults
+        limits = list(self._limits.get(target.key, {}).values()) or [concurrency_limits(None)]
+        limit = min(limit for limit, _ in limits)
+        user_limit = min(user_limit for _, user_limit in limits)
+        granted = True
+        while granted and target.depth:
+            granted = False
+            for user_id in list(target.waiting):
+                queue = target.waiting[user_id]
+                waiter = queue[0]
+                if target.running >= limit or target.running_by_user.get(user_id, 0) >= user_limit:
+                    continue
+                queue.popleft()
+                target.depth -= 1
+                # The served user goes to the back of the line
+                del target.waiting[user_id]
+                if queue:
+                    target.waiting[user_id] = queue
+                target.running += 1
+                target.running_by_user[user_id] = target.running_by_user.get(user_id, 0) + 1
+                waiter.granted = True
+                waiter.event.set()
+                granted = True
+                break
+
+    def forget(self, conn_id):
+        """Stop applying a saved connection's limits, e.g. after it was edited or deleted"""
+        with self._lock:
+            for key, limits in list(self._limits.items()):
+                limits.pop(conn_id, None)
+                if not limits and key not in self._targets:
+                    del self._limits[key]
+
+    def _remove(self, key, target, waiter):
+        queue = target.waiting[waiter.user_id]
+        queue.remove(waiter)
+        target.depth -= 1
+        if not queue:
+            del target.waiting[waiter.user_id]
+        if not target.running and not target.depth:
+            self._targets.pop(key, None)
+
+    def _publish(self, db_type):
+        """Update this process's running and waiting gauges for a database type (lock must be held)"""
+        targets = [target for target in self._targets.values() if target.db_type == db_type]
+        set_execution_load(db_type, sum(target.running for target in targets), sum(target.depth for target in targets))
+
+    def stats(self, connection):
+        """{'running', 'waiting'} on the connection's database in this process"""
+        with self._lock:
+            target = self._targets.get(target_key(connection))
+            return {'running': target.running if target else 0, 'waiting': target.depth if target else 0}
+
+# Shared, process-wide execution scheduler
+execution_scheduler = ExecutionScheduler()
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from flask import has_app_context
+from sqlalchemy.exc import SQLAlchemyError
+from extensions import db
+from pool import pool_manager
+from cache import TTLCache
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Seconds a schema stays in memory; after that it is reloaded from its stored snapshot
+SCHEMA_CACHE_TTL = int(os.environ.get('SCHEMA_CACHE_TTL', 3600))
+# Table signatures are re-checked against the database at most this often (seconds)
+SCHEMA_FINGERPRINT_INTERVAL = int(os.environ.get('SCHEMA_FINGERPRINT_INTERVAL', 30))
+SCHEMA_CACHE_SIZE = int(os.environ.get('SCHEMA_CACHE_SIZE', 256))
+
+_schema_cache = TTLCache(maxsize=SCHEMA_CACHE_SIZE, ttl=SCHEMA_CACHE_TTL)
+# One lock per connection so concurrent requests don't introspect the same database twice
+_introspection_locks = {}
+_locks_guard = threading.Lock()
+
+# One row per table: its name and a checksum of its columns, indexes and foreign
+# keys. Catalog rows get a new xmin (or oid) whenever DDL rewrites them.
+PG_SIGNATURES_SQL = """
+    SELECT {table_name} AS table_name, md5(
+        COALESCE((SELECT string_agg(a.attnum::text || ':' || a.attname || ':' || a.atttypid::text || ':' ||
+                                    a.atttypmod::text || ':' || a.attnotnull::text || ':' || a.xmin::text,
+                                    ',' ORDER BY a.attnum)
+                  FROM pg_attribute a
+                  WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped), '') || '|' ||
+        COALESCE((SELECT string_agg(d.oid::text, ',' ORDER BY d.oid)
+                  FROM pg_attrdef d WHERE d.adrelid = c.oid), '') || '|' ||
+        COALESCE((SELECT string_agg(i.indexrelid::text, ',' ORDER BY i.indexrelid)
+                  FROM pg_index i WHERE i.indrelid = c.oid), '') || '|' ||
+        COALESCE((SELECT string_agg(con.oid::text, ',' ORDER BY con.oid)
+                  FROM pg_constraint con WHERE con.conrelid = c.oid AND con.contype = 'f'), '')
+    ) AS signature
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+      AND has_table_privilege(c.oid, 'SELECT')
+      AND {schema_filter}
+"""
+
+# information_schema.TABLES timestamps can be cached by the server (and
+# UPDATE_TIME tracks row changes, not DDL), so column and foreign key
+# checksums are what detect a change; CREATE_TIME catches table rebuilds.
+MYSQL_SIGNATURES_SQL = """
+    SELECT t.TABLE_NAME AS table_name,
+           CONCAT_WS(':', COALESCE(t.CREATE_TIME, ''), COUNT(c.COLUMN_NAME),
+                     COALESCE(SUM(CRC32(CONCAT_WS('|', c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, c.COLUMN_KEY,
+                                                  c.ORDINAL_POSITION, c.COLUMN_DEFAULT, c.EXTRA))), 0),
+                     COALESCE((SELECT SUM(CRC32(CONCAT_WS('|', k.CONSTRAINT_NAME, k.COLUMN_NAME,
+                                                          k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME)))
+                               FROM information_schema.KEY_COLUMN_USAGE k
+                               WHERE k.TABLE_SCHEMA = t.TABLE_SCHEMA AND k.TABLE_NAME = t.TABLE_NAME
+                                 AND k.REFERENCED_TABLE_NAME IS NOT NULL), 0)) AS signature
+    FROM information_schema.TABLES t
+    LEFT JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+    WHERE t.TABLE_SCHEMA = DATABASE()
+    GROUP BY t.TABLE_SCHEMA, t.TABLE_NAME, t.CREATE_TIME
+"""
+
+class CachedSchema:
+    """A schema snapshot together with the table signatures it was built from"""
+
+    def __init__(self, schema, signatures, checked_at=None):
+        self.schema = schema
+        self.signatures = signatures
+        self.fingerprint = schema_fingerprint(signatures)
+        self.checked_at = time.monotonic() if checked_at is None else checked_at
+
+def schema_fingerprint(signatures):
+    """Checksum over all table signatures, identifying one version of the schema"""
+    return hashlib.md5(json.dumps(sorted(signatures.items())).encode()).hexdigest()
+
+@timed('schema')
+def get_table_signatures(connection):
+    """Return {table: signature} for every table, from one cheap catalog query"""
+    # Imported here because database.py imports this module
+    from database import PG_SCHEMA_FILTER, PG_TABLE_NAME, schema_errors
+
+    with schema_errors(connection):
+        with pool_manager.connection(connection) as conn:
+            with conn.cursor() as cursor:
+                if connection.is_mysql:
+                    cursor.execute(MYSQL_SIGNATURES_SQL)
+                    return {row['table_name']: row['signature'] for row in cursor.fetchall()}
+                elif connection.is_postgresql:
+                    cursor.execute(PG_SIGNATURES_SQL.format(table_name=PG_TABLE_NAME, schema_filter=PG_SCHEMA_FILTER))
+                    return dict(cursor.fetchall())
+        raise Exception(f"Unsupported database type: {connection.db_type}")
+
+def get_schema_fingerprint(connection):
+    """Compute a cheap checksum over the table definitions of the target database"""
+    return schema_fingerprint(get_table_signatures(connection))
+
+def _load_snapshot(conn_id):
+    """The connection's stored snapshot, due for a signature check, or None"""
+    from models import SchemaSnapshot
+
+    if not has_app_context():
+        return None
+    try:
+        with db.engine.connect() as conn:
+            data = conn.execute(
+                db.select(SchemaSnapshot.data).where(SchemaSnapshot.connection_id == conn_id)
+            ).scalar()
+    except SQLAlchemyError as e:
+        logger.warning("Could not load the schema snapshot of connection %s: %s", conn_id, e)
+        return None
+    if data is None:
+        return None
+    snapshot = json.loads(zlib.decompress(data).decode())
+    return CachedSchema(snapshot['schema'], snapshot['signatures'], checked_at=float('-inf'))
+
+def _save_snapshot(conn_id, cached):
+    """Persist a snapshot in its own transaction, leaving the caller's session alone"""
+    from models import SchemaSnapshot
+
+    if not has_app_context():
+        return
+    data = zlib.compress(json.dumps({'schema': cached.schema, 'signatures': cached.signatures},
+                                    default=str, separators=(',', ':')).encode())
+    table = SchemaSnapshot.__table__
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(table.delete().where(table.c.connection_id == conn_id))
+            conn.execute(table.insert().values(connection_id=conn_id, fingerprint=cached.fingerprint,
+                                               data=data, updated_at=datetime.utcnow()))
+    except SQLAlchemyError as e:
+        logger.warning("Could not save the schema snapshot of connection %s: %s", conn_id, e)
+
+def _refresh_tables(connection, cached, signatures):
+    """Re-introspect only the tables whose signature changed and drop removed ones"""
+    from database import get_database_schema
+
+    changed = {table for table, signature in signatures.items() if cached.signatures.get(table) != signature}
+    removed = set(cached.signatures) - set(signatures)
+    # Foreign keys into a changed or removed table may name columns that are gone
+    touched = changed | removed
+    changed |= {
+        table for table, columns in cached.schema.items()
+        if table in signatures and any(column.get('References', {}).get('table') in touched for column in columns)
+    }
+
+    schema = {table: columns for table, columns in cached.schema.items()
+              if table in signatures and table not in changed}
+    schema.update(get_database_schema(connection, sorted(changed)))
+    logger.info("Schema of connection %s: %d tables re-introspected, %d removed",
+                connection.id, len(changed), len(removed))
+    return dict(sorted(schema.items()))
+
+def _lock_for(conn_id):
+    with _locks_guard:
+        return _introspection_locks.setdefault(conn_id, threading.Lock())
+
+def get_cached_schema(connection, refresh=False):
+    """
+    Return the schema for a connection, introspecting only what changed
+
+    A schema is reused while its table signatures match the database's
+    (checked at most every SCHEMA_FINGERPRINT_INTERVAL seconds). When some
+    differ, only the changed tables are re-introspected and dropped tables
+    are removed. Snapshots are stored in the SchemaSnapshot table, so a new
+    worker only checks signatures instead of introspecting from scratch.
+    Pass refresh=True to force a full re-introspection.
+    """
+    from database import get_database_schema
+
+    if not refresh:
+        cached = _schema_cache.get(connection.id)
+        if cached and time.monotonic() - cached.checked_at < SCHEMA_FINGERPRINT_INTERVAL:
+            return cached.schema
+
+    with _lock_for(connection.id):
+        cached = None if refresh else _schema_cache.get(connection.id) or _load_snapshot(connection.id)
+        if cached and time.monotonic() - cached.checked_at < SCHEMA_FINGERPRINT_INTERVAL:
+            return cached.schema
+
+        # Signatures are read before introspecting, so a concurrent change shows up on the next check
+        signatures = get_table_signatures(connection)
+        if cached and cached.signatures == signatures:
+            cached.checked_at = time.monotonic()
+            _schema_cache.set(connection.id, cached)
+            return cached.schema
+
+        if cached:
+            schema = _refresh_tables(connection, cached, signatures)
+        else:
+            schema = dict(sorted(get_database_schema(connection).items()))
+        cached = CachedSchema(schema, signatures)
+        _schema_cache.set(connection.id, cached)
+        _save_snapshot(connection.id, cached)
+        return schema
+
+def get_cached_fingerprint(connection):
+    """Return the fingerprint of the cached schema, if one is cached"""
+    cached = _schema_cache.get(connection.id)
+    return cached.fingerprint if cached else None
+
+def invalidate_schema(conn_id):
+    """
+    Forget the in-memory schema for a connection
+
+    The stored snapshot is kept: it is only used after its table signatures
+    have been checked against the database again.
+    """
+    _schema_cache.pop(conn_id)
@@ -0,0 +1,151 @@
+import os
+import re
+import math
+from collections import Counter
+from ai import describe_table, estimate_tokens
+from cache import TTLCache
+
+# Upper bound on the (estimated) tokens spent on the schema in the generation prompt
+SCHEMA_PROMPT_TOKEN_BUDGET = int(os.environ.get('SCHEMA_PROMPT_TOKEN_BUDGET', 6000))
+# Maximum number of directly matching tables included before adding foreign-key neighbors
+SCHEMA_TOP_K = int(os.environ.get('SCHEMA_TOP_K', 12))
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Table-name tokens count this many times more than column-name tokens
+TABLE_NAME_WEIGHT = 3
+
+_STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'do', 'does', 'each', 'for', 'from', 'get',
+    'give', 'has', 'have', 'how', 'i', 'in', 'is', 'it', 'list', 'many', 'me', 'much', 'of', 'on',
+    'or', 'per', 'please', 'show', 'that', 'the', 'their', 'there', 'to', 'was', 'were', 'what',
+    'when', 'where', 'which', 'who', 'with', 'all', 'any', 'find', 'tell', 'our', 'my', 'we',
+}
+
+_index_cache = TTLCache(maxsize=256, ttl=0)
+
+def split_identifier(identifier):
+    """Split an identifier on snake_case, camelCase, digits and punctuation into lowercase words"""
+    words = []
+    for part in re.split(r'[^0-9A-Za-z]+', identifier):
+        words.extend(re.findall(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+', part))
+    return [word.lower() for word in words]
+
+def _stem(word):
+    """Very small plural folding so 'orders' matches 'order' and 'categories' matches 'category'"""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('ses', 'xes', 'ches', 'shes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+def tokenize(text):
+    """Tokenize free text or identifiers into stemmed search terms"""
+    return [_stem(word) for word in split_identifier(text) if word not in _STOPWORDS]
+
+class SchemaIndex:
+    """BM25 index over the tables of a schema, with foreign-key neighbors"""
+
+    def __init__(self, schema_info):
+        self.schema_info = schema_info
+        self.terms = {}
+        self.costs = {}
+        self.neighbors = {table: set() for table in schema_info}
+
+        for table, columns in schema_info.items():
+            terms = tokenize(table) * TABLE_NAME_WEIGHT
+            for column in columns:
+                terms.extend(tokenize(column['Field']))
+                reference = column.get('References')
+                if reference and reference['table'] in self.neighbors:
+                    self.neighbors[table].add(reference['table'])
+                    self.neighbors[reference['table']].add(table)
+            self.terms[table] = Counter(terms)
+            self.costs[table] = estimate_tokens(describe_table(table, columns))
+
+        lengths = [sum(counts.values()) for counts in self.terms.values()]
+        self.average_length = (sum(lengths) / len(lengths)) if lengths else 0
+        document_frequency = Counter()
+        for counts in self.terms.values():
+            document_frequency.update(counts.keys())
+        total = len(self.terms)
+        self.idf = {
+            term: math.log(1 + (total - freq + 0.5) / (freq + 0.5))
+            for term, freq in document_frequency.items()
+        }
+
+    @property
+    def total_cost(self):
+        return sum(self.costs.values())
+
+    def score(self, question):
+        """Return {table: BM25 score} for the tables matching the question"""
+        query_terms = set(tokenize(question))
+        scores = {}
+        for table, counts in self.terms.items():
+            length = sum(counts.values())
+            score = 0.0
+            for term in query_terms:
+                frequency = counts.get(term)
+                if not frequency:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self.average_length or 1))
+                score += self.idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+            if score > 0:
+                scores[table] = score
+        return scores
+
+    def select_tables(self, question, token_budget=SCHEMA_PROMPT_TOKEN_BUDGET, top_k=SCHEMA_TOP_K):
+        """
+        Pick the tables relevant to a question within a token budget
+
+        Direct matches are taken in score order (at most top_k), then their
+        foreign-key neighbors so the model can still see join targets. Tables
+        that don't fit in the remaining budget are skipped.
+        """
+        if self.total_cost <= token_budget:
+            return list(self.schema_info)
+
+        scores = self.score(question)
+        ranked = sorted(scores, key=lambda table: (-scores[table], table))[:top_k]
+        if not ranked:
+            # Nothing matched: fall back to the smallest tables that fit
+            ranked = sorted(self.schema_info, key=lambda table: self.costs[table])
+
+        selected = []
+        used = 0
+
+        def take(table):
+            nonlocal used
+            if table not in selected and used + self.costs[table] <= token_budget:
+                selected.append(table)
+                used += self.costs[table]
+
+        for table in ranked:
+            take(table)
+        for table in list(selected):
+            for neighbor in sorted(self.neighbors[table], key=lambda t: (-scores.get(t, 0), t)):
+                take(neighbor)
+        return selected
+
+def get_schema_index(conn_id, fingerprint, schema_info):
+    """Return the index for a cached schema, building it once per schema fingerprint"""
+    key = (conn_id, fingerprint)
+    index = _index_cache.get(key)
+    if index is None or index.schema_info is not schema_info:
+        index = SchemaIndex(schema_info)
+        _index_cache.set(key, index)
+    return index
+
+def prune_schema(conn_id, fingerprint, schema_info, question, token_budget=SCHEMA_PROMPT_TOKEN_BUDGET):
+    """Return the subset of schema_info relevant to a question, preserving table order"""
+    index = get_schema_index(conn_id, fingerprint, schema_info)
+    selected = set(index.select_tables(question, token_budget))
+    return {table: columns for table, columns in schema_info.items() if table in selected}
+
+def invalidate_schema_index(conn_id):
+    """Forget the indexes built for a connection"""
+    _index_cache.discard_where(lambda key: key[0] == conn_id)
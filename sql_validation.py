@@ -0,0 +1,424 @@
+import re
+
+# Statements the app will send to the database
+STATEMENT_KEYWORDS = ('select', 'with', 'insert', 'update', 'delete', 'show', 'explain', 'describe', 'desc')
+
+# Keywords after which a table reference follows (see _starts_table_reference for UPDATE and FROM)
+_TABLE_KEYWORDS = {'from', 'join', 'into', 'update'}
+# Keywords that can't end a complete statement
+_DANGLING_KEYWORDS = {
+    'select', 'from', 'where', 'and', 'or', 'not', 'join', 'on', 'by', 'group', 'order', 'having',
+    'limit', 'offset', 'set', 'values', 'into', 'union', 'as', 'in', 'like', 'between', 'case', 'when',
+    'then', 'else', 'distinct', 'with', 'inner', 'left', 'right', 'full', 'outer', 'cross',
+}
+# Words that may follow a table reference instead of an alias
+_CLAUSE_KEYWORDS = _DANGLING_KEYWORDS | {
+    'end', 'natural', 'using', 'window', 'returning', 'for', 'lateral', 'fetch', 'except', 'intersect',
+    'straight_join', 'partition', 'use', 'force', 'ignore', 'tablesample', 'only',
+}
+# Schemas whose tables are not part of the introspected schema but are fine to query
+_SYSTEM_SCHEMAS = {'information_schema', 'pg_catalog', 'mysql', 'performance_schema', 'sys'}
+
+_TOKEN = re.compile(r"""
+      (?P<space>\s+)
+    | (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?\*/)
+    | (?P<string>(?:[EeNnBbXx])?'(?:[^'\\]|''|\\.)*')
+    | (?P<dollar>\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$)
+    | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`)
+    | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<param>%s|%\(\w+\)s|\?|\$\d+|:\w+)
+    | (?P<op>::|<=|>=|<>|!=|\|\||->>|->|[-+*/%=<>(),.;\[\]^~!&|@:])
+""", re.VERBOSE | re.DOTALL)
+
+_STATEMENT_START = re.compile(r'\s*\(?\s*(?:' + '|'.join(STATEMENT_KEYWORDS) + r')\b', re.IGNORECASE)
+_FENCE = re.compile(r"```[ \t]*(?:sql|mysql|postgresql|postgres|pgsql)?[ \t]*\n?(.*?)```", re.IGNORECASE | re.DOTALL)
+
+class SQLValidationError(Exception):
+    """Generated SQL failed local validation; sql is the offending statement"""
+
+    def __init__(self, message, sql):
+        super().__init__(message)
+        self.sql = sql
+
+class Name(str):
+    """An identifier as written: exact text if it was quoted, lowercased if not"""
+    quoted = False
+
+class Token:
+    __slots__ = ('kind', 'text', 'depth', 'start', 'end')
+
+    def __init__(self, kind, text, depth, start=None, end=None):
+        self.kind = kind
+        self.text = text
+        self.depth = depth
+        # Offsets of the token in the SQL it was read from
+        self.start = start
+        self.end = end
+
+    @property
+    def lower(self):
+        return self.text.lower()
+
+    @property
+    def name(self):
+        """Identifier text without quotes (lowercased unless quoted)"""
+        if self.kind == 'quoted':
+            name = Name(self.text[1:-1].replace(self.text[0] * 2, self.text[0]))
+            name.quoted = True
+            return name
+        return Name(self.text.lower())
+
+    def is_word(self, *words):
+        return self.kind == 'word' and self.lower in words
+
+    def is_op(self, op):
+        return self.kind == 'op' and self.text == op
+
+def clean_sql(text):
+    """
+    Extract the SQL statement from a model response
+
+    Takes the contents of a markdown code fence if there is one, drops any
+    prose before the first statement keyword, and drops trailing prose after
+    the statement's semicolon or after a blank line.
+    """
+    text = text.strip()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+
+    lines = text.splitlines()
+    start = next((i for i, line in enumerate(lines) if _STATEMENT_START.match(line)), 0)
+    kept = []
+    for i, line in enumerate(lines[start:]):
+        stripped = line.strip()
+        # Prose after a blank line starts with a capitalized word that isn't SQL
+        if kept and not lines[start + i - 1].strip() and re.match(r'[A-Z][a-z]+\b', stripped) \
+                and stripped.split()[0].lower() not in _CLAUSE_KEYWORDS | set(STATEMENT_KEYWORDS):
+            break
+        kept.append(line)
+    sql = '\n'.join(kept).strip()
+
+    # Anything after the first top-level semicolon is not part of the statement
+    for match in _TOKEN.finditer(sql):
+        if match.lastgroup == 'op' and match.group() == ';':
+            return sql[:match.start()].strip()
+    return sql
+
+def tokenize(sql):
+    """Split SQL into tokens (comments and whitespace dropped); raises ValueError on bad lexing"""
+    tokens = []
+    depth = 0
+    position = 0
+    while position < len(sql):
+        match = _TOKEN.match(sql, position)
+        if match is None:
+            char = sql[position]
+            if char in "'\"`":
+                raise ValueError(f"Unterminated quote ({char}) starting at: {sql[position:position + 30]!r}")
+            if sql.startswith('/*', position):
+                raise ValueError("Unterminated /* comment")
+            raise ValueError(f"Unexpected character {char!r}")
+        kind = match.lastgroup if match.lastgroup != 'tag' else 'dollar'
+        text = match.group()
+        position = match.end()
+        if kind in ('space', 'comment'):
+            continue
+        if kind == 'dollar':
+            kind = 'string'
+        if text == ')':
+            depth -= 1
+            if depth < 0:
+                raise ValueError("Unbalanced parentheses: ')' without a matching '('")
+        tokens.append(Token(kind, text, depth, match.start(), match.end()))
+        if text == '(':
+            depth += 1
+    if depth:
+        raise ValueError("Unbalanced parentheses: missing ')'")
+    return tokens
+
+def _check_syntax(tokens, db_type):
+    """Structural and dialect checks that don't need the schema"""
+    if not tokens:
+        raise ValueError("The statement is empty")
+    if not (tokens[0].kind == 'word' and tokens[0].lower in STATEMENT_KEYWORDS) and not tokens[0].is_op('('):
+        raise ValueError(f"Statements must start with one of {', '.join(k.upper() for k in STATEMENT_KEYWORDS[:6])}, "
+                         f"not {tokens[0].text!r}")
+    for i, token in enumerate(tokens):
+        if token.is_op(';'):
+            raise ValueError("Only a single SQL statement is allowed")
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token.is_op(',') and following is not None and \
+                (following.is_op(')') or following.is_word('from', 'where', 'group', 'order')):
+            raise ValueError(f"Unexpected comma before {following.text!r}")
+        if token.is_word('select') and following is not None and following.is_word('top'):
+            raise ValueError("SELECT TOP is SQL Server syntax; use LIMIT")
+        if db_type == 'postgresql' and token.kind == 'quoted' and token.text.startswith('`'):
+            raise ValueError("PostgreSQL quotes identifiers with double quotes, not backticks")
+        if db_type == 'mysql':
+            if token.is_word('ilike'):
+                raise ValueError("MySQL has no ILIKE; use LIKE (case-insensitive by default) or LOWER()")
+            if token.is_op('::'):
+                raise ValueError("MySQL has no :: casts; use CAST(value AS type)")
+    last = tokens[-1]
+    if last.kind == 'word' and last.lower in _DANGLING_KEYWORDS or last.is_op(',') or \
+            (last.kind == 'op' and last.text in ('=', '<', '>', '<=', '>=', '<>', '!=', '+', '-', '/', '.')):
+        raise ValueError(f"The statement is incomplete: it ends with {last.text!r}")
+
+def _read_name(tokens, i):
+    """Read a possibly qualified name starting at tokens[i]; returns (parts, next_index)"""
+    parts = [tokens[i].name]
+    i += 1
+    while i + 1 < len(tokens) and tokens[i].is_op('.') and tokens[i + 1].kind in ('word', 'quoted'):
+        parts.append(tokens[i + 1].name)
+        i += 2
+    return parts, i
+
+class _SchemaLookup:
+    """
+    Table and column lookup over a schema_info dict
+
+    Unquoted names match case-insensitively. On PostgreSQL a quoted name
+    must match exactly, as it does in the database; MySQL compares
+    identifiers the same way whether or not they are quoted.
+    """
+
+    def __init__(self, schema_info, database_name=None, case_sensitive=False):
+        self.columns = {}
+        self.folded = {}
+        for table, columns in schema_info.items():
+            self.columns[table] = {column['Field'].lower(): column['Field'] for column in columns}
+            self.folded.setdefault(table.lower(), table)
+        self.database_name = (database_name or '').lower()
+        self.case_sensitive = case_sensitive
+
+    def _match(self, name, exact):
+        """True if a name as written refers to the exact name from the schema"""
+        if name == exact:
+            return True
+        return name.lower() == exact.lower() and not (name.quoted and self.case_sensitive)
+
+    def resolve(self, parts):
+        """Return the schema_info key for a table reference, None if unknown, or '' for system tables"""
+        if len(parts) > 1 and parts[-2].lower() in _SYSTEM_SCHEMAS or parts[-1].lower().startswith('pg_'):
+            return ''
+        # Drop a database prefix (MySQL) or the public schema (PostgreSQL)
+        if len(parts) > 1 and parts[-2].lower() in ('public', self.database_name):
+            parts = parts[-1:]
+        parts = parts[-2:]
+        name = '.'.join(parts)
+        if name in self.columns:
+            return name
+        table = self.folded.get(name.lower())
+        if table is None or table.count('.') != len(parts) - 1:
+            return None
+        return table if all(map(self._match, parts, table.split('.'))) else None
+
+    def has_column(self, table, column):
+        exact = self.columns[table].get(column.lower())
+        return exact is not None and self._match(column, exact)
+
+def _in_function_call(tokens, i):
+    """True if tokens[i] sits directly inside a function's parentheses, as in EXTRACT(YEAR FROM x)"""
+    depth = tokens[i].depth
+    if depth == 0:
+        return False
+    for k in range(i - 1, -1, -1):
+        if tokens[k].is_op('(') and tokens[k].depth == depth - 1:
+            # A subquery's parentheses open with SELECT or WITH
+            return not (k + 1 < len(tokens) and tokens[k + 1].is_word('select', 'with'))
+    return False
+
+def _starts_table_reference(tokens, i):
+    """
+    True if tokens[i], a _TABLE_KEYWORDS word, is followed by a table reference
+
+    UPDATE names a table only when it starts a statement, either at the top
+    or inside or after a WITH clause; not in ON CONFLICT ... DO UPDATE, ON
+    DUPLICATE KEY UPDATE or FOR UPDATE. The FROM of IS [NOT] DISTINCT FROM
+    is a comparison, not a table list.
+    """
+    if _in_function_call(tokens, i):
+        return False
+    previous = tokens[i - 1] if i else None
+    if tokens[i].lower == 'update':
+        return previous is None or previous.is_op('(') or previous.is_op(')')
+    if tokens[i].lower == 'from' and previous is not None and previous.is_word('distinct'):
+        return not (i > 1 and tokens[i - 2].is_word('is', 'not'))
+    return True
+
+def _check_references(tokens, lookup):
+    """Verify referenced tables exist and qualified column references name real columns"""
+    ctes = set()
+    for i in range(len(tokens) - 2):
+        # CTE definitions: name AS ( ... ) or name (columns) AS ( ... )
+        if tokens[i].kind in ('word', 'quoted') and tokens[i + 1].is_word('as') and tokens[i + 2].is_op('('):
+            if i == 0 or tokens[i - 1].is_word('with', 'recursive') or tokens[i - 1].is_op(','):
+                ctes.add(tokens[i].name)
+        if tokens[i].is_op(')') and tokens[i + 1].is_word('as') and tokens[i + 2].is_op('('):
+            # name (columns) AS (...): walk back to the name before the column list
+            j = i
+            while j > 0 and not tokens[j].is_op('('):
+                j -= 1
+            if j > 0 and tokens[j - 1].kind in ('word', 'quoted'):
+                ctes.add(tokens[j - 1].name)
+
+    aliases = {}  # alias or table name -> resolved table key (None when columns are unknown)
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if not (token.kind == 'word' and token.lower in _TABLE_KEYWORDS) or not _starts_table_reference(tokens, i):
+            i += 1
+            continue
+        depth = token.depth
+        i += 1
+        while i < len(tokens):
+            while i < len(tokens) and tokens[i].is_word('only', 'lateral', 'ignore'):
+                i += 1
+            if i >= len(tokens):
+                break
+            if tokens[i].is_op('('):
+                # Derived table or subquery: its alias exposes unknown columns
+                close = next((k for k in range(i + 1, len(tokens))
+                              if tokens[k].is_op(')') and tokens[k].depth == depth), len(tokens) - 1)
+                i = close + 1
+                table = None
+                parts = None
+            elif tokens[i].kind in ('word', 'quoted'):
+                parts, i = _read_name(tokens, i)
+                if i < len(tokens) and tokens[i].is_op('(') and token.lower == 'into':
+                    # INSERT INTO t (columns): skip the column list
+                    i = next((k for k in range(i + 1, len(tokens))
+                              if tokens[k].is_op(')') and tokens[k].depth == depth), len(tokens) - 1) + 1
+                    table = lookup.resolve(parts)
+                    if table is None:
+                        raise ValueError(f"Unknown table {'.'.join(parts)!r}")
+                    break
+                if i < len(tokens) and tokens[i].is_op('('):
+                    # Table function such as generate_series(...)
+                    table = None
+                    close = next((k for k in range(i + 1, len(tokens))
+                                  if tokens[k].is_op(')') and tokens[k].depth == depth), len(tokens) - 1)
+                    i = close + 1
+                elif len(parts) == 1 and parts[0] in ctes:
+                    table = None
+                else:
+                    table = lookup.resolve(parts)
+                    if table is None:
+                        raise ValueError(f"Unknown table {'.'.join(parts)!r}")
+                    aliases[parts[-1]] = table or None
+                    aliases['.'.join(parts)] = table or None
+            else:
+                break
+            # Optional alias
+            if i < len(tokens) and tokens[i].is_word('as'):
+                i += 1
+            if i < len(tokens) and tokens[i].kind in ('word', 'quoted') and \
+                    not (tokens[i].kind == 'word' and tokens[i].lower in _CLAUSE_KEYWORDS):
+                aliases[tokens[i].name] = table or None
+                i += 1
+            # FROM a, b, c
+            if i < len(tokens) and tokens[i].is_op(',') and tokens[i].depth == depth and token.lower == 'from':
+                i += 1
+                continue
+            break
+
+    # Qualified column references: alias.column or table.column
+    for i in range(len(tokens) - 2):
+        if tokens[i].kind not in ('word', 'quoted') or not tokens[i + 1].is_op('.'):
+            continue
+        if i > 0 and tokens[i - 1].is_op('.'):
+            continue
+        parts, end = _read_name(tokens, i)
+        if end < len(tokens) and tokens[end].is_op('('):
+            continue  # schema-qualified function call
+        if i + 2 < len(tokens) and tokens[i + 2].is_op('*'):
+            continue
+        qualifier, column = '.'.join(parts[:-1]), parts[-1]
+        if qualifier in aliases:
+            table = aliases[qualifier]
+            if table and not lookup.has_column(table, column):
+                raise ValueError(f"Unknown column {column!r} in table {table!r}")
+
+def validate_sql(sql_query, schema_info, db_type='mysql', database_name=None):
+    """
+    Check generated SQL locally before it is sent to the database
+
+    Lexes the statement, checks its structure (a single statement of an
+    allowed kind, balanced parentheses, nothing dangling) and a few common
+    dialect mistakes, then checks that every referenced table exists in
+    schema_info and that qualified column references (alias.column) name
+    real columns. Unqualified columns are left to the database, since they
+    can't be told apart from output aliases without a full parser.
+    Raises ValueError describing the first problem found.
+    """
+    tokens = tokenize(sql_query)
+    db_type = (db_type or 'mysql').lower()
+    _check_syntax(tokens, db_type)
+    # SHOW / DESCRIBE / EXPLAIN name databases and tables in their own ways
+    if schema_info and not tokens[0].is_word('show', 'describe', 'desc', 'explain'):
+        _check_references(tokens, _SchemaLookup(schema_info, database_name, db_type == 'postgresql'))
+
+# Statements that only read; EXPLAIN ANALYZE and data-modifying CTEs are checked further
+READ_STATEMENTS = ('select', 'with', 'values', 'table', 'show', 'explain', 'describe', 'desc')
+# Reads PostgreSQL can run through a server-side (DECLARE ... CURSOR) cursor
+CURSOR_STATEMENTS = ('select', 'with', 'values', 'table')
+# Keywords that start a data-modifying statement, including one nested in a CTE
+_WRITE_STATEMENTS = ('insert', 'update', 'delete', 'merge', 'replace')
+
+def _writes(tokens):
+    """True if a SELECT/WITH token list modifies data or takes row locks"""
+    for i, token in enumerate(tokens):
+        previous = tokens[i - 1] if i else None
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+        # A statement keyword at the start of a CTE body or after the CTE list (not a call like REPLACE(...))
+        if token.is_word(*_WRITE_STATEMENTS) and (previous is None or previous.is_op('(') or previous.is_op(')')) \
+                and not (following is not None and following.is_op('(')):
+            return True
+        # SELECT ... FOR UPDATE / FOR SHARE / FOR NO KEY UPDATE / FOR KEY SHARE
+        if token.is_word('update', 'share') and previous is not None and previous.is_word('for', 'key'):
+            return True
+        # SELECT ... INTO creates a table (PostgreSQL) or writes variables and files (MySQL)
+        if token.is_word('into') and token.depth == 0:
+            return True
+    return False
+
+def classify_statement(sql_query):
+    """
+    Return (keyword, is_read) for a statement
+
+    keyword is the lowercased first keyword (after any opening parentheses)
+    or None if the statement can't be lexed. is_read is True for SELECT,
+    WITH, VALUES, TABLE, SHOW, DESCRIBE and EXPLAIN, except a WITH whose CTEs
+    or final statement modify data, a locking SELECT (FOR UPDATE / SHARE),
+    SELECT ... INTO, and EXPLAIN ANALYZE of a write, which executes it.
+    Anything else, including SQL that can't be lexed, counts as a write, so
+    it goes to the primary without a read-only transaction.
+    """
+    try:
+        tokens = tokenize(sql_query)
+    except ValueError:
+        return None, False
+    start = 0
+    while start < len(tokens) and tokens[start].is_op('('):
+        start += 1
+    if start == len(tokens) or tokens[start].kind != 'word':
+        return None, False
+    keyword = tokens[start].lower
+    if keyword not in READ_STATEMENTS:
+        return keyword, False
+    if keyword == 'explain':
+        body = start + 1
+        while body < len(tokens) and not tokens[body].is_word(*CURSOR_STATEMENTS, *_WRITE_STATEMENTS):
+            body += 1
+        analyze = any(token.is_word('analyze', 'analyse') for token in tokens[start + 1:body])
+        return keyword, not (analyze and body < len(tokens) and
+                             (tokens[body].is_word(*_WRITE_STATEMENTS) or _writes(tokens[body:])))
+    if keyword in CURSOR_STATEMENTS:
+        return keyword, not _writes(tokens[start:])
+    return keyword, True
+
+def is_read_statement(sql_query):
+    """True if a statement only reads (see classify_statement)"""
+    return classify_statement(sql_query)[1]
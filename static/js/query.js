@@ -8,6 +8,7 @@ document.addEventListener('DOMContentLoaded', function() {
   const resultData = document.getElementById('resultData');
   const resultExplanation = document.getElementById('resultExplanation');
   const copySqlBtn = document.getElementById('copySql');
+  const refreshSchemaBtn = document.getElementById('refreshSchema');
   
   if (!queryForm) return;
   
@@ -23,97 +24,26 @@ document.addEventListener('DOMContentLoaded', function() {
     const formData = new FormData(queryForm);
     const csrfToken = formData.get('csrf_token');
     
-    // Send query request
-    fetch(queryForm.action, {
+    // Send query request. The streaming endpoint answers with NDJSON events;
+    // errors raised before execution starts come back as plain JSON. In
+    // preview-first mode the preview endpoint answers with JSON right away.
+    const url = formData.get('preview_first') ? queryForm.dataset.previewUrl
+                                              : (queryForm.dataset.streamUrl || queryForm.action);
+    fetch(url, {
       method: 'POST',
       headers: {
         'X-CSRFToken': csrfToken
       },
       body: formData
     })
-    .then(response => response.json())
-    .then(data => {
-      // Hide loading indicator
-      loadingIndicator.classList.add('d-none');
-      
-      if (data.success) {
-        // Display results
-        resultContainer.classList.remove('d-none');
-        
-        // Display SQL query
-        sqlQuery.textContent = data.sql;
-        
-        // Display result data
-        if (Array.isArray(data.result) && data.result.length > 0) {
-          // Create table for result data
-          const table = document.createElement('table');
-          table.className = 'table table-dark table-striped table-hover';
-          
-          // Create table header
-          const thead = document.createElement('thead');
-          const headerRow = document.createElement('tr');
-          
-          // Get column names from first result object
-          const columns = Object.keys(data.result[0]);
-          columns.forEach(column => {
-            const th = document.createElement('th');
-            th.textContent = column;
-            headerRow.appendChild(th);
-          });
-          
-          thead.appendChild(headerRow);
-          table.appendChild(thead);
-          
-          // Create table body
-          const tbody = document.createElement('tbody');
-          
-          // Add data rows
-          data.result.forEach(row => {
-            const tr = document.createElement('tr');
-            
-            columns.forEach(column => {
-              const td = document.createElement('td');
-              td.textContent = row[column] !== null ? row[column] : 'NULL';
-              tr.appendChild(td);
-            });
-            
-            tbody.appendChild(tr);
-          });
-          
-          table.appendChild(tbody);
-          
-          // Add responsive wrapper
-          const tableResponsive = document.createElement('div');
-          tableResponsive.className = 'table-responsive';
-          tableResponsive.appendChild(table);
-          
-          // Clear previous results and add new table
-          resultData.innerHTML = '';
-          resultData.appendChild(tableResponsive);
-        } else if (data.result && data.result.affected_rows !== undefined) {
-          // Display affected rows for non-SELECT queries
-          resultData.innerHTML = `<div class="alert alert-info">
-            <i class="bi bi-info-circle me-2"></i>
-            Query executed successfully. ${data.result.affected_rows} rows affected.
-          </div>`;
-        } else {
-          // No results
-          resultData.innerHTML = `<div class="alert alert-warning">
-            <i class="bi bi-exclamation-triangle me-2"></i>
-            Query executed successfully, but returned no results.
-          </div>`;
-        }
-        
-        // Display explanation
-        resultExplanation.textContent = data.explanation;
-        
-        // Add query to recent list
-        addQueryToRecentList(data.query_id, formData.get('query'));
-      } else {
-        // Show error
-        resultContainer.classList.add('d-none');
-        showToast(data.error, 'danger');
+    .then(response => {
+      const contentType = response.headers.get('Content-Type') || '';
+      if (contentType.indexOf('application/x-ndjson') === -1) {
+        return response.json().then(data => data.job_id && data.preview !== undefined
+          ? handlePreviewResponse(data, formData)
+          : handleQueryResponse(data, formData));
       }
+      return readEvents(response, event => handleStreamEvent(event, formData));
     })
     .catch(error => {
       // Hide loading indicator
@@ -124,6 +54,331 @@ document.addEventListener('DOMContentLoaded', function() {
     });
   });
   
+  // Render a complete (non-streamed) JSON response
+  function handleQueryResponse(data, formData) {
+    // Hide loading indicator
+    loadingIndicator.classList.add('d-none');
+    
+    if (data.success) {
+      // Display results
+      resultContainer.classList.remove('d-none');
+      
+      // Display SQL query
+      sqlQuery.textContent = data.sql;
+      resultData.innerHTML = '';
+      
+      // Display result data (columnar: {columns, types, rows})
+      if (data.result && Array.isArray(data.result.rows) && data.result.rows.length > 0) {
+        const tbody = createResultTable(data.result.columns, data.result.types);
+        appendResultRows(tbody, data.result.types, data.result.rows);
+      } else {
+        showResultNotice(data.result);
+      }
+      showPreflightNotice(data.preflight);
+      if (data.result_cached) {
+        showCachedNotice(data.result_age);
+      }
+      
+      // Display explanation
+      resultExplanation.textContent = data.explanation;
+      
+      // Add query to recent list
+      addQueryToRecentList(data.query_id, formData.get('query'));
+    } else {
+      // Show error
+      resultContainer.classList.add('d-none');
+      showToast(data.error, 'danger');
+    }
+  }
+  
+  // Render the preview of a preview-first query, then follow the background full run
+  function handlePreviewResponse(data, formData) {
+    loadingIndicator.classList.add('d-none');
+    resultContainer.classList.remove('d-none');
+    sqlQuery.textContent = data.sql;
+    resultData.innerHTML = '';
+    
+    if (data.preview && data.preview.rows.length > 0) {
+      const tbody = createResultTable(data.preview.columns, data.preview.types);
+      appendResultRows(tbody, data.preview.types, data.preview.rows);
+    } else if (data.preview) {
+      showResultNotice(null);
+    }
+    showPreflightNotice(data.preflight);
+    if (data.result_cached) {
+      showCachedNotice(data.result_age);
+    }
+    resultExplanation.textContent = 'Waiting for the full result...';
+    
+    const status = document.createElement('div');
+    status.className = 'alert alert-secondary d-flex align-items-center justify-content-between mb-2';
+    status.innerHTML = `
+      <span><span class="spinner-border spinner-border-sm me-2" role="status"></span><span class="status-text"></span></span>
+      <button type="button" class="btn btn-sm btn-outline-light">Cancel</button>
+    `;
+    const statusText = status.querySelector('.status-text');
+    statusText.textContent = data.preview
+      ? (data.preview_complete ? `These are all ${data.preview.rows.length} rows. Saving the result...`
+                               : `Showing the first ${data.preview.rows.length} rows. Fetching the full result...`)
+      : 'Running the query...';
+    resultData.insertAdjacentElement('afterbegin', status);
+    
+    const cancelBtn = status.querySelector('button');
+    cancelBtn.addEventListener('click', function() {
+      cancelBtn.disabled = true;
+      fetch(data.cancel_url, {
+        method: 'POST',
+        headers: { 'X-CSRFToken': formData.get('csrf_token') }
+      })
+      .then(response => response.json())
+      .then(result => { if (!result.success) showToast(result.error, 'warning'); })
+      .catch(error => showToast('Error cancelling the query: ' + error.message, 'danger'));
+    });
+    
+    // Stage labels of the background full run
+    const stageText = {
+      execute: 'Fetching the full result...',
+      explain: 'Full result fetched. Generating explanation...',
+      save: 'Saving the result...'
+    };
+    // The server ends each stream after a short window; EventSource reconnects
+    // and resumes from the last stage it received
+    const events = new EventSource(data.events_url);
+    events.addEventListener('stage', event => {
+      const entry = JSON.parse(event.data);
+      if (stageText[entry.stage]) statusText.textContent = stageText[entry.stage];
+      if (entry.stage !== 'execute') cancelBtn.remove();
+    });
+    events.addEventListener('done', event => {
+      events.close();
+      finishFullResult(status, JSON.parse(event.data), data, formData);
+    });
+  }
+  
+  // Replace the progress indicator with the outcome of the full run
+  function finishFullResult(status, job, data, formData) {
+    status.innerHTML = '';
+    if (job.status === 'cancelled') {
+      status.className = 'alert alert-warning mb-2';
+      status.textContent = data.preview ? 'The full query was cancelled; only the preview is shown.'
+                                        : 'The query was cancelled.';
+      resultExplanation.textContent = '';
+      return;
+    }
+    if (job.status !== 'succeeded') {
+      status.className = 'alert alert-danger mb-2';
+      status.textContent = (job.error && job.error.error) || 'The full query failed.';
+      resultExplanation.textContent = '';
+      return;
+    }
+    
+    resultExplanation.textContent = job.explanation;
+    addQueryToRecentList(job.query_id, formData.get('query'));
+    if (!data.preview) {
+      // No preview (a write, SHOW or EXPLAIN): show the stored result itself
+      status.remove();
+      fetch(job.result_url)
+        .then(response => response.json())
+        .then(result => {
+          if (result.rows && result.rows.length > 0) {
+            const tbody = createResultTable(result.columns, null);
+            appendResultRows(tbody, null, result.rows);
+          } else {
+            showResultNotice(result.summary);
+          }
+        })
+        .catch(error => showToast('Error loading the result: ' + error.message, 'danger'));
+      return;
+    }
+    
+    const rows = job.row_count.toLocaleString();
+    if (job.truncated) {
+      status.className = 'alert alert-warning mb-2';
+      status.textContent = `Truncated: the full result was cut off at the ${job.max_rows.toLocaleString()} row limit. `;
+    } else {
+      status.className = 'alert alert-success mb-2';
+      status.textContent = `Complete: ${rows} row${job.row_count === 1 ? '' : 's'} in total. `;
+    }
+    if (job.row_count > data.preview.rows.length) {
+      const link = document.createElement('a');
+      link.href = job.detail_url;
+      link.textContent = `View all ${rows} rows`;
+      status.appendChild(link);
+    }
+  }
+  
+  // State of the result table currently being streamed
+  let streamState = null;
+  
+  // Render one event of a streamed (NDJSON) response
+  function handleStreamEvent(event, formData) {
+    switch (event.type) {
+      case 'sql':
+        loadingIndicator.classList.add('d-none');
+        resultContainer.classList.remove('d-none');
+        sqlQuery.textContent = event.sql;
+        resultData.innerHTML = '';
+        resultExplanation.textContent = 'Generating explanation...';
+        streamState = { types: null, tbody: null, explaining: false, preflight: event.preflight };
+        break;
+      case 'columns':
+        streamState.types = event.types;
+        streamState.tbody = createResultTable(event.columns, event.types);
+        showPreflightNotice(streamState.preflight);
+        break;
+      case 'rows':
+        appendResultRows(streamState.tbody, streamState.types, event.rows);
+        break;
+      case 'complete':
+        if (event.result !== undefined || event.row_count === 0) {
+          showResultNotice(event.result);
+        } else if (event.truncated) {
+          resultData.insertAdjacentHTML('beforeend', `<div class="alert alert-warning mt-2">
+            <i class="bi bi-exclamation-triangle me-2"></i>
+            Showing the first ${event.row_count} rows. The result was cut off at the ${event.max_rows} row limit.
+          </div>`);
+        }
+        if (event.result_cached) {
+          showCachedNotice(event.result_age);
+        }
+        break;
+      case 'explanation_delta':
+        // Render the explanation incrementally as fragments arrive
+        if (!streamState.explaining) {
+          streamState.explaining = true;
+          resultExplanation.textContent = '';
+        }
+        resultExplanation.textContent += event.text;
+        break;
+      case 'explanation':
+        resultExplanation.textContent = event.explanation;
+        addQueryToRecentList(event.query_id, formData.get('query'));
+        break;
+      case 'error':
+        loadingIndicator.classList.add('d-none');
+        resultContainer.classList.add('d-none');
+        showToast(event.error, 'danger');
+        break;
+    }
+  }
+  
+  // Read a newline-delimited JSON response, calling onEvent for each line as it arrives
+  function readEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    function pump() {
+      return reader.read().then(({ done, value }) => {
+        buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+        const lines = buffer.split('\n');
+        buffer = done ? '' : lines.pop();
+        lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+        if (!done) return pump();
+      });
+    }
+    
+    return pump();
+  }
+  
+  // Column types whose values are right-aligned
+  const NUMERIC_TYPES = new Set(['integer', 'number']);
+  
+  // Create an empty result table with the given columns and return its body
+  function createResultTable(columns, types) {
+    const table = document.createElement('table');
+    table.className = 'table table-dark table-striped table-hover';
+    
+    // Create table header
+    const thead = document.createElement('thead');
+    const headerRow = document.createElement('tr');
+    columns.forEach((column, index) => {
+      const th = document.createElement('th');
+      th.textContent = column;
+      if (types && NUMERIC_TYPES.has(types[index])) {
+        th.className = 'text-end';
+      }
+      headerRow.appendChild(th);
+    });
+    thead.appendChild(headerRow);
+    table.appendChild(thead);
+    
+    // Create table body
+    const tbody = document.createElement('tbody');
+    table.appendChild(tbody);
+    
+    // Add responsive wrapper
+    const tableResponsive = document.createElement('div');
+    tableResponsive.className = 'table-responsive';
+    tableResponsive.appendChild(table);
+    
+    // Clear previous results and add new table
+    resultData.innerHTML = '';
+    resultData.appendChild(tableResponsive);
+    return tbody;
+  }
+  
+  // Append data rows (arrays in column order) to a result table body
+  function appendResultRows(tbody, types, rows) {
+    const numeric = (types || []).map(type => NUMERIC_TYPES.has(type));
+    const fragment = document.createDocumentFragment();
+    rows.forEach(row => {
+      const tr = document.createElement('tr');
+      
+      row.forEach((value, index) => {
+        const td = document.createElement('td');
+        if (value === null) {
+          td.textContent = 'NULL';
+        } else {
+          // JSON columns arrive as objects
+          td.textContent = typeof value === 'object' ? JSON.stringify(value) : value;
+        }
+        if (numeric[index]) {
+          td.className = 'text-end';
+        }
+        tr.appendChild(td);
+      });
+      
+      fragment.appendChild(tr);
+    });
+    tbody.appendChild(fragment);
+  }
+  
+  // Show the affected-row count of a write, or a notice that a read returned nothing
+  function showResultNotice(result) {
+    if (result && result.affected_rows !== undefined) {
+      // Display affected rows for non-SELECT queries
+      resultData.innerHTML = `<div class="alert alert-info">
+        <i class="bi bi-info-circle me-2"></i>
+        Query executed successfully. ${result.affected_rows} rows affected.
+      </div>`;
+    } else {
+      // No results
+      resultData.innerHTML = `<div class="alert alert-warning">
+        <i class="bi bi-exclamation-triangle me-2"></i>
+        Query executed successfully, but returned no results.
+      </div>`;
+    }
+  }
+  
+  // Explain that the pre-flight check capped an expensive query with a LIMIT
+  function showPreflightNotice(preflight) {
+    if (!preflight || !preflight.limited) return;
+    resultData.insertAdjacentHTML('afterbegin', `<div class="alert alert-warning mb-2">
+      <i class="bi bi-speedometer2 me-2"></i>
+      The database estimated about ${preflight.original.rows.toLocaleString()} rows for this query,
+      so it was limited to ${preflight.limit.toLocaleString()} rows.
+    </div>`);
+  }
+  
+  // Note that the rows shown were served from the result cache
+  function showCachedNotice(age) {
+    resultData.insertAdjacentHTML('afterbegin', `<div class="text-muted small mb-2">
+      <i class="bi bi-clock-history me-1"></i>
+      Cached result from ${Math.round(age)}s ago. Tick the regenerate option to re-run it.
+    </div>`);
+  }
+  
   // Copy SQL button handler
   if (copySqlBtn) {
     copySqlBtn.addEventListener('click', function() {
@@ -133,6 +388,34 @@ document.addEventListener('DOMContentLoaded', function() {
     });
   }
   
+  // Refresh schema button handler
+  if (refreshSchemaBtn) {
+    refreshSchemaBtn.addEventListener('click', function() {
+      const csrfToken = new FormData(queryForm).get('csrf_token');
+      refreshSchemaBtn.disabled = true;
+      
+      fetch(refreshSchemaBtn.dataset.url, {
+        method: 'POST',
+        headers: {
+          'X-CSRFToken': csrfToken
+        }
+      })
+      .then(response => response.json())
+      .then(data => {
+        refreshSchemaBtn.disabled = false;
+        if (data.success) {
+          showToast(data.message);
+        } else {
+          showToast(data.error, 'danger');
+        }
+      })
+      .catch(error => {
+        refreshSchemaBtn.disabled = false;
+        showToast('Error refreshing schema: ' + error.message, 'danger');
+      });
+    });
+  }
+  
   // Function to add a query to the recent list
   function addQueryToRecentList(queryId, queryText) {
     const recentQueries = document.getElementById('recentQueries');
@@ -170,4 +453,72 @@ document.addEventListener('DOMContentLoaded', function() {
       recentQueries.removeChild(recentQueries.lastChild);
     }
   }
+  
+  // Query history: older pages are fetched from the JSON history endpoint
+  const historyMore = document.getElementById('historyMore');
+  let historyLoading = false;
+  
+  function loadMoreHistory() {
+    if (!historyMore || historyLoading || !historyMore.dataset.cursor) return;
+    historyLoading = true;
+    
+    const url = `${historyMore.dataset.url}?before=${encodeURIComponent(historyMore.dataset.cursor)}`;
+    fetch(url)
+      .then(response => response.json())
+      .then(data => {
+        if (!data.success) {
+          showToast(data.error, 'danger');
+          return;
+        }
+        const previousQueries = document.getElementById('previousQueries');
+        data.queries.forEach(query => previousQueries.appendChild(createHistoryCard(query)));
+        historyMore.dataset.cursor = data.next_cursor || '';
+        if (!data.next_cursor) {
+          historyMore.remove();
+        }
+      })
+      .catch(error => showToast('Error loading history: ' + error.message, 'danger'))
+      .finally(() => { historyLoading = false; });
+  }
+  
+  // Build a history card matching the server-rendered ones
+  function createHistoryCard(query) {
+    const card = document.createElement('div');
+    card.className = 'card mb-4 bg-dark border-secondary';
+    card.id = `query-${query.id}`;
+    card.innerHTML = `
+      <div class="card-header d-flex justify-content-between align-items-center border-secondary">
+        <h5 class="mb-0"></h5>
+      </div>
+      <div class="card-body">
+        <p><strong>Question:</strong> <span class="history-question"></span></p>
+        <div class="mb-3">
+          <h6>SQL Query:</h6>
+          <pre class="bg-dark border-0 text-light p-0"><code class="text-success"></code></pre>
+        </div>
+        <a>View result and explanation</a>
+      </div>
+    `;
+    card.querySelector('h5').textContent = 'Query from ' + new Date(query.created_at + 'Z').toLocaleString();
+    card.querySelector('.history-question').textContent = query.natural_language;
+    card.querySelector('code').textContent = query.sql_query || '';
+    card.querySelector('a').href = query.detail_url;
+    if (query.result_row_count !== null) {
+      const badge = document.createElement('div');
+      badge.className = 'badge bg-secondary';
+      badge.textContent = `${query.result_row_count} rows`;
+      card.querySelector('.card-header').appendChild(badge);
+    }
+    return card;
+  }
+  
+  if (historyMore) {
+    document.getElementById('loadMoreHistory').addEventListener('click', loadMoreHistory);
+    // Load the next page automatically when the end of the list scrolls into view
+    if ('IntersectionObserver' in window) {
+      new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) loadMoreHistory();
+      }).observe(historyMore);
+    }
+  }
 });
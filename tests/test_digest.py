@@ -0,0 +1,27 @@
+import datetime
+from decimal import Decimal
+from digest import ResultDigest
+
+def _describe(rows, *batches):
+    digest = ResultDigest(['a'])
+    for batch in (rows,) + batches:
+        digest.add_rows(batch)
+    return digest.stats[0].describe(digest.row_count)
+
+def test_mixed_floats_and_decimals():
+    line = _describe([(1.5,), (Decimal('2.5'),)])
+    assert 'min=1.5' in line and 'max=2.5' in line and 'mean=2' in line
+
+def test_mixed_dates_and_datetimes():
+    line = _describe([(datetime.date(2024, 1, 2),), (datetime.datetime(2024, 1, 1, 12, 0),)])
+    assert 'min=2024-01-01 12:00:00' in line and 'max=2024-01-02' in line
+
+def test_naive_and_aware_datetimes():
+    aware = datetime.datetime(2024, 1, 3, tzinfo=datetime.timezone.utc)
+    line = _describe([(datetime.datetime(2024, 1, 1),), (aware,)])
+    assert 'min=2024-01-01 00:00:00' in line
+
+def test_kind_changing_between_batches():
+    line = _describe([('n/a',), (3,)], [(1,), (Decimal('7.25'),)])
+    assert line.startswith('  - a (number)')
+    assert 'min=1' in line and 'max=7.25' in line
@@ -0,0 +1,40 @@
+import io
+import datetime
+from decimal import Decimal
+import pytest
+from export import export_rows
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet
+
+class _Stream:
+    def __init__(self, columns, batches, types=None, type_codes=None):
+        self.columns = columns
+        self.types = types
+        self.type_codes = type_codes
+        self._batches = batches
+
+    def __iter__(self):
+        return iter(self._batches)
+
+def _parquet(stream):
+    return pyarrow.parquet.read_table(io.BytesIO(b''.join(export_rows(stream, 'parquet'))))
+
+def test_schema_follows_column_types():
+    stream = _Stream(['n', 'amount', 'at'], [[(1, Decimal('1.5'), datetime.datetime(2024, 1, 1))],
+                                            [(2, Decimal('12345678901234567890123456789012.25'), None)]],
+                     ['integer', 'number', 'datetime'], [23, 1700, 1114])
+    table = _parquet(stream)
+    assert table.schema.field('n').type == pa.int64()
+    assert pa.types.is_decimal(table.schema.field('amount').type)
+    assert table.column('amount').to_pylist()[1] == Decimal('12345678901234567890123456789012.25')
+
+def test_float_column_keeps_fractions():
+    stream = _Stream(['x'], [[(1.0,)], [(2.5,)]], ['number'], [701])
+    assert _parquet(stream).column('x').to_pylist() == [1.0, 2.5]
+
+def test_value_that_does_not_fit_fails_loudly():
+    # A stored result has no types: the first batch decides, and 2.5 can't become an integer
+    stream = _Stream(['x'], [[(1,)], [(2.5,)]])
+    with pytest.raises(pa.ArrowInvalid):
+        _parquet(stream)
@@ -0,0 +1,56 @@
+import pytest
+import preflight
+from preflight import inject_limit
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT * FROM t", "SELECT * FROM t LIMIT 1000"),
+    ("SELECT * FROM t; ", "SELECT * FROM t LIMIT 1000"),
+    ("SELECT * FROM t -- all rows", "SELECT * FROM t LIMIT 1000"),
+    ("SELECT * FROM t /* everything */;", "SELECT * FROM t LIMIT 1000"),
+    ("SELECT * FROM t LIMIT 10", "SELECT * FROM t LIMIT 10"),
+    ("SELECT * FROM t LIMIT 5000", "SELECT * FROM t LIMIT 1000"),
+    ("SELECT * FROM t LIMIT 5000 OFFSET 20", "SELECT * FROM t LIMIT 1000 OFFSET 20"),
+    ("SELECT * FROM t LIMIT 20, 5000", "SELECT * FROM t LIMIT 20, 1000"),
+    ("SELECT * FROM t LIMIT ALL", "SELECT * FROM t LIMIT 1000"),
+    ("SELECT * FROM t LIMIT ALL OFFSET 3", "SELECT * FROM t LIMIT 1000 OFFSET 3"),
+    ("SELECT * FROM t FETCH FIRST 5000 ROWS ONLY", "SELECT * FROM t FETCH FIRST 1000 ROWS ONLY"),
+    ("SELECT * FROM t OFFSET 2 ROWS FETCH NEXT 10 ROWS ONLY", "SELECT * FROM t OFFSET 2 ROWS FETCH NEXT 10 ROWS ONLY"),
+    ("SELECT * FROM t FETCH FIRST ROW ONLY", "SELECT * FROM t FETCH FIRST ROW ONLY"),
+    ("SELECT * FROM (SELECT * FROM t LIMIT 5) s", "SELECT * FROM (SELECT * FROM t LIMIT 5) s LIMIT 1000"),
+    ("SELECT * FROM t LIMIT %s", "SELECT * FROM (SELECT * FROM t LIMIT %s) AS limited LIMIT 1000"),
+])
+def test_inject_limit(sql, expected):
+    assert inject_limit(sql, 1000) == expected
+
+class _MySQLConnection:
+    is_mysql = True
+    is_postgresql = False
+    db_type = 'mysql'
+    max_estimated_rows = 1000000
+    max_estimated_cost = None
+    preflight_action = 'limit'
+    preflight_limit = 1000
+
+@pytest.fixture
+def big_estimate(monkeypatch):
+    monkeypatch.setattr(preflight, 'explain_query', lambda connection, sql: {'rows': 5000000, 'cost': None})
+
+def test_mysql_limits_plain_select(big_estimate):
+    sql, report = preflight.preflight_query(_MySQLConnection(), "SELECT * FROM big WHERE x = 1")
+    assert sql == "SELECT * FROM big WHERE x = 1 LIMIT 1000"
+    assert report['limited']
+
+def test_mysql_keeps_existing_small_limit(big_estimate):
+    sql, report = preflight.preflight_query(_MySQLConnection(), "SELECT * FROM big LIMIT 10")
+    assert sql == "SELECT * FROM big LIMIT 10"
+    assert not report['limited']
+
+@pytest.mark.parametrize('sql', [
+    "SELECT COUNT(*) FROM a CROSS JOIN b",
+    "SELECT x, SUM(y) FROM big GROUP BY x",
+    "SELECT * FROM big ORDER BY created_at",
+    "SELECT DISTINCT x FROM big",
+])
+def test_mysql_rejects_when_limit_does_not_reduce_work(big_estimate, sql):
+    with pytest.raises(preflight.PreflightRejected):
+        preflight.preflight_query(_MySQLConnection(), sql)
@@ -0,0 +1,48 @@
+import threading
+import pytest
+from scheduler import ExecutionScheduler, ExecutionBusy
+
+class _Connection:
+    db_type = 'postgresql'
+    host = 'db.internal'
+    port = 5432
+    database_name = 'shop'
+
+    def __init__(self, conn_id, user_id, max_concurrent_queries=None, max_user_queries=None):
+        self.id = conn_id
+        self.user_id = user_id
+        self.max_concurrent_queries = max_concurrent_queries
+        self.max_user_queries = max_user_queries
+
+def test_strictest_limit_applies_to_shared_database():
+    execution = ExecutionScheduler()
+    limited = _Connection(1, user_id=1, max_concurrent_queries=2)
+    unlimited = _Connection(2, user_id=2, max_concurrent_queries=0, max_user_queries=0)
+    tokens = [execution.acquire(limited)]
+    tokens.append(execution.acquire(unlimited))
+    # The unlimited connection's owner can't go past the cap the other connection set
+    with pytest.raises(ExecutionBusy):
+        execution.acquire(unlimited, timeout=0.05)
+    for token in tokens:
+        execution.release(token)
+
+def test_forgotten_connection_no_longer_limits():
+    execution = ExecutionScheduler()
+    execution.release(execution.acquire(_Connection(1, user_id=1, max_concurrent_queries=1)))
+    execution.forget(1)
+    other = _Connection(2, user_id=2, max_concurrent_queries=3, max_user_queries=0)
+    tokens = [execution.acquire(other, timeout=0.05) for _ in range(3)]
+    for token in tokens:
+        execution.release(token)
+
+def test_freed_slot_goes_to_waiter():
+    execution = ExecutionScheduler()
+    connection = _Connection(1, user_id=1, max_concurrent_queries=1)
+    token = execution.acquire(connection)
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(execution.acquire(_Connection(1, user_id=2), timeout=5)))
+    waiter.start()
+    execution.release(token)
+    waiter.join()
+    execution.release(acquired[0])
+    assert execution.stats(connection) == {'running': 0, 'waiting': 0}
@@ -0,0 +1,33 @@
+import pytest
+from sql_validation import validate_sql
+
+SCHEMA = {
+    'orders': [{'Field': 'id'}, {'Field': 'total'}, {'Field': 'user_id'}],
+    'users': [{'Field': 'id'}, {'Field': 'name'}],
+}
+
+@pytest.mark.parametrize('sql, db_type', [
+    ("INSERT INTO orders (id, total) VALUES (1, 2) ON CONFLICT (id) DO UPDATE SET total = EXCLUDED.total",
+     'postgresql'),
+    ("INSERT INTO orders (id, total) VALUES (1, 2) ON DUPLICATE KEY UPDATE total = 3", 'mysql'),
+    ("SELECT * FROM orders o WHERE o.id = 1 FOR UPDATE NOWAIT", 'postgresql'),
+    ("SELECT * FROM orders o WHERE o.id = 1 FOR UPDATE SKIP LOCKED", 'postgresql'),
+    ("SELECT * FROM orders o JOIN users u ON u.id = o.user_id FOR UPDATE OF o", 'postgresql'),
+    ("SELECT o.id FROM orders o JOIN users u ON u.id = o.user_id WHERE u.name IS DISTINCT FROM o.total",
+     'postgresql'),
+    ("SELECT o.id FROM orders o JOIN users u ON u.id = o.user_id WHERE u.name IS NOT DISTINCT FROM o.total",
+     'postgresql'),
+    ("UPDATE orders SET total = 0 WHERE id = 1", 'mysql'),
+    ("WITH t AS (SELECT id FROM orders) UPDATE orders SET total = 0 WHERE id IN (SELECT id FROM t)", 'postgresql'),
+])
+def test_valid_statements_pass(sql, db_type):
+    validate_sql(sql, SCHEMA, db_type)
+
+@pytest.mark.parametrize('sql, message', [
+    ("UPDATE nope SET total = 0", "Unknown table 'nope'"),
+    ("WITH t AS (SELECT 1) UPDATE nope SET total = 0", "Unknown table 'nope'"),
+    ("SELECT * FROM orders o WHERE o.id IS DISTINCT FROM (SELECT id FROM nope)", "Unknown table 'nope'"),
+])
+def test_unknown_tables_are_rejected(sql, message):
+    with pytest.raises(ValueError, match=message):
+        validate_sql(sql, SCHEMA, 'postgresql')